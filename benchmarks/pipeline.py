@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the display pipeline of vini.
+
+Measures loading per file format, resampling (also by thread count),
+slicing, colour mapping, rendering of the image items and the viewer
+operations built on them (frame changes, crosshair moves, mosaic refresh
+and export). By default
+synthetic volumes are written to a temporary directory in all formats; with
+-i the given images are used instead. Run from the repository root:
+
+    python benchmarks/pipeline.py [--shape 128 128 80] [--frames 60]
+        [-n 10] [-i image.nii ...] [-k slice] [--json out.json]
+        [--compare old.json]
+
+Every benchmark is run n times after one warm-up call, the minimum, median
+and mean wall time are reported. Qt can be run without a display by setting
+QT_QPA_PLATFORM=offscreen.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import nibabel as nib
+
+from vini.pyqtgraph_vini.Qt import QtCore, QtGui
+
+# formats written for the synthetic volumes
+FORMATS = ['.nii', '.nii.gz', '.v', '.npy']
+
+VISTA_REPN = {
+    np.dtype(np.uint8): 'ubyte', np.dtype(np.int16): 'short',
+    np.dtype(np.int32): 'int', np.dtype(np.int64): 'long',
+    np.dtype(np.float32): 'float', np.dtype(np.float64): 'double',
+}
+
+
+## Section: Data ##
+def syntheticVolume(shape, frames=0, seed=0):
+    """
+    Returns a float32 volume with a smooth ellipsoid, a few blobs and noise,
+    roughly the value distribution of an MR image. With frames > 0 a 4D
+    time series with a slow signal change is returned.
+    """
+    rng = np.random.RandomState(seed)
+    grid = np.meshgrid(*[np.linspace(-1, 1, n) for n in shape],
+                       indexing='ij')
+    radius = np.sqrt(sum(g**2 for g in grid))
+    volume = 800. / (1 + np.exp((radius - 0.8) * 20))
+    for _ in range(5):
+        center = rng.uniform(-0.5, 0.5, 3)
+        volume += 300. * np.exp(
+            -sum((g - c)**2 for g, c in zip(grid, center)) / 0.02)
+    volume = volume.astype(np.float32)
+    if frames == 0:
+        return volume + rng.normal(0, 20, shape).astype(np.float32)
+    series = np.empty(tuple(shape) + (frames,), dtype=np.float32)
+    for t in range(frames):
+        series[..., t] = volume * (1 + 0.02*np.sin(2*np.pi*t/20.)) + \
+            rng.normal(0, 20, shape).astype(np.float32)
+    return series
+
+
+def syntheticAffine(zooms, oblique=0.):
+    """
+    Returns an affine with voxel size 'zooms' rotated by 'oblique' degrees
+    around the z axis.
+    """
+    angle = np.deg2rad(oblique)
+    rotation = np.array([[np.cos(angle), -np.sin(angle), 0],
+                         [np.sin(angle), np.cos(angle), 0],
+                         [0, 0, 1]])
+    affine = np.eye(4)
+    affine[:3, :3] = np.dot(rotation, np.diag(zooms))
+    return affine
+
+
+def writeVista(filename, data, zooms, repetition_time=0):
+    """
+    Writes a volume in lipsia's vista format as read by VistaLoad: 3D images
+    as one image with the slices as bands, 4D images as one image per slice
+    with the frames as bands. Data is stored big-endian.
+    """
+    data = np.asarray(data)
+    if data.ndim == 3:
+        # (x, y, z) -> bands z, rows y, columns x
+        blocks = [np.transpose(data, (2, 1, 0))]
+    else:
+        # (x, y, z, t) -> one image per z: bands t, rows y, columns x
+        blocks = [np.transpose(data[:, :, z, :], (2, 1, 0))
+                  for z in range(data.shape[2])]
+    repn = VISTA_REPN[data.dtype]
+    voxel = ' '.join('%g' % z for z in zooms[:3])
+    header = ['V-data 2 {']
+    offset = 0
+    for block in blocks:
+        length = block.size * block.itemsize
+        header += [
+            '\timage: image {',
+            '\t\tdata: %d' % offset,
+            '\t\tlength: %d' % length,
+            '\t\tnbands: %d' % block.shape[0],
+            '\t\tnrows: %d' % block.shape[1],
+            '\t\tncolumns: %d' % block.shape[2],
+            '\t\trepn: %s' % repn,
+            '\t\tvoxel: "%s"' % voxel,
+        ]
+        if repetition_time > 0:
+            header.append('\t\trepetition_time: %g' % repetition_time)
+        header.append('\t}')
+        offset += length
+    header.append('}')
+    with open(filename, 'wb') as f:
+        f.write(('\n'.join(header) + '\n\x0c\n').encode('utf-8'))
+        for block in blocks:
+            f.write(np.ascontiguousarray(block).astype(
+                block.dtype.newbyteorder('>')).tobytes())
+
+
+def writeSynthetic(directory, name, data, affine):
+    """
+    Writes 'data' in all FORMATS and returns the filenames.
+    """
+    zooms = np.sqrt((affine[:3, :3]**2).sum(axis=0))
+    filenames = []
+    for extension in FORMATS:
+        filename = os.path.join(directory, name + extension)
+        if extension == '.v':
+            writeVista(filename, data, zooms,
+                       repetition_time=2000 if data.ndim == 4 else 0)
+        elif extension == '.npy':
+            np.save(filename, data)
+        else:
+            image = nib.Nifti1Image(data, affine)
+            if data.ndim == 4:
+                image.header.set_zooms(tuple(zooms) + (2.,))
+            image.to_filename(filename)
+        filenames.append(filename)
+    return filenames
+
+
+## Section: Timing ##
+def measure(function, repeat, setup=None):
+    """
+    Calls 'function' once to warm up and then 'repeat' times. 'setup' is
+    called untimed before each call. Returns the wall times in seconds.
+    """
+    times = []
+    for i in range(repeat + 1):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if i > 0:
+            times.append(elapsed)
+    return times
+
+
+def summary(times):
+    times = sorted(times)
+    return {
+        'min': times[0],
+        'median': times[len(times) // 2],
+        'mean': sum(times) / len(times),
+        'max': times[-1],
+        'runs': len(times),
+    }
+
+
+class Suite(object):
+    """
+    Collects the results of the benchmarks matching the keyword filter.
+    """
+
+    def __init__(self, repeat, keywords=None):
+        self.repeat = repeat
+        self.keywords = keywords or []
+        self.results = []
+
+    def selected(self, name):
+        return (len(self.keywords) == 0 or
+                any(k in name for k in self.keywords))
+
+    def run(self, name, function, setup=None, repeat=None, **info):
+        """
+        Measures 'function' and returns the result, None if not selected.
+        """
+        if not self.selected(name):
+            return None
+        result = summary(measure(function, repeat or self.repeat, setup))
+        result['name'] = name
+        result.update(info)
+        self.results.append(result)
+        print("%-48s %9.2f ms %9.2f ms %9.2f ms" % (
+            name, 1e3*result['min'], 1e3*result['median'],
+            1e3*result['mean']))
+        sys.stdout.flush()
+        return result
+
+
+## Section: Benchmarks ##
+def benchLoading(suite, filename, label, preferences):
+    """
+    Loading a file into an Image (reading, NaN handling, resampling to its
+    own grid and the first slice).
+    """
+    from vini.loadImage import loadImageFromFile
+    def load():
+        loadImageFromFile(filename, preferences, 0)
+    suite.run('load[%s]' % label, load, file=filename,
+              size=os.path.getsize(filename))
+
+
+def benchPipeline(suite, app, filename, label):
+    """
+    Opens 'filename' in a viewer and measures the pipeline stages and viewer
+    operations on it.
+    """
+    from vini.viewer import Viff
+    from vini.resample import resample_image
+    from vini.ImageItemMod import ImageItemMod
+    from vini.pyqtgraph_vini.functions import mymakeARGB
+
+    viewer = Viff()
+    viewer.resize(1200, 800)
+    viewer.loadImagesFromFiles([filename], [0])
+    viewer.show()
+    app.processEvents()
+    img = viewer.images[0]
+    shape = img.image_res.shape
+    info = {'file': filename, 'shape': list(img.image.shape)}
+
+    def name(stage):
+        return '%s[%s]' % (stage, label)
+
+    # stages of the pipeline
+    data = img.image.get_fdata()
+    if data.ndim == 4:
+        data = data[..., 0]
+    for interpolation, method in [(0, 'nearest'), (1, 'trilinear')]:
+        suite.run(name('resample_image.%s' % method), lambda: resample_image(
+            data, img.affine_res_inv, img.res_shape, interpolation), **info)
+
+    # an oblique grid is interpolated in slabs by 1, 2, 4, ... threads
+    angle = np.radians(10.)
+    oblique = np.array(img.affine_res_inv, dtype=float)
+    oblique[:3, :3] = np.dot(oblique[:3, :3], [
+        [np.cos(angle), -np.sin(angle), 0.],
+        [np.sin(angle), np.cos(angle), 0.],
+        [0., 0., 1.]])
+    serial = None
+    for workers in [n for n in (1, 2, 4, 8)
+                    if n <= max(2, os.cpu_count() or 1)]:
+        result = suite.run(
+            name('resample_image.oblique.threads%d' % workers),
+            lambda: resample_image(data, oblique, img.res_shape, 1,
+                                   workers=workers),
+            workers=workers, **info)
+        if result is None:
+            continue
+        if serial is None:
+            serial = result['median']
+        result['speedup'] = serial / result['median']
+        if workers > 1:
+            print("%-48s %9.2fx" % ('  speedup with %d threads' % workers,
+                                    result['speedup']))
+
+    # every call slices at a new position so nothing is cached
+    positions = [[(i*7) % n for n in shape] for i in range(11)]
+    position = iter(positions * (suite.repeat + 1))
+    suite.run(name('Image.slice'), lambda: img.slice(next(position)),
+              **info)
+
+    plane = np.asarray(img.image_res[:, :, shape[2] // 2], dtype=float)
+    suite.run(name('mymakeARGB'), lambda: mymakeARGB(
+        plane, lut=img.cmap_pos, levels=list(img.threshold_pos),
+        useRGBA=True), **info)
+
+    item = ImageItemMod()
+    item.setImage(img.image_slices[2])
+    def clearImage():
+        item.qimage = None
+    suite.run(name('ImageItem.render'), item.render, setup=clearImage,
+              **info)
+
+    # viewer operations, each followed by the event processing that paints
+    # the views
+    def crosshair():
+        viewer.img_coord = next(position)
+        viewer.setCrosshair()
+        app.processEvents()
+    position = iter(positions * (suite.repeat + 1))
+    suite.run(name('Viff.crosshair'), crosshair, **info)
+
+    if img.type_d() == '4D':
+        frames = img.getTimeDim()
+        frame = iter(list(range(1, frames)) * (suite.repeat + 1))
+        def setFrame():
+            viewer.frame = next(frame)
+            viewer.setFrame()
+            app.processEvents()
+        suite.run(name('Viff.setFrame'), setFrame, **info)
+
+    if suite.selected(name('Viff.refreshMosaicView')):
+        viewer.mosaic_dialog.setDims(viewer.img_dims)
+        def openMosaic():
+            if viewer.mosaic_view is not None:
+                viewer.mosaic_view.close()
+            viewer.openMosaicView()
+            viewer.mosaic_active = True
+        def refreshMosaic():
+            viewer.refreshMosaicView()
+            app.processEvents()
+        viewer.mosaic_view = None
+        suite.run(name('Viff.refreshMosaicView'), refreshMosaic,
+                  setup=openMosaic, **info)
+        viewer.mosaic_view.close()
+        viewer.mosaic_active = False
+
+    if suite.selected(name('Viff.export')):
+        import matplotlib
+        matplotlib.use('Agg')
+        from matplotlib import pyplot
+        directory = tempfile.mkdtemp(prefix='vini_export_')
+        # export asks for the filename
+        get_save_filename = QtGui.QFileDialog.getSaveFileName
+        QtGui.QFileDialog.getSaveFileName = staticmethod(
+            lambda *args, **kwargs: (os.path.join(directory, 'view.png'), ''))
+        try:
+            suite.run(name('Viff.export'), viewer.export,
+                      setup=lambda: pyplot.close('all'),
+                      repeat=max(1, suite.repeat // 5), **info)
+        finally:
+            QtGui.QFileDialog.getSaveFileName = get_save_filename
+            pyplot.close('all')
+            shutil.rmtree(directory, ignore_errors=True)
+
+    viewer.hide()
+
+
+def environment():
+    import scipy
+    from vini.pyqtgraph_vini.Qt import QT_LIB
+    return {
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'nibabel': nib.__version__,
+        'qt': QT_LIB + ' ' + QtCore.QT_VERSION_STR,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'qpa': os.environ.get('QT_QPA_PLATFORM', ''),
+    }
+
+
+def compare(results, filename):
+    """
+    Prints the median of each benchmark relative to an earlier run.
+    """
+    with open(filename) as f:
+        earlier = dict((r['name'], r) for r in json.load(f)['results'])
+    print("\n%-48s %12s %12s %8s" % ('compared to ' + filename, 'before',
+                                      'now', 'ratio'))
+    for result in results:
+        if result['name'] in earlier:
+            before = earlier[result['name']]['median']
+            print("%-48s %9.2f ms %9.2f ms %7.2fx" % (
+                result['name'], 1e3*before, 1e3*result['median'],
+                result['median'] / before))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='vini pipeline benchmarks')
+    parser.add_argument('--shape', type=int, nargs=3, default=[128, 128, 80],
+                        help='shape of the synthetic volumes')
+    parser.add_argument('--zooms', type=float, nargs=3, default=[2., 2., 2.],
+                        help='voxel size of the synthetic volumes')
+    parser.add_argument('--oblique', type=float, default=0.,
+                        help='rotation of the synthetic volumes in degrees')
+    parser.add_argument('--frames', type=int, default=60,
+                        help='frames of the synthetic 4D volume, 0 for none')
+    parser.add_argument('-i', '--input', nargs='+', default=None,
+                        help='images to benchmark instead of synthetic ones')
+    parser.add_argument('-n', '--repeat', type=int, default=10,
+                        help='timed runs per benchmark')
+    parser.add_argument('-k', '--keyword', action='append', default=None,
+                        help='only run benchmarks whose name contains this '
+                        '(can be given several times)')
+    parser.add_argument('--json', default=None,
+                        help='write the results to this file')
+    parser.add_argument('--compare', default=None,
+                        help='results of an earlier run (--json) to compare '
+                        'the medians with')
+    args = parser.parse_args()
+
+    app = QtGui.QApplication([])
+    suite = Suite(args.repeat, args.keyword)
+    directory = None
+    datasets = []
+    if args.input is not None:
+        for filename in args.input:
+            datasets.append((os.path.basename(filename), [filename]))
+    else:
+        directory = tempfile.mkdtemp(prefix='vini_bench_')
+        affine = syntheticAffine(args.zooms, args.oblique)
+        datasets.append(('3d', writeSynthetic(
+            directory, 'synthetic3d', syntheticVolume(args.shape), affine)))
+        if args.frames > 0:
+            datasets.append(('4d', writeSynthetic(
+                directory, 'synthetic4d',
+                syntheticVolume(args.shape, args.frames), affine)))
+
+    from vini.viewer import Viff
+    preferences = Viff().preferences
+
+    print("%-48s %12s %12s %12s" % ('benchmark', 'min', 'median', 'mean'))
+    try:
+        for label, filenames in datasets:
+            for filename in filenames:
+                extension = os.path.basename(filename).split('.', 1)[-1]
+                benchLoading(suite, filename, '%s.%s' % (label, extension)
+                             if args.input is None else label, preferences)
+            benchPipeline(suite, app, filenames[0], label)
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if args.compare is not None:
+        compare(suite.results, args.compare)
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'environment': environment(),
+                'parameters': {
+                    'shape': args.shape, 'zooms': args.zooms,
+                    'oblique': args.oblique, 'frames': args.frames,
+                    'input': args.input, 'repeat': args.repeat,
+                },
+                'results': suite.results,
+            }, f, indent=2)
+    sys.stdout.flush()
+    # skip the interpreter teardown, Qt may crash while destroying the scene
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Start-up benchmark of vini.
+
+Measures the import time of vini.viewer (sum of the self times reported by
+python -X importtime) and the time from process start to the first paint of
+the main window with an image loaded. Each measurement runs in a fresh
+interpreter. Run from the repository root:
+
+    python benchmarks/startup.py [-n 5] [-i image.nii] [--json out.json]
+
+Without -i a small synthetic volume is shown. Qt can be run without a
+display by setting QT_QPA_PLATFORM=offscreen.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that are only needed for optional features and should not be
+# imported at start-up
+OPTIONAL_MODULES = [
+    'matplotlib', 'pkg_resources', 'scipy.ndimage', 'scipy.sparse', 'IPython',
+    'qtconsole',
+    'PyQt5.uic', 'vini.pyqtgraph_vini.parametertree',
+    'vini.pyqtgraph_vini.exporters', 'vini.pyqtgraph_vini.flowchart',
+    'vini.pyqtgraph_vini.opengl', 'vini.pyqtgraph_vini.console',
+    'vini.pyqtgraph_vini.canvas', 'vini.pyqtgraph_vini.multiprocess',
+    'vini.pyqtgraph_vini.metaarray',
+]
+
+FIRST_PAINT_SCRIPT = r"""
+import sys, time, json
+t_start = float(sys.argv[1])
+import vini.viewer
+from vini.pyqtgraph_vini.Qt import QtCore, QtGui
+t_import = time.time()
+
+class PaintFilter(QtCore.QObject):
+    def __init__(self):
+        super(PaintFilter, self).__init__()
+        self.armed = False
+        self.t_paint = None
+    def eventFilter(self, obj, event):
+        if (self.armed and self.t_paint is None and
+                event.type() == QtCore.QEvent.Paint):
+            self.t_paint = time.time()
+            QtCore.QTimer.singleShot(0, app.quit)
+        return False
+
+app = QtGui.QApplication([])
+paint_filter = PaintFilter()
+app.installEventFilter(paint_filter)
+viewer = vini.viewer.Viff()
+t_window = time.time()
+if len(sys.argv) > 2:
+    viewer.loadImagesFromFiles([sys.argv[2]], [0])
+else:
+    import numpy as np
+    data = np.random.RandomState(0).randn(64, 64, 40)
+    viewer.loadImagesFromNumpy(data, 'synthetic')
+t_loaded = time.time()
+paint_filter.armed = True
+viewer.show()
+QtCore.QTimer.singleShot(10000, app.quit)
+app.exec_()
+print(json.dumps({
+    'import': t_import - t_start,
+    'window': t_window - t_start,
+    'loaded': t_loaded - t_start,
+    'first_paint': (paint_filter.t_paint or float('nan')) - t_start,
+}))
+sys.stdout.flush()
+# skip the interpreter teardown, Qt may crash while destroying the scene
+import os
+os._exit(0)
+"""
+
+
+def environment():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def importTime():
+    """
+    Returns the total import time of vini.viewer in seconds, the cumulative
+    times of the slowest modules and the optional modules that were loaded.
+    """
+    code = ("import sys, json, vini.viewer; "
+            "print(json.dumps([m for m in %r if m in sys.modules]))"
+            % OPTIONAL_MODULES)
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, env=environment(), check=True)
+    total = 0
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        total += int(self_us)
+        cumulative[name.strip()] = int(cumulative_us) * 1e-6
+    slowest = sorted(cumulative.items(), key=lambda x: -x[1])[:15]
+    return total * 1e-6, slowest, json.loads(proc.stdout.splitlines()[-1])
+
+
+def firstPaint(filename=None):
+    """
+    Returns the times from process start to import, window creation, image
+    loading and the first paint in seconds.
+    """
+    cmd = [sys.executable, '-c', FIRST_PAINT_SCRIPT, repr(time.time())]
+    if filename is not None:
+        cmd.append(os.path.abspath(filename))
+    proc = subprocess.run(
+        cmd, stdout=subprocess.PIPE, universal_newlines=True,
+        env=environment(), check=True)
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='vini start-up benchmark')
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help='number of runs, the median is reported')
+    parser.add_argument('-i', '--input', default=None,
+                        help='image to load for the first paint')
+    parser.add_argument('--json', default=None,
+                        help='write the results to this file')
+    args = parser.parse_args()
+
+    import_runs = [importTime() for _ in range(args.repeat)]
+    paint_runs = [firstPaint(args.input) for _ in range(args.repeat)]
+
+    results = {
+        'python': sys.version.split()[0],
+        'repeat': args.repeat,
+        'import_total': median([r[0] for r in import_runs]),
+        'slowest_imports': import_runs[-1][1],
+        'optional_modules_loaded': import_runs[-1][2],
+    }
+    for key in ['import', 'window', 'loaded', 'first_paint']:
+        results[key] = median([r[key] for r in paint_runs])
+
+    print("import time (-X importtime): %7.1f ms" %
+          (1e3*results['import_total']))
+    print("vini.viewer imported:        %7.1f ms" % (1e3*results['import']))
+    print("main window created:         %7.1f ms" % (1e3*results['window']))
+    print("image loaded:                %7.1f ms" % (1e3*results['loaded']))
+    print("first paint:                 %7.1f ms" %
+          (1e3*results['first_paint']))
+    print("optional modules loaded: %s" %
+          (', '.join(results['optional_modules_loaded']) or 'none'))
+    print("slowest imports (cumulative):")
+    for name, seconds in results['slowest_imports']:
+        print("  %7.1f ms  %s" % (1e3*seconds, name))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""
+Checks that reading a file in chunks gives the data nibabel reads.
+"""
+import nibabel as nib
+import numpy as np
+import pytest
+
+from vini.loadImage import readData
+
+
+@pytest.mark.parametrize('suffix, dtype, scaled', [
+    ('.nii', np.int16, True),
+    ('.nii', np.dtype('>f4'), False),
+    ('.nii.gz', np.uint8, True),
+])
+def test_read_data_matches_get_fdata(tmp_path, suffix, dtype, scaled):
+    data = np.random.RandomState(0).randint(0, 200, (11, 9, 7, 3))
+    image = nib.Nifti1Image(data.astype(dtype), np.eye(4))
+    if scaled:
+        image.header.set_slope_inter(0.37, -12.5)
+    filename = str(tmp_path / ('image' + suffix))
+    nib.save(image, filename)
+
+    reported = []
+    image = nib.load(filename)
+    read = readData(image, lambda done, total, shape:
+                    reported.append((done, total)), chunk_size=1000)
+    np.testing.assert_array_equal(read, image.get_fdata())
+    assert read.dtype == np.float64
+    # read in several chunks up to the end
+    assert len(reported) > 2 and reported[-1][0] == reported[-1][1]
@@ -0,0 +1,43 @@
+"""
+Checks that the planes precomputed for playback are those resample_image
+gives for every frame.
+"""
+import numpy as np
+import pytest
+
+from vini.PlaneStacks import planeVoxels, sampleFrames
+from vini.resample import resample_image
+
+
+def planeAffine(mapping, plane, index):
+    """
+    Returns the mapping of the plane at 'index', as Image4D.resample_slice
+    builds it.
+    """
+    affine = np.array(mapping, dtype=float)
+    affine[0:3,3] += affine[0:3,plane] * index
+    return affine
+
+
+@pytest.mark.parametrize('interpolation', [0, 1])
+def test_sample_frames_matches_resample_image(interpolation):
+    rng = np.random.RandomState(0)
+    data = rng.randn(9, 10, 8, 6)
+    shape = (12, 11, 10)
+    rotation = np.linalg.qr(rng.randn(3, 3))[0]
+    for linear in [np.diag([0.5, 1., -0.75]), 0.8 * rotation]:
+        mapping = np.eye(4)
+        mapping[0:3,0:3] = linear
+        mapping[0:3,3] = [1.3, 0.5, 6.2]
+        for plane, index in [(0, 4), (1, 0), (2, 7)]:
+            voxels, plane_shape = planeVoxels(mapping, shape, plane, index)
+            values = sampleFrames(data, voxels, interpolation, 0, 6)
+            plane_grid = list(shape)
+            plane_grid[plane] = 1
+            for frame in range(6):
+                expected = resample_image(
+                    data[..., frame], planeAffine(mapping, plane, index),
+                    plane_grid, interpolation)
+                np.testing.assert_allclose(
+                    values[:, frame].reshape(plane_shape),
+                    expected.reshape(plane_shape), rtol=1e-12, atol=1e-12)
@@ -0,0 +1,115 @@
+"""
+Checks that the shortcuts of resample_image give what scipy's
+affine_transform computes for the whole volume, bit for bit also when it is
+resampled in slabs, and that NaN stays NaN with spline interpolation.
+"""
+import warnings
+
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from vini.resample import resample_image, resample_axes, ResampledGrid, \
+    spline_coefficients, invalid_voxels
+
+
+def reference(data, affine, shape, interpolation):
+    """
+    Resamples with one affine_transform call, as resample_image did before
+    it had shortcuts and slabs. For spline interpolation 'data' are the
+    spline coefficients.
+    """
+    A = np.asarray(affine, dtype=float)[0:3,0:3]
+    b = np.asarray(affine, dtype=float)[0:3,3]
+    if np.all(np.diag(np.diag(A)) == A):
+        A = np.diag(A)
+    result = np.empty(shape)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        ndimage.affine_transform(data, A, b, output_shape=shape,
+                                 output=result, order=interpolation,
+                                 prefilter=False)
+    return result
+
+
+def axis_aligned_affine(rng, data_shape):
+    """
+    Returns a random affine without rotation or shear: flips, permutations,
+    integer and fractional zooms and offsets, some of them at the border.
+    """
+    affine = np.eye(4)
+    affine[0:3,0:3] = 0
+    for axis, out_axis in enumerate(rng.permutation(3)):
+        affine[axis, out_axis] = rng.choice(
+            [1., -1., 0.5, 1. / 3, 0.25, 2., 1.5, 0.4, -0.5])
+        affine[axis, 3] = rng.choice(
+            [0, 1, -1, 2, 0.5, -0.5, 0.25, rng.uniform(-3, 3),
+             data_shape[axis] - 1, 0.5 - 1e-9])
+    return affine
+
+
+def test_resample_axes_matches_affine_transform():
+    rng = np.random.RandomState(0)
+    shortcuts = 0
+    for trial in range(1000):
+        data = rng.randn(*rng.randint(1, 9, 3))
+        if rng.rand() < 0.2:
+            data[tuple(rng.randint(0, n) for n in data.shape)] = np.nan
+        affine = axis_aligned_affine(rng, data.shape)
+        shape = tuple(rng.randint(1, 12, 3))
+        for interpolation in [0, 1]:
+            shortcuts += resample_axes(
+                data, affine, shape, interpolation) is not None
+            np.testing.assert_array_equal(
+                resample_image(data, affine, shape, interpolation),
+                reference(data, affine, shape, interpolation))
+    # the shortcuts are taken for a good part of the cases
+    assert shortcuts > 200
+
+
+def test_integer_zoom_repeats_blocks():
+    data = np.random.RandomState(1).rand(6, 7, 5)
+    affine = np.diag([0.5, 0.25, 1. / 3, 1])
+    shape = (12, 28, 15)
+    assert resample_axes(data, affine, shape, 0) is not None
+    np.testing.assert_array_equal(resample_image(data, affine, shape, 0),
+                                  reference(data, affine, shape, 0))
+
+
+def test_cubic_keeps_nan_transparent():
+    data = np.full((12, 12, 12), 100.)
+    data[4:8, 4:8, 4:8] = np.nan
+    affine = np.diag([0.5, 0.5, 0.5, 1])
+    shape = (24, 24, 24)
+    linear = resample_image(data, affine, shape, 1)
+    cubic = resample_image(data, affine, shape, 3)
+    # NaN wherever a NaN voxel is interpolated, as for linear interpolation
+    assert np.isnan(cubic[7:16, 7:16, 7:16]).all()
+    assert not np.isnan(cubic[np.isfinite(linear)]).any()
+    # the same from precomputed coefficients and lazily
+    np.testing.assert_array_equal(cubic, resample_image(
+        spline_coefficients(data, 3), affine, shape, 3, prefilter=False,
+        invalid=invalid_voxels(data)))
+    np.testing.assert_array_equal(
+        cubic[:, 12], ResampledGrid(data, affine, shape, 3)[:, 12])
+
+
+@pytest.mark.parametrize('interpolation', [0, 1, 3])
+def test_slabs_match_one_call(interpolation):
+    rng = np.random.RandomState(2)
+    data = rng.randn(20, 18, 16)
+    if interpolation > 1:
+        data = spline_coefficients(data, interpolation)
+    shape = (23, 21, 19)
+    oblique = np.eye(4)
+    oblique[0:3,0:3] = np.linalg.qr(rng.randn(3, 3))[0] * 0.9
+    oblique[0:3,3] = [8.3, -1.7, 5.1]
+    zoom = np.diag([0.7, -0.85, 0.6, 1])
+    zoom[0:3,3] = [0.3, 16.9, 1.45]
+    for affine in [oblique, zoom]:
+        expected = reference(data, affine, shape, interpolation)
+        for workers in [1, 4]:
+            # a few voxel rows per slab
+            np.testing.assert_array_equal(resample_image(
+                data, affine, shape, interpolation, prefilter=False,
+                workers=workers, slab_size=3 * 21 * 19), expected)
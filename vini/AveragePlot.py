@@ -73,7 +73,7 @@ class AveragePlot(GraphicsWindow):
         color:
             color of the experimental condition
         """
-        if self.curves.has_key(cond):
+        if cond in self.curves:
             self.curves[cond].setData(x=x, y=data)
             self.uppers[cond].setData(x=x, y=data+self.c*stderr)
             self.lowers[cond].setData(x=x, y=data-self.c*stderr)
@@ -0,0 +1,389 @@
+"""
+Out-of-core multiresolution volumes for data that does not fit into memory.
+
+A bricked volume is converted once from a NIfTI file. It is stored as a small
+JSON description ('name.bricks') and one file per level of detail
+('name.bricks.<level>.npy'). Level 0 has the original resolution, every
+further level halves it by averaging 2x2x2 voxels. Each level is split into
+cubic bricks of 'brick' voxels per side which are stored contiguously, so
+that a brick is read from disk in one piece.
+
+Only the bricks that are needed to show the displayed planes are read. They
+are kept in a least recently used cache of fixed size.
+
+Convert a file with:
+
+    python -m vini.BrickStore input.nii.gz output.bricks
+"""
+import json
+import os
+import sys
+from collections import OrderedDict
+import numpy as np
+from nibabel import load, Nifti1Header
+
+from .resample import ResampledGrid
+
+VERSION = 1
+
+
+def levelShape(shape, level):
+    """
+    Returns the shape of the volume at the given level of detail.
+    """
+    factor = 2**level
+    return tuple(int(-(-int(n) // factor)) for n in shape)
+
+
+def brickGrid(shape, brick):
+    """
+    Returns the number of bricks along each axis.
+    """
+    return tuple(int(-(-int(n) // brick)) for n in shape)
+
+
+def levelFile(filename, level):
+    return '{}.{}.npy'.format(filename, level)
+
+
+def downsample(block):
+    """
+    Halves the resolution of a 3D block by averaging 2x2x2 voxels. Odd
+    dimensions are padded by repeating the last voxel.
+    """
+    pad = [(0, n % 2) for n in block.shape]
+    if any(p[1] for p in pad):
+        block = np.pad(block, pad, mode='edge')
+    nx, ny, nz = block.shape
+    return block.reshape(nx//2, 2, ny//2, 2, nz//2, 2).mean(
+        axis=(1, 3, 5), dtype=np.float64).astype(np.float32)
+
+
+def writeSlab(array, slab, z_brick, brick):
+    """
+    Writes a slab of whole bricks along z (starting at brick z_brick) into
+    the brick-major memory map.
+    """
+    nbx, nby = array.shape[:2]
+    for bx in range(nbx):
+        for by in range(nby):
+            for bz in range(slab.shape[2] // brick):
+                array[bx, by, z_brick + bz] = slab[
+                    bx*brick:(bx+1)*brick, by*brick:(by+1)*brick,
+                    bz*brick:(bz+1)*brick]
+
+
+def convertToBricks(source, filename, brick=32):
+    """
+    Converts the 3D NIfTI file 'source' into a bricked multiresolution
+    volume 'filename'. The source is read in slabs of 'brick' slices, so
+    that it never has to be held in memory as a whole. Non-finite values
+    are stored as 0, as the bricks have no way to mark them.
+    """
+    image = load(source)
+    shape = tuple(int(n) for n in image.shape[:3])
+    if len(image.shape) > 3 and int(np.prod(image.shape[3:])) > 1:
+        raise ValueError("only 3D images can be converted to bricks")
+    levels = [shape]
+    while max(levels[-1]) > brick:
+        levels.append(levelShape(shape, len(levels)))
+
+    arrays = []
+    for level, lshape in enumerate(levels):
+        arrays.append(np.lib.format.open_memmap(
+            levelFile(filename, level), mode='w+', dtype=np.float32,
+            shape=brickGrid(lshape, brick) + (brick, brick, brick)))
+
+    low, high = np.inf, -np.inf
+    nbx, nby, nbz = arrays[0].shape[:3]
+    for bz in range(nbz):
+        z0 = bz*brick
+        z1 = min(z0 + brick, shape[2])
+        data = np.array(image.dataobj[:, :, z0:z1], dtype=np.float32)
+        data = data.reshape(shape[0], shape[1], z1 - z0)
+        data[~np.isfinite(data)] = 0
+        low = min(low, float(data.min()))
+        high = max(high, float(data.max()))
+        slab = np.zeros((nbx*brick, nby*brick, brick), dtype=np.float32)
+        slab[:shape[0], :shape[1], :z1-z0] = data
+        writeSlab(arrays[0], slab, bz, brick)
+
+    # each level is built from the one above, one slab of bricks at a time
+    for level in range(1, len(levels)):
+        above = BrickArray(arrays[level-1], levels[level-1])
+        lshape = levels[level]
+        nbx, nby, nbz = arrays[level].shape[:3]
+        for bz in range(nbz):
+            z0 = 2*bz*brick
+            z1 = min(z0 + 2*brick, levels[level-1][2])
+            block = downsample(above.region(
+                (0, 0, z0), (levels[level-1][0], levels[level-1][1], z1)))
+            slab = np.zeros((nbx*brick, nby*brick, brick), dtype=np.float32)
+            slab[:lshape[0], :lshape[1], :block.shape[2]] = block
+            writeSlab(arrays[level], slab, bz, brick)
+
+    for array in arrays:
+        array.flush()
+    sform_code = 0
+    if 'sform_code' in image.header.keys():
+        sform_code = int(image.header['sform_code'])
+    description = {
+        'version': VERSION,
+        'shape': list(shape),
+        'affine': np.asarray(image.affine, dtype=float).tolist(),
+        'sform_code': sform_code,
+        'brick': int(brick),
+        'levels': [{'shape': list(lshape),
+                    'file': os.path.basename(levelFile(filename, level))}
+                   for level, lshape in enumerate(levels)],
+        'min': low,
+        'max': high}
+    with open(filename, 'w') as f:
+        json.dump(description, f, indent=1)
+    return filename
+
+
+def assemble(lower, upper, brick, getBrick):
+    """
+    Returns the voxels from 'lower' to 'upper' (exclusive) of a level,
+    copied from the bricks returned by getBrick((bx, by, bz)).
+    """
+    b = brick
+    out = np.zeros([u - l for l, u in zip(lower, upper)], dtype=np.float32)
+    ranges = [range(l // b, (u - 1) // b + 1) for l, u in zip(lower, upper)]
+    for bx in ranges[0]:
+        for by in ranges[1]:
+            for bz in ranges[2]:
+                # overlap of the brick and the region in voxels
+                start = [bx*b, by*b, bz*b]
+                first = [max(l, s) for l, s in zip(lower, start)]
+                last = [min(u, s + b) for u, s in zip(upper, start)]
+                src = tuple(slice(f - s, e - s)
+                            for f, e, s in zip(first, last, start))
+                dst = tuple(slice(f - l, e - l)
+                            for f, e, l in zip(first, last, lower))
+                out[dst] = getBrick((bx, by, bz))[src]
+    return out
+
+
+class BrickArray(object):
+    """
+    A level of a bricked volume stored as (nbx, nby, nbz, b, b, b).
+    """
+
+    def __init__(self, array, shape):
+        self.array = array
+        self.shape = tuple(shape)
+        self.brick = array.shape[3]
+
+    def region(self, lower, upper):
+        """
+        Returns the voxels from 'lower' to 'upper' (exclusive) as array.
+        """
+        return assemble(lower, upper, self.brick,
+                        lambda index: self.array[index])
+
+
+class BrickStore(object):
+    """
+    Reads a bricked multiresolution volume.
+
+    It stands in for the nibabel image of an Image: it has a shape, an
+    affine and a header, but the data is only read brick by brick.
+    """
+
+    def __init__(self, filename, cache_size=512*2**20):
+        with open(filename) as f:
+            description = json.load(f)
+        if description.get('version', 0) > VERSION:
+            raise IOError("{} was written by a newer version of vini".format(
+                filename))
+        directory = os.path.dirname(os.path.abspath(filename))
+        self.filename = filename
+        self.shape = tuple(description['shape'])
+        self.affine = np.array(description['affine'], dtype=float)
+        self.brick = int(description['brick'])
+        self.extremum = [description['min'], description['max']]
+        self.levels = []
+        for level in description['levels']:
+            array = np.load(os.path.join(directory, level['file']),
+                            mmap_mode='r')
+            self.levels.append(BrickArray(array, level['shape']))
+
+        self.header = Nifti1Header()
+        self.header.set_data_shape(self.shape)
+        self.header.set_data_dtype(np.float32)
+        self.header.set_sform(self.affine, int(description['sform_code']))
+        self.header.set_qform(self.affine, 1)
+
+        # (level, bx, by, bz) -> brick, least recently used first
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cached_bytes = 0
+        self.reads = 0
+
+    def nLevels(self):
+        return len(self.levels)
+
+    def getBrick(self, level, index):
+        """
+        Returns a brick from the cache or reads it from disk.
+        """
+        key = (level,) + tuple(index)
+        brick = self.cache.get(key)
+        if brick is not None:
+            self.cache.move_to_end(key)
+            return brick
+        brick = np.array(self.levels[level].array[tuple(index)])
+        self.reads += 1
+        self.cache[key] = brick
+        self.cached_bytes += brick.nbytes
+        while self.cached_bytes > self.cache_size and len(self.cache) > 1:
+            self.cached_bytes -= self.cache.popitem(last=False)[1].nbytes
+        return brick
+
+    def values(self, level, voxels, cval=0.0):
+        """
+        Returns the values at integer voxels ((N, 3) array) of a level,
+        voxels outside are 'cval'. Every brick is looked up once.
+        """
+        voxels = np.asarray(voxels).reshape(-1, 3)
+        out = np.full(len(voxels), cval, dtype=np.float32)
+        shape = np.asarray(self.levels[level].shape)
+        inside = np.all((voxels >= 0) & (voxels < shape), axis=1)
+        voxels = voxels[inside]
+        if len(voxels) == 0:
+            return out
+        b = self.brick
+        n_bricks = self.levels[level].array.shape[:3]
+        ids = np.ravel_multi_index((voxels // b).T, n_bricks)
+        order = np.argsort(ids, kind='stable')
+        ids = ids[order]
+        local = voxels[order] % b
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        ends = np.r_[starts[1:], len(ids)]
+        values = np.empty(len(ids), dtype=np.float32)
+        for start, end in zip(starts, ends):
+            brick = self.getBrick(level, np.unravel_index(ids[start], n_bricks))
+            values[start:end] = brick[
+                local[start:end, 0], local[start:end, 1], local[start:end, 2]]
+        result = np.empty_like(values)
+        result[order] = values
+        out[inside] = result
+        return out
+
+    def region(self, level, lower, upper):
+        """
+        Returns the voxels from 'lower' to 'upper' (exclusive) of a level,
+        reading the bricks through the cache.
+        """
+        return assemble(lower, upper, self.brick,
+                        lambda index: self.getBrick(level, index))
+
+    def sample(self, coords, level=0, interpolation=0, cval=0.0):
+        """
+        Samples the volume at voxel coordinates of level 0 ((N, 3) array)
+        with nearest neighbour (0) or trilinear (1) interpolation, using the
+        data of the given level. Like resample_image, points outside the
+        volume are 'cval'.
+
+        If the points lie in a small box (e.g. an axis-aligned plane), the
+        box is assembled from the bricks and interpolated at once, otherwise
+        every voxel needed is looked up in its brick.
+        """
+        from scipy import ndimage
+
+        coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+        result = np.full(len(coords), cval, dtype=np.float32)
+        inside = np.all(
+            (coords >= 0) & (coords <= np.asarray(self.shape) - 1), axis=1)
+        coords = coords[inside]
+        if len(coords) == 0:
+            return result
+        if level > 0:
+            coords = (coords + 0.5) / 2**level - 0.5
+        shape = np.asarray(self.levels[level].shape)
+        lower = np.clip(np.floor(coords.min(axis=0)).astype(int), 0, shape - 1)
+        upper = np.clip(np.floor(coords.max(axis=0)).astype(int) + 2, 1, shape)
+        if np.prod(upper - lower) <= 8 * len(coords):
+            block = self.region(level, lower, upper)
+            result[inside] = ndimage.map_coordinates(
+                block, (coords - lower).T, order=interpolation, mode='nearest',
+                output=np.float32)
+            return result
+        # coarser levels may be slightly smaller than the volume, the edge
+        # voxels are repeated like in the box interpolation
+        if interpolation == 0:
+            voxels = np.clip(np.floor(coords + 0.5).astype(np.intp), 0,
+                             shape - 1)
+            result[inside] = self.values(level, voxels)
+            return result
+        floor = np.floor(coords)
+        weights = coords - floor
+        floor = floor.astype(np.intp)
+        values = np.zeros(len(coords), dtype=np.float64)
+        for corner in np.ndindex(2, 2, 2):
+            w = np.prod(np.where(corner, weights, 1 - weights), axis=1)
+            voxels = np.clip(floor + corner, 0, shape - 1)
+            values += w * self.values(level, voxels)
+        result[inside] = values
+        return result
+
+    def uncache(self):
+        """
+        Empties the brick cache.
+        """
+        self.cache.clear()
+        self.cached_bytes = 0
+
+    def get_fdata(self):
+        """
+        Returns the coarsest level, which is small enough for whole-volume
+        statistics (e.g. value sets). It does not have the shape of the
+        volume.
+        """
+        level = self.levels[-1]
+        return level.region((0, 0, 0), level.shape).astype(float)
+
+
+class BrickedGrid(ResampledGrid):
+    """
+    Read-only stand-in for the resampled data of a bricked image.
+
+    Indexing it samples the requested voxels of the resampled grid from the
+    bricks. Planes (one integer index) are sampled at the level of detail
+    set for them, everything else at full resolution.
+    """
+
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, store, mapping, shape, interpolation):
+        super(BrickedGrid, self).__init__(None, mapping, shape, interpolation)
+        self.store = store
+        # level of detail of the planes (0: sagittal, 1: coronal, ...)
+        self.plane_levels = [0, 0, 0]
+
+    def sample(self, voxels, integers):
+        level = 0
+        if len(integers) == 1:
+            level = self.plane_levels[integers[0]]
+        return self.store.sample(voxels, level, self.interpolation)
+
+    def setDetail(self, plane, level):
+        """
+        Sets the level of detail of a plane, returns True if it changed.
+        """
+        if self.plane_levels[plane] == level:
+            return False
+        self.plane_levels[plane] = level
+        return True
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        sys.stderr.write(
+            "usage: python -m vini.BrickStore input.nii output.bricks "
+            "[brick size]\n")
+        sys.exit(1)
+    convertToBricks(sys.argv[1], sys.argv[2],
+                    *[int(a) for a in sys.argv[3:]])
@@ -0,0 +1,157 @@
+import numpy as np
+
+from .Image3D import Image3D
+from .BrickStore import BrickedGrid
+
+
+class BrickedImage3D(Image3D):
+    """
+    3D image whose data stays on disk in a bricked multiresolution volume
+    (see BrickStore). Only the windows of the displayed planes are sampled,
+    at the level of detail that matches the zoom of the views showing them.
+    """
+
+    # always resampled lazily
+    lazy_capable = False
+
+    def __init__(self, store, color=False):
+        super(BrickedImage3D, self).__init__()
+        self.store = store
+        self.image = store
+        self.lazy = True
+        # screen pixels per grid voxel of the views of each plane, 0 until
+        # the views are known (then the coarsest level is used)
+        self.plane_pixels = [0, 0, 0]
+        self.affine_res_inv = np.eye(4)
+        self.res_shape = store.shape
+        self.image_res = self.resampledData()
+
+        self.extremum[0] = store.extremum[0]
+        self.extremum[1] = store.extremum[1]
+
+        self.two_cm = color
+        self.dialog.setPreferences(
+            two_cm=self.two_cm, clippings_pos=self.clippings_pos,
+            clippings_neg=self.clippings_neg)
+
+        self.setPosThresholdsDefault()
+        self.setNegThresholdsDefault()
+        self.slice()
+
+    def resampledData(self):
+        """
+        Returns a BrickedGrid instead of resampling the whole volume.
+        """
+        # splines would need the coefficients of the whole volume, the
+        # bricks are interpolated linearly at most
+        grid = BrickedGrid(self.store, self.affine_res_inv, self.res_shape,
+                           min(self.interp_type, 1))
+        for plane in range(3):
+            grid.setDetail(plane, self.detail(plane, self.plane_pixels[plane]))
+        return grid
+
+    def setUnresampled(self):
+        self.res_key = None
+        self.affine_res_inv = np.eye(4)
+        self.res_shape = self.store.shape
+        self.image_res = self.resampledData()
+
+    def detail(self, plane, pixels):
+        """
+        Returns the level of detail for a plane shown with 'pixels' screen
+        pixels per voxel of the resampled grid.
+
+        The finest level whose voxels are at least one screen pixel wide is
+        used, so the bricks of a plane never cover more voxels than the view
+        has pixels.
+        """
+        # source voxels per grid voxel within the plane
+        source_step = min(np.linalg.norm(self.affine_res_inv[:3, axis])
+                          for axis in range(3) if axis != plane)
+        level = self.store.nLevels() - 1
+        if pixels > 0:
+            level = min(level, int(np.ceil(
+                np.log2(max(source_step / pixels, 1.0)))))
+        return level
+
+    def setDetail(self, plane, pixels):
+        """
+        Sets the zoom of the views of a plane. Returns True if the plane has
+        to be sliced again.
+        """
+        self.plane_pixels[plane] = pixels
+        if self.image_res.setDetail(plane, self.detail(plane, pixels)):
+            self.slice_indices_key[plane] = None
+            return True
+        return False
+
+    def sampleCoordinates(self, coords, interpolation=0, mapping=None):
+        if mapping is None:
+            mapping = self.affine_res_inv
+        coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+        voxels = np.dot(coords, mapping[:3,:3].T) + mapping[:3,3]
+        return self.store.sample(
+            voxels, 0, interpolation, cval=np.nan).astype(float)
+
+    def nonzeroVoxels(self):
+        """
+        Returns the voxels where the data is not zero at full resolution,
+        read slab by slab past the brick cache so that the displayed bricks
+        stay cached.
+        """
+        level = self.store.levels[0]
+        shape = np.asarray(level.shape)
+        voxels = []
+        for first in range(0, shape[0], self.store.brick):
+            lower = np.array([first, 0, 0])
+            upper = np.array([min(first + self.store.brick, shape[0]),
+                              shape[1], shape[2]])
+            voxels.append(np.argwhere(level.region(lower, upper) != 0) + lower)
+        return np.concatenate(voxels)
+
+    def getHistogram(self, targetHistogramSize=500):
+        """
+        Returns the histogram of the coarsest level of detail.
+        """
+        if self.hist_saved is not True:
+            data = self.store.get_fdata()
+            hist_bins = np.linspace(
+                self.getMin(), self.getMax(), targetHistogramSize)
+            self.hist = np.histogram(data[data!=0], bins=hist_bins)
+            self.hist_saved = True
+        return self.hist[1][:-1], self.hist[0]
+
+    def getMaxCoord(self, radius=0):
+        return self.extremeCoord(radius, np.argmax)
+
+    def getMinCoord(self, radius=0):
+        return self.extremeCoord(radius, np.argmin)
+
+    def extremeCoord(self, radius, arg):
+        """
+        Returns the grid coordinate of the extreme value within a cube of
+        given width. The whole image is searched at the coarsest level and
+        then on the grid around the extreme coarse voxel.
+        """
+        shape = self.image_res.shape
+        if radius == 0:
+            data = self.store.get_fdata()
+            factor = 2**(self.store.nLevels() - 1)
+            voxel = np.array(np.unravel_index(arg(data), data.shape))
+            # corners of the coarse voxel in voxels of level 0 and the box
+            # of grid voxels around them
+            corners = np.array(list(np.ndindex(2, 2, 2))) * factor + \
+                voxel * factor - 0.5
+            corners = np.dot(np.c_[corners, np.ones(8)],
+                             np.linalg.inv(self.affine_res_inv).T)[:, :3]
+            lower = np.clip(np.floor(corners.min(axis=0)).astype(int), 0,
+                            np.asarray(shape) - 1)
+            upper = np.clip(np.ceil(corners.max(axis=0)).astype(int) + 1,
+                            lower + 1, shape)
+        else:
+            lower = [max(0, int(c) - radius) for c in self.coord]
+            upper = [min(int(c) + radius, n)
+                     for c, n in zip(self.coord, shape)]
+        cube = self.image_res[tuple(slice(l, u) for l, u in zip(lower, upper))]
+        coord = np.unravel_index(arg(cube), cube.shape)
+        return [int(c) + int(l) for c, l in zip(coord, lower)]
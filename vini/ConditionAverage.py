@@ -0,0 +1,116 @@
+"""
+Trial averages of the time courses of all voxels of a time series, one
+peri-stimulus time course per voxel and experimental condition (see
+Image4D.updateTimeAverageData for the average of the crosshair region).
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+import numpy as np
+from .ProgressThread import ProgressThread
+
+
+def interpolationWeights(x, xp):
+    """
+    Returns the indices and weights ((len(x), 2) arrays) of the samples at
+    the increasing times 'xp' that interpolate linearly at 'x', clamped at
+    the first and last sample like np.interp.
+    """
+    x = np.clip(np.asarray(x, dtype=float), xp[0], xp[-1])
+    if len(xp) == 1:
+        return (np.zeros((len(x), 2), dtype=np.intp),
+                np.tile([1., 0.], (len(x), 1)))
+    upper = np.clip(np.searchsorted(xp, x, side='right'), 1, len(xp) - 1)
+    lower = upper - 1
+    fraction = (x - xp[lower]) / (xp[upper] - xp[lower])
+    return (np.stack([lower, upper], axis=1),
+            np.stack([1 - fraction, fraction], axis=1))
+
+
+def averagingMatrix(onsets, times, frame_times):
+    """
+    Returns the sparse (len(times), len(frame_times)) matrix that maps a
+    time course sampled at 'frame_times' to its mean over the trials
+    starting at 'onsets', interpolated at 'times' after each onset.
+    """
+    # scipy is imported on first use to keep the start-up of vini fast
+    import scipy.sparse
+
+    rows, columns, values = [], [], []
+    for onset in onsets:
+        indices, weights = interpolationWeights(
+            np.asarray(times) + onset, frame_times)
+        rows.append(np.repeat(np.arange(len(times)), 2))
+        columns.append(indices.ravel())
+        values.append(weights.ravel() / len(onsets))
+    shape = (len(times), len(frame_times))
+    if len(rows) == 0:
+        return scipy.sparse.csr_matrix(shape)
+    # the weights of the same frame are summed
+    matrix = scipy.sparse.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows),
+                                  np.concatenate(columns))), shape=shape)
+    # frames without weight don't spread NaNs
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def conditionAverages(rows, matrices, chunk_size=4096, workers=None,
+                      progress=None):
+    """
+    Returns for every sparse (time points, frames) matrix in 'matrices' the
+    (voxels, time points) averages of 'rows', the (voxels, frames) time
+    courses.
+
+    The voxels are averaged in chunks of 'chunk_size' by a pool of
+    'workers' threads (by default one per core, at most 4), so that
+    besides the averages only a chunk per thread is held in memory.
+    progress(voxels done, voxels) is called after every chunk, it may raise
+    an exception to stop.
+    """
+    import scipy.sparse
+
+    if workers is None:
+        workers = min(4, os.cpu_count() or 1)
+    stacked = scipy.sparse.vstack(matrices).tocsr()
+    bounds = np.cumsum([0] + [matrix.shape[0] for matrix in matrices])
+    n = rows.shape[0]
+    # in the memory order of the time courses, so that the averages can be
+    # reshaped like the data without copying
+    order = 'F' if rows.flags.f_contiguous else 'C'
+    averages = [np.empty((n, last - first), order=order)
+                for first, last in zip(bounds[:-1], bounds[1:])]
+
+    def average(first):
+        last = min(first + chunk_size, n)
+        chunk = stacked.dot(rows[first:last].T).T
+        for i in range(len(averages)):
+            averages[i][first:last] = chunk[:, bounds[i]:bounds[i+1]]
+        return last - first
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(average, first)
+                   for first in range(0, n, chunk_size)]
+        try:
+            for future in as_completed(futures):
+                done += future.result()
+                if progress is not None:
+                    progress(done, n)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return averages
+
+
+class AverageThread(ProgressThread):
+    """
+    Computes conditionAverages in the background, reporting the progress.
+    """
+
+    def __init__(self, rows, matrices, name, parent=None):
+        super(AverageThread, self).__init__(
+            partial(conditionAverages, rows, matrices), "Averaging trials",
+            name, "voxel", parent)
@@ -0,0 +1,48 @@
+"""
+Reading coordinate tables and writing the values sampled at them as CSV.
+"""
+import csv
+import numpy as np
+
+from .testInputs import testFloat
+
+
+def readCoordinates(filename):
+    """
+    Reads x, y, z from the first three columns of a CSV (or tab or space
+    separated) file. Rows that are not numbers, like a header, are skipped.
+    """
+    with open(filename, newline='') as f:
+        text = f.read()
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t ')
+    except csv.Error:
+        dialect = csv.excel
+    coords = []
+    for row in csv.reader(text.splitlines(), dialect):
+        row = [field for field in row if field.strip() != '']
+        if len(row) >= 3 and all(testFloat(field) for field in row[:3]):
+            coords.append([float(field) for field in row[:3]])
+    return np.array(coords, dtype=float).reshape(-1, 3)
+
+
+def writeValues(filename, coords, names, values):
+    """
+    Writes one row per coordinate: x, y, z and the value of every image.
+    For 4D images 'values' has a time axis and one column per frame is
+    written ('name[t]').
+    """
+    values = np.asarray(values)
+    header = ['x', 'y', 'z']
+    if values.ndim == 3:
+        for name in names:
+            header += ['{}[{}]'.format(name, t)
+                       for t in range(values.shape[2])]
+        values = values.reshape(values.shape[0], -1)
+    else:
+        header += list(names)
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for xyz, row in zip(coords, values):
+            writer.writerow(['%g' % v for v in xyz] + ['%g' % v for v in row])
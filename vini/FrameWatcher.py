@@ -0,0 +1,143 @@
+"""
+Watches a directory or file pattern for volumes written during an
+acquisition (one NIfTI file per volume) and hands them over in order.
+"""
+from .pyqtgraph_vini.Qt import QtCore
+import glob
+import os
+import re
+import numpy as np
+from nibabel import load
+
+
+def naturalKey(filename):
+    """
+    Sort key so that vol_10.nii comes after vol_9.nii.
+    """
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r'(\d+)', filename)]
+
+
+class FrameReader(QtCore.QThread):
+    """
+    Reads volume files in the background.
+    """
+
+    # Emits a list of (filename, data, affine), with the exception instead
+    # of the data and None as affine if a file could not be read.
+    sigRead = QtCore.Signal(object)
+
+    def __init__(self, filenames, parent=None):
+        super(FrameReader, self).__init__(parent)
+        self.filenames = filenames
+
+    def run(self):
+        results = []
+        for filename in self.filenames:
+            try:
+                image = load(filename)
+                # read now and in the stored data type, not as float64
+                data = np.array(image.dataobj)
+                results.append((filename, data, image.affine))
+            except Exception as e:
+                results.append((filename, e, None))
+        self.sigRead.emit(results)
+
+
+class FrameWatcher(QtCore.QObject):
+    """
+    Polls a directory or glob pattern for new volume files.
+
+    A file is only read once its size did not change between two polls, so
+    that files that are still being written are not read. Files are handed
+    over in natural name order, a 4D file counts as several volumes. Files
+    are read in the background; a file that can't be read although its size
+    is stable is skipped.
+    """
+
+    # Emits a list of 3D arrays and the affine of the first new file.
+    sigNewFrames = QtCore.Signal(object, object)
+
+    def __init__(self, path, interval=200, parent=None):
+        super(FrameWatcher, self).__init__(parent)
+        if os.path.isdir(path):
+            self.pattern = os.path.join(path, '*.nii*')
+        else:
+            self.pattern = path
+        self.done = set()
+        # file name -> size seen at the last poll
+        self.pending = {}
+        # thread reading the stable files, None when idle
+        self.reader = None
+        self.stopped = False
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.poll)
+        self.interval = interval
+
+    def start(self):
+        self.stopped = False
+        self.poll()
+        self.timer.start(self.interval)
+
+    def stop(self):
+        self.stopped = True
+        self.timer.stop()
+        if self.reader is not None:
+            self.reader.wait()
+            self.reader = None
+
+    def poll(self):
+        """
+        Records the sizes of all new files and starts reading the leading
+        run of files whose size did not change since the last poll.
+        """
+        reading = set() if self.reader is None else set(self.reader.filenames)
+        new_files = sorted(
+            [f for f in glob.glob(self.pattern)
+             if f not in self.done and f not in reading],
+            key=naturalKey)
+        stable = []
+        leading = True
+        for filename in new_files:
+            try:
+                size = os.path.getsize(filename)
+            except OSError:
+                # removed meanwhile
+                size = None
+            if leading and size is not None and \
+                    self.pending.get(filename) == size:
+                stable.append(filename)
+            else:
+                # new or still growing, later files keep the order and wait
+                leading = False
+            self.pending[filename] = size
+        if len(stable) > 0 and self.reader is None:
+            self.reader = FrameReader(stable, self)
+            self.reader.sigRead.connect(self.framesRead)
+            self.reader.start()
+
+    def framesRead(self, results):
+        """
+        Hands over the volumes of the files read by the reader thread.
+        """
+        if self.stopped:
+            return
+        self.reader.wait()
+        self.reader = None
+        frames = []
+        affine = None
+        for filename, data, file_affine in results:
+            self.pending.pop(filename, None)
+            self.done.add(filename)
+            if isinstance(data, Exception):
+                print("Warning: cannot read {}, skipped: {}".format(
+                    filename, data))
+                continue
+            if affine is None:
+                affine = file_affine
+            if data.ndim == 4:
+                frames.extend([data[..., t] for t in range(data.shape[3])])
+            else:
+                frames.append(data.reshape(data.shape[:3]))
+        if len(frames) > 0:
+            self.sigNewFrames.emit(frames, affine)
@@ -24,6 +24,8 @@ class FunctionalDialog(QtGui.QDialog):
     sigDelDesMat = QtCore.Signal()
     # Emits when trial averages are to be computed.
     sigComputeTA = QtCore.Signal()
+    # Emits when trial averages are to be computed for all voxels.
+    sigComputeVolumes = QtCore.Signal()
 
     def __init__(self):
         super(FunctionalDialog, self).__init__()
@@ -41,6 +43,13 @@ class FunctionalDialog(QtGui.QDialog):
         # Number of standard errors for plot.
         self.cond_stddevs = 2.0
 
+        # region of the time course
+        self.roi_shapes = ['voxel', 'sphere', 'box', 'mask']
+        self.roi_shape = 'voxel'
+        self.roi_radius = 5.0
+        self.roi_statistic = 'mean'
+        self.roi_mask_index = -1
+
         self.layout = QtGui.QGridLayout()
         self.resize(320,320)
 
@@ -66,6 +75,22 @@ class FunctionalDialog(QtGui.QDialog):
         self.del_design_button.clicked.connect(self.delDesignFile)
         self.form1.addRow("Remove design file", self.del_design_button)
 
+        self.roi_cb = QtGui.QComboBox()
+        self.roi_cb.addItems(["Voxel", "Sphere", "Box", "Mask image"])
+        self.roi_cb.currentIndexChanged.connect(self.savePreferences)
+        self.form1.addRow("Time course of:", self.roi_cb)
+        self.radius_le = QtGui.QLineEdit(str(self.roi_radius))
+        self.radius_le.returnPressed.connect(self.savePreferences)
+        self.radius_le.editingFinished.connect(self.savePreferences)
+        self.form1.addRow("Radius (half edge) in mm:", self.radius_le)
+        self.mask_cb = QtGui.QComboBox()
+        self.mask_cb.currentIndexChanged.connect(self.savePreferences)
+        self.form1.addRow("Mask image:", self.mask_cb)
+        self.statistic_cb = QtGui.QComboBox()
+        self.statistic_cb.addItems(["Mean", "Median"])
+        self.statistic_cb.currentIndexChanged.connect(self.savePreferences)
+        self.form1.addRow("Statistic:", self.statistic_cb)
+
         # Second tab: trial averages for experimental conditions
         self.form2 = QtGui.QFormLayout()
         self.tab2.setLayout(self.form2)
@@ -82,6 +107,13 @@ class FunctionalDialog(QtGui.QDialog):
         self.compute_button.setFocusPolicy(QtCore.Qt.NoFocus)
         self.compute_button.clicked.connect(self.computeTA)
         self.form2.addRow("Trial Averages:", self.compute_button)
+        self.volumes_button = QtGui.QPushButton("Compute volumes", self)
+        self.volumes_button.setFocusPolicy(QtCore.Qt.NoFocus)
+        self.volumes_button.setToolTip(
+            "Adds a 4D image of the trial average of every voxel for each\n"
+            "condition.")
+        self.volumes_button.clicked.connect(self.computeVolumes)
+        self.form2.addRow("Average volumes:", self.volumes_button)
 
         self.quit = QtGui.QAction('Quit', self)
         self.quit.setShortcut(QtGui.QKeySequence.Quit)
@@ -103,10 +135,10 @@ class FunctionalDialog(QtGui.QDialog):
         self.frame_le.setText(str(self.frame_time))
         self.deltax_le.setText(str(self.frame_time))
         self.stddevs_le.setText(str(self.cond_stddevs))
-        if kwargs.has_key('length'):
+        if 'length' in kwargs:
             self.cond_time = kwargs['length']
             self.time_le.setText(str(self.cond_time))
-        if kwargs.has_key('conds'):
+        if 'conds' in kwargs:
             conds = kwargs['conds']
             self.cond_le.setText(" ".join([str(i) for i in kwargs['conds']]))
 
@@ -119,9 +151,29 @@ class FunctionalDialog(QtGui.QDialog):
         self.cond_le.setText(" ".join([str(i) for i in conds]))
         self.stddevs_le.setText(str(self.cond_stddevs))
 
+    def setMaskNames(self, names, index=-1):
+        """
+        Resets the images that can be selected as mask.
+        """
+        self.mask_cb.blockSignals(True)
+        self.mask_cb.clear()
+        self.mask_cb.addItems(names)
+        self.mask_cb.setCurrentIndex(index)
+        self.mask_cb.blockSignals(False)
+        self.roi_mask_index = index
+
     def savePreferences(self):
         if testFloat(self.frame_le.text()):
             self.frame_time = float(self.frame_le.text())
+        if testFloat(self.radius_le.text()) and \
+                float(self.radius_le.text()) >= 0:
+            self.roi_radius = float(self.radius_le.text())
+        else:
+            self.radius_le.setText(str(self.roi_radius))
+        self.roi_shape = self.roi_shapes[self.roi_cb.currentIndex()]
+        self.roi_statistic = ['mean', 'median'][
+            self.statistic_cb.currentIndex()]
+        self.roi_mask_index = self.mask_cb.currentIndex()
         self.sigChanged.emit()
 
     def openDesignFile(self):
@@ -129,6 +181,9 @@ class FunctionalDialog(QtGui.QDialog):
         Lets design file to be chosen and emits signal.
         """
         fname = QtGui.QFileDialog.getOpenFileName(self, 'Open file')
+        # PyQt5 returns the filename and the selected filter
+        if isinstance(fname, tuple):
+            fname = fname[0]
         self.sigDesignFile.emit(fname)
 
     def delDesignFile(self):
@@ -137,11 +192,11 @@ class FunctionalDialog(QtGui.QDialog):
     def getFrameTime(self):
         return self.frame_time
 
-    def computeTA(self):
+    def readAverageSettings(self):
         """
-        Checks input for trial averages and emits signal.
+        Reads the trial average settings from the boxes, returns False if they
+        could not be interpreted.
         """
-        # read in boxes and emit signal to trigger the average time plot
         if testFloat(self.deltax_le.text()):
             if float(self.deltax_le.text()) > 1000:
                 QtGui.QMessageBox.warning(self, "Warning",
@@ -150,19 +205,19 @@ class FunctionalDialog(QtGui.QDialog):
         else:
             QtGui.QMessageBox.warning(self, "Warning",
                 "Time sampling could not be interpreted as a float.")
-            return 0
+            return False
         if testFloat(self.time_le.text()):
             self.cond_time = float(self.time_le.text())
         else:
             QtGui.QMessageBox.warning(self, "Warning",
                 "Time could not be interpreted as a float.")
-            return 0
+            return False
         if testFloat(self.stddevs_le.text()):
             self.cond_stddevs = float(self.stddevs_le.text())
         else:
             QtGui.QMessageBox.warning(self, "Warning",
                 "Input could not be interpreted as a float.")
-            return 0
+            return False
         cond_text = self.cond_le.text()
         conditions = cond_text.split()
         self.cond_conds = []
@@ -172,7 +227,23 @@ class FunctionalDialog(QtGui.QDialog):
             else:
                 QtGui.QMessageBox.warning(self, "Warning",
                     "Could not interpret condition index.")
-        self.sigComputeTA.emit()
+        return True
+
+    def computeTA(self):
+        """
+        Checks input for trial averages and emits signal.
+        """
+        # read in boxes and emit signal to trigger the average time plot
+        if self.readAverageSettings():
+            self.sigComputeTA.emit()
+
+    def computeVolumes(self):
+        """
+        Checks input for trial averages and emits the signal to compute them
+        for all voxels.
+        """
+        if self.readAverageSettings():
+            self.sigComputeVolumes.emit()
 
     def closeDialog(self):
         self.close()
@@ -7,6 +7,8 @@ from nibabel.affines import apply_affine
 from nibabel.volumeutils import shape_zoom_affine
 from nibabel import Nifti1Image
 import copy
+import weakref
+from collections import OrderedDict
 
 from .pyqtgraph_vini import *
 from .pyqtgraph_vini.colormap import ColorMap
@@ -14,8 +16,11 @@ from .pyqtgraph_vini.colormap import ColorMap
 from .ImageItemMod import *
 from .ColorMapWidget import *
 from .ImageDialog import *
-from .resample import resample_image
+from .resample import resample_image, sample_coordinates, ResampledGrid, \
+    spline_coefficients, invalid_voxels
+from .InvalidMask import scanData
 from .quaternions import fillpositive, quat2mat, mat2quat
+from .Tracing import span, traced
 
 # try:
 #     from pyvista import pyvista
@@ -29,6 +34,17 @@ class Image(object):
     dimensional images.
     """
 
+    # Number of quantisation levels of the slice indices. The last index is
+    # reserved for voxels that are not finite.
+    QUANT_LEVELS = 65535
+    INVALID_INDEX = 65535
+
+    # Function that maps values through thresholds and a colormap.
+    colormapFunction = staticmethod(mymakeARGB)
+
+    # Whether the resampled data can be replaced by lazy resampling.
+    lazy_capable = True
+
     def __init__(self, filename=None):
 
         # filename string
@@ -44,14 +60,31 @@ class Image(object):
         self.affine_res = None
         # affine used for resampling (voxel coordinates)
         self.affine_res_inv = None
-        # 0 for nearest and 1 for linear
+        # spline order: 0 for nearest, 1 for linear and 3 for cubic
         self.interp_type = 0
+        # spline coefficients and invalid voxels of the data for
+        # interp_type > 1 by frame (None for 3D images) and the data they
+        # were computed from (see interpolatedData)
+        self.spline_cache = OrderedDict()
+        self.spline_source = None
         
         #sform code
         self.sform_code = -1
 
         # For resample to fit, the affine is overwritten with this:
         self.state_affine_over = False
+        # Transformation, shape and interpolation image_res was resampled
+        # with, so that resampling to the same grid can be skipped.
+        self.res_key = None
+        # Lazy mode: instead of the resampled volume only the displayed
+        # voxels are resampled when they are needed (see ResampledGrid).
+        self.lazy = False
+        # (data, stride) of a strided subsample that is shown until the full
+        # data is read (see loadPreviewFromFile), None otherwise.
+        self.preview = None
+        # Deferred: resampled lazily until the viewer has computed the
+        # resampled volume in the background (see setResampled).
+        self.deferred = False
 
         # Saves where to saturate of clip values.
         self.clippings_pos = [False, False]
@@ -62,9 +95,26 @@ class Image(object):
         # Coordinates of the image slices.
         self.coord = [0,0,0]
         self.two_cm = True
-        self.image_slices_pos = [None, None, None]
-        self.image_slices_neg = [None, None, None]
         self.image_slices = [None, None, None]
+        # Rendered planes shared by all windows showing this image, keyed by
+        # plane (see ImageItemMod.setImage).
+        self.render_cache = {}
+
+        # Displayed planes quantised to uint16 indices into the effective
+        # lookup table, so that threshold and colormap changes only rebuild
+        # the lookup table and re-index.
+        self.quant_range = None
+        self.quant_step = 1.0
+        self.slice_indices = [None, None, None]
+        self.slice_indices_key = [None, None, None]
+        # Part of each plane that is sliced as (first, last) along both axes
+        # of the plane and a step, or None for the whole plane. The viewer
+        # sets it to what its views show (see setPlaneWindows).
+        self.plane_windows = [None, None, None]
+        # windows that the current image_slices were sliced with
+        self.slice_windows = [None, None, None]
+        self.effective_lut = {}
+        self.effective_lut_key = {}
 
         self.threshold_pos = [0.0, 0.0]
         self.threshold_neg = [0.0, 0.0]
@@ -74,6 +124,9 @@ class Image(object):
 
         # Has to be kept up to date when resampling or changing frame (4D).
         self.extremum = [0, 0]
+        # Whether the data has NaN voxels (see scanData). They stay NaN in
+        # the data and are shown transparent.
+        self.has_invalid = False
         self.deadzone = 1e-7 #for two colormaps: excludes values from negative cmap (otherwise 0 = blue)
 
         # Use as an alpha for the whole image.
@@ -172,7 +225,7 @@ class Image(object):
         return out
 
     def getOriginalDimensions(self):
-        return self.image.get_fdata().shape
+        return self.image.shape
 
     def getDimensions(self):
         return self.image_res.shape
@@ -292,6 +345,39 @@ class Image(object):
     def setInterpolation(self, interp_type):
         self.interp_type = interp_type
 
+    def splineCoefficients(self, data, frame=None):
+        """
+        Returns the spline coefficients of 'data' (the frame 'frame' of a 4D
+        image) for interp_type and its invalid voxels (see
+        resample.invalid_voxels). They are computed once and kept for the
+        last few frames until the image data changes.
+        """
+        if self.spline_source is not self.image:
+            self.spline_cache.clear()
+            self.spline_source = self.image
+        key = (self.interp_type, frame)
+        if key in self.spline_cache:
+            self.spline_cache.move_to_end(key)
+            return self.spline_cache[key]
+        # infinite values are not noted in has_invalid, the scan costs
+        # little next to the spline filter
+        coefficients = (spline_coefficients(data, self.interp_type),
+                        invalid_voxels(data))
+        self.spline_cache[key] = coefficients
+        while len(self.spline_cache) > 4:
+            self.spline_cache.popitem(last=False)
+        return coefficients
+
+    def interpolatedData(self):
+        """
+        Returns what resample_image interpolates with prefilter=False and
+        its invalid voxels: the data and None, or its splineCoefficients for
+        spline interpolation.
+        """
+        if self.interp_type > 1:
+            return self.splineCoefficients(self.image.get_fdata())
+        return self.image.get_fdata(), None
+
     def presetCMPos(self, name):
         """
         Loads a predefined positive colormap with the name name.
@@ -310,37 +396,127 @@ class Image(object):
     def setClippingsNeg(self, clpg_low, clpg_high):
         self.clippings_neg = [clpg_low, clpg_high]
 
+    def resamplingKey(self, affine_res_inv, shape, affine_over):
+        """
+        Returns what determines the resampled data besides the image data.
+        """
+        return (affine_over, tuple(np.asarray(affine_res_inv).ravel()),
+                tuple(np.asarray(shape).astype(int)), self.interp_type)
+
+    def isResampled(self, affine_res_inv, shape, affine_over=False):
+        """
+        Returns True if image_res already holds the data resampled with this
+        transformation, shape and the current interpolation.
+        """
+        return (self.image_res is not None and self.res_key ==
+                self.resamplingKey(affine_res_inv, shape, affine_over))
+
     # Resample with given affine
     def resample_overaffine(self, shape, t_affine, over_affine):
         """
         Resamples the image to 'shape' with the transformation 'affine'
         overwriting its own transformation with 'over_affine'.
         """
-        self.affine_res_inv = np.dot(np.linalg.inv(over_affine), t_affine)
-        self.image_res = resample_image(
-            self.image.get_fdata(), affine=self.affine_res_inv,
-            shape=shape, interpolation=self.interp_type)
+        affine_res_inv = np.dot(np.linalg.inv(over_affine), t_affine)
+        if self.isResampled(affine_res_inv, shape, True):
+            return
+        self.affine_res_inv = affine_res_inv
         self.res_shape = shape
+        self.image_res = self.resampledData()
         self.state_affine_over = True
+        self.res_key = self.resamplingKey(affine_res_inv, shape, True)
 
     def resample(self, shape, affine):
         """
         Resamples the image to 'shape' with the transformation 'affine'.
         """
-        self.affine_res_inv = np.dot(np.linalg.inv(self.image.affine), affine)
-        self.image_res = resample_image(
-            self.image.get_fdata(), affine=self.affine_res_inv,
-            shape=shape, interpolation=self.interp_type)
+        affine_res_inv = np.dot(np.linalg.inv(self.image.affine), affine)
+        if self.isResampled(affine_res_inv, shape):
+            return
+        self.affine_res_inv = affine_res_inv
         self.res_shape = shape
+        self.image_res = self.resampledData()
         self.state_affine_over = False
+        self.res_key = self.resamplingKey(affine_res_inv, shape, False)
 
     def reresample(self):
         """
         Resamples with already given affine.
         """
-        self.image_res = resample_image(
-            self.image.get_fdata(), affine=self.affine_res_inv,
-            shape=self.res_shape, interpolation=self.interp_type)
+        self.res_key = None
+        self.image_res = self.resampledData()
+
+    def resampledData(self):
+        """
+        Returns the data resampled with affine_res_inv to res_shape.
+        """
+        if self.preview is not None:
+            data, stride = self.preview
+            mapping = np.dot(np.diag([1. / stride] * 3 + [1]),
+                             self.affine_res_inv)
+            # the coarse preview is at most interpolated linearly
+            return ResampledGrid(
+                data, mapping, self.res_shape, min(self.interp_type, 1))
+        if self.deferred:
+            # until the background resampling is done, which is at most
+            # interpolated linearly
+            return ResampledGrid(
+                self.image.get_fdata(), self.affine_res_inv, self.res_shape,
+                min(self.interp_type, 1))
+        data, invalid = self.interpolatedData()
+        if self.lazy:
+            return ResampledGrid(
+                data, self.affine_res_inv, self.res_shape, self.interp_type,
+                prefilter=False, invalid=invalid)
+        return resample_image(
+            data, affine=self.affine_res_inv, shape=self.res_shape,
+            interpolation=self.interp_type, prefilter=False, invalid=invalid)
+
+    def replaceData(self, image):
+        """
+        Replaces the image data by the data of the nifti object 'image' with
+        the same number of dimensions. Thresholds and colormaps are kept, the
+        data has to be resampled again.
+        """
+        self.image = image
+        self.extremum[0], self.extremum[1], self.has_invalid = scanData(
+            image.get_fdata())
+        self.hist_saved = False
+        self.res_key = None
+
+    def replacePreview(self, image, scan, resampled=None, key=None):
+        """
+        Replaces the preview by the full data of the nifti object 'image'.
+        'scan' is what scanData returns for the data. 'resampled' is the data
+        resampled with the resampling key 'key', it is used if the image was
+        not resampled differently in the meantime.
+        """
+        self.image = image
+        self.preview = None
+        self.extremum[0], self.extremum[1], self.has_invalid = scan
+        self.hist_saved = False
+        if self.image_res is None:
+            return
+        if resampled is not None and key is not None and \
+                key == self.res_key and not self.lazy:
+            self.image_res = resampled
+        else:
+            # resampled again in the background
+            self.deferred = not self.lazy
+            self.reresample()
+
+    def setResampled(self, resampled, key):
+        """
+        Sets the data resampled in the background with the resampling key
+        'key' for a deferred image. Returns False if the image was resampled
+        differently in the meantime and the data can't be used.
+        """
+        if key != self.res_key or self.lazy:
+            return False
+        self.image_res = resampled
+        self.deferred = False
+        self.hist_saved = False
+        return True
 
     def getAffine(self):
         return self.image.affine
@@ -361,13 +537,94 @@ class Image(object):
             print("Image doesn't have a affine inverse used for resampling \
             yet!")
 
+    def sampleCoordinates(self, coords, interpolation=0, mapping=None):
+        """
+        Returns the values at N coordinates ((N, 3) array) with nearest
+        neighbour (0) or trilinear (1) interpolation.
+
+        'mapping' maps the coordinates to voxels of this image, by default
+        they are coordinates of the resampled grid (mapped with
+        affine_res_inv). All coordinates are mapped in one matrix product.
+        """
+        if mapping is None:
+            mapping = self.affine_res_inv
+        coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+        voxels = np.dot(coords, mapping[:3,:3].T) + mapping[:3,3]
+        if self.preview is not None:
+            return sample_coordinates(
+                self.preview[0], voxels / self.preview[1], interpolation)
+        return sample_coordinates(self.heldData(), voxels, interpolation)
+
+    def heldData(self):
+        """
+        Returns the data of the image without making nibabel cache a float64
+        copy of it: the array the image was made from or the one nibabel
+        holds in memory, or else the data as stored, read without caching.
+        """
+        data = self.image.dataobj
+        if isinstance(data, np.ndarray) or not self.image.in_memory:
+            return np.asanyarray(data)
+        return self.cachedData()
+
+    def nonzeroVoxels(self):
+        """
+        Returns the voxels ((N, 3) array) where the data is not zero, e.g. of
+        a mask.
+        """
+        return np.argwhere(self.heldData() != 0)
+
+    def cachedData(self):
+        """
+        Returns the data nibabel holds in memory for an image read from a
+        file, which get_fdata caches for 3D images.
+        """
+        return self.image.get_fdata(caching='unchanged')
+
+    def setLazy(self, state, resample=True):
+        """
+        Switches lazy mode on or off and resamples again, or with
+        resample=False at the next resampling.
+        """
+        if state == self.lazy or not self.lazy_capable:
+            return
+        self.lazy = state
+        self.res_key = None
+        if resample and self.image_res is not None and \
+                self.affine_res_inv is not None:
+            self.reresample()
+
+    def resampledBytes(self, shape):
+        """
+        Returns the bytes the resampled data would take on a grid of 'shape'.
+        """
+        if self.lazy:
+            return 0
+        return int(np.prod(np.asarray(shape, dtype=float))) * \
+            np.dtype(float).itemsize
+
+    def releaseCaches(self):
+        """
+        Drops what is rebuilt when needed: lookup tables, the histogram,
+        the rendered planes, spline coefficients and nibabel's cache of the
+        data.
+        """
+        self.spline_cache.clear()
+        self.effective_lut = {}
+        self.effective_lut_key = {}
+        self.hist_saved = False
+        self.hist = None
+        self.render_cache.clear()
+        self.image.uncache()
+
     def setUnresampled(self):
         # TODO: setze self.affine_res_inv = np.eye(4)?
+        self.res_key = None
         self.image_res = self.image.get_fdata()
 
     def setHistogram(self):
         c_hist = self.getHistogram()
 
+    @traced('Image.slice')
     def slice(self, coord=None):
         """
         Slices through the resampled data cube and applies the colormaps.
@@ -380,52 +637,152 @@ class Image(object):
         if not self.state:
             return 0
 
-        [self.image_slices_pos[0], truth] = \
-            mymakeARGB(
-                self.image_res[int(self.coord[0]),:,:], lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-        [self.image_slices_pos[1], truth] = \
-            mymakeARGB(
-                self.image_res[:,int(self.coord[1]),:], lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-        [self.image_slices_pos[2], truth] = \
-            mymakeARGB(
-                self.image_res[:,:,int(self.coord[2])], lut=self.cmap_pos,
+        lut = self.getEffectiveLut()
+        for plane in range(3):
+            self.image_slices[plane] = np.take(
+                lut, self.getSliceIndices(plane), axis=0)
+
+    def planeData(self, plane, window=None):
+        """
+        Returns the resampled data of the displayed plane (0: sagittal,
+        1: coronal, 2: transverse), restricted to 'window' if given.
+        """
+        index = [slice(None)] * 3
+        index[plane] = int(self.coord[plane])
+        if window is not None:
+            first0, last0, first1, last1, step = window
+            axes = [axis for axis in range(3) if axis != plane]
+            index[axes[0]] = slice(first0, last0, step)
+            index[axes[1]] = slice(first1, last1, step)
+        return self.image_res[tuple(index)]
+
+    def setPlaneWindows(self, windows):
+        """
+        Sets the parts of the planes to slice. Returns for every plane
+        whether its window changed.
+        """
+        changed = [self.plane_windows[plane] != windows[plane]
+                   for plane in range(3)]
+        self.plane_windows = list(windows)
+        return changed
+
+    def getImageRects(self):
+        """
+        Returns where the image arrays lie in their planes as (x, y, width,
+        height) in voxels of the resampled grid.
+        """
+        rects = []
+        for plane in range(3):
+            if self.image_slices[plane] is None:
+                rects.append(None)
+                continue
+            shape = self.image_slices[plane].shape
+            window = self.slice_windows[plane]
+            if window is None:
+                rects.append((0, 0, shape[0], shape[1]))
+            else:
+                rects.append((window[0], window[2], shape[0]*window[4],
+                              shape[1]*window[4]))
+        return rects
+
+    def updateQuantization(self):
+        """
+        Sets the quantisation range of the slice indices to the value range of
+        the image.
+
+        If the extrema are integers the step is chosen such that integer
+        values fall exactly onto quantisation levels.
+        """
+        low, high = float(self.extremum[0]), float(self.extremum[1])
+        if not np.isfinite(low) or not np.isfinite(high):
+            low, high = 0.0, 0.0
+        if (low, high) == self.quant_range:
+            return
+        span = high - low
+        n_steps = self.QUANT_LEVELS - 1
+        if span <= 0:
+            self.quant_step = 1.0
+        elif low == int(low) and high == int(high) and span <= n_steps:
+            self.quant_step = 1.0 / np.floor(n_steps / span)
+        else:
+            self.quant_step = span / n_steps
+        self.quant_range = (low, high)
+
+    def quantizeSlice(self, data):
+        """
+        Returns the uint16 lookup table indices for the values in data.
+        """
+        self.updateQuantization()
+        indices = np.subtract(data, self.quant_range[0], dtype=np.float64)
+        indices *= 1.0 / self.quant_step
+        np.rint(indices, out=indices)
+        np.clip(indices, 0, self.QUANT_LEVELS - 1, out=indices)
+        invalid = np.isnan(indices)
+        has_invalid = invalid.any()
+        if has_invalid:
+            indices[invalid] = 0
+        indices = indices.astype(np.uint16)
+        if has_invalid:
+            indices[invalid] = self.INVALID_INDEX
+        return indices
+
+    def getSliceIndices(self, plane):
+        """
+        Returns the quantised indices of the window of the displayed plane.
+
+        The indices are only recomputed if the resampled data, the slice
+        position, the window or the value range changed.
+        """
+        self.updateQuantization()
+        window = self.plane_windows[plane]
+        key = (int(self.coord[plane]), self.quant_range, window)
+        cached = self.slice_indices_key[plane]
+        if (cached is None or cached[0]() is not self.image_res or
+                cached[1] != key):
+            self.slice_indices[plane] = self.quantizeSlice(
+                self.planeData(plane, window))
+            # weak reference, the old resampled data may be freed
+            self.slice_indices_key[plane] = (weakref.ref(self.image_res), key)
+        self.slice_windows[plane] = window
+        return self.slice_indices[plane]
+
+    def getEffectiveLut(self, function=None):
+        """
+        Returns the RGBA lookup table for the quantised indices combining
+        thresholds, clippings and both colormaps.
+
+        function: colormapping function, defaults to colormapFunction.
+        """
+        if function is None:
+            function = self.colormapFunction
+        self.updateQuantization()
+        use_neg = (self.two_cm and
+                   float(self.threshold_neg[0]) != float(self.threshold_neg[1]))
+        key = (self.quant_range, self.quant_step,
+               tuple(self.threshold_pos), tuple(self.threshold_neg), use_neg)
+        cached = self.effective_lut_key.get(function)
+        if (cached is not None and cached[0] == key and
+                cached[1] is self.cmap_pos and cached[2] is self.cmap_neg):
+            return self.effective_lut[function]
+        values = self.quant_range[0] + \
+            self.quant_step * np.arange(self.QUANT_LEVELS, dtype=np.float64)
+        values = values.reshape(-1, 1)
+        lut = np.empty((self.QUANT_LEVELS + 1, 4), dtype=np.ubyte)
+        with span(function.__name__):
+            lut[:-1] = function(
+                values, lut=self.cmap_pos,
                 levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-
-        if self.two_cm:
-            [self.image_slices_neg[0], truth] = \
-                mymakeARGB(
-                    self.image_res[int(self.coord[0]),:,:], self.cmap_neg,
+                useRGBA=True)[0][:,0,:]
+            if use_neg:
+                lut[:-1] += function(
+                    values, lut=self.cmap_neg,
                     levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-            [self.image_slices_neg[1], truth] = \
-                mymakeARGB(
-                    self.image_res[:,int(self.coord[1]),:], self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-            [self.image_slices_neg[2], truth] = \
-                mymakeARGB(
-                    self.image_res[:,:,int(self.coord[2])], self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-
-        # add positive and negative parts
-        if (self.two_cm and
-                float(self.threshold_neg[0]) != float(self.threshold_neg[1])):
-            self.image_slices[0] = \
-                self.image_slices_pos[0] + self.image_slices_neg[0]
-            self.image_slices[1] = \
-                self.image_slices_pos[1] + self.image_slices_neg[1]
-            self.image_slices[2] = \
-                self.image_slices_pos[2] + self.image_slices_neg[2]
-        else:
-            self.image_slices[0] = self.image_slices_pos[0]
-            self.image_slices[1] = self.image_slices_pos[1]
-            self.image_slices[2] = self.image_slices_pos[2]
+                    useRGBA=True)[0][:,0,:]
+        # Voxels without a value (NaN) are transparent.
+        lut[self.INVALID_INDEX] = 0
+        self.effective_lut[function] = lut
+        self.effective_lut_key[function] = (key, self.cmap_pos, self.cmap_neg)
+        return lut
 
     def mosaicSlice(self, plane, coord):
         """
@@ -438,16 +795,9 @@ class Image(object):
             sliced = self.image_res[:,coord,:]
         if plane == 't':
             sliced = self.image_res[:,:,coord]
-        [slice_rgba, truth] = mymakeARGB(
-            sliced, self.cmap_pos, levels=[self.threshold_pos[0],
-            self.threshold_pos[1]], useRGBA=True)
-        if (self.two_cm and
-                float(self.threshold_neg[0]) != float(self.threshold_neg[1])):
-            [slice_neg, truth] = mymakeARGB(
-                sliced, self.cmap_neg, levels=[self.threshold_neg[0],
-                self.threshold_neg[1]], useRGBA=True)
-            slice_rgba = np.add(slice_rgba, slice_neg)
-        return slice_rgba
+        return np.take(
+            self.getEffectiveLut(mymakeARGB), self.quantizeSlice(sliced),
+            axis=0)
 
     def getImageArrays(self):
         return self.image_slices
@@ -528,7 +878,17 @@ class Image(object):
             xmin = self.getMin()
             xmax = self.getMax()
             hist_bins = np.linspace(xmin, xmax, targetHistogramSize)
-            self.hist = np.histogram(self.image_res[self.image_res!=0], bins=hist_bins)
+            # in lazy mode the voxels of the image, not of the grid
+            if self.preview is not None:
+                data = self.preview[0]
+            elif self.lazy or self.deferred:
+                data = self.image.get_fdata()
+            else:
+                data = self.image_res
+            values = data[data!=0]
+            if self.has_invalid:
+                values = values[~np.isnan(values)]
+            self.hist = np.histogram(values, bins=hist_bins)
             self.hist_saved = True
         return self.hist[1][:-1], self.hist[0]
 
@@ -556,13 +916,29 @@ class Image(object):
     def getMax(self):
         return self.extremum[1]
 
+    def extremeIndex(self, data, extreme):
+        """
+        Returns the flat index of the maximum ('max') or minimum ('min') of
+        data, NaNs are ignored.
+        """
+        if isinstance(data, ResampledGrid):
+            return data.argExtreme(getattr(np, 'nanarg' + extreme))
+        if not self.has_invalid:
+            return getattr(data, 'arg' + extreme)()
+        try:
+            return getattr(np, 'nanarg' + extreme)(data)
+        except ValueError:
+            # only NaNs
+            return 0
+
     def getMaxCoord(self, radius=0):
         """
         Return the coordinate of the local maximum within a cube of given width.
         """
         if (radius == 0):
             return list(np.unravel_index(
-                self.image_res.argmax(), self.image_res.shape))
+                self.extremeIndex(self.image_res, 'max'),
+                self.image_res.shape))
         else:
             shapes = self.image_res.shape
             x_range = range(max(0, self.coord[0]-radius),
@@ -574,9 +950,8 @@ class Image(object):
             new_shape = [x_range[-1]-x_range[0]+1,
                          y_range[-1]-y_range[0]+1,
                          z_range[-1]-z_range[0]+1]
-            arg_max = \
-                self.image_res[x_range,:,:][:,y_range,:][:,:,z_range]\
-                .argmax()
+            arg_max = self.extremeIndex(
+                self.image_res[x_range,:,:][:,y_range,:][:,:,z_range], 'max')
             arg_coord = list(np.unravel_index(arg_max, new_shape))
             arg_coord[0] += x_range[0]
             arg_coord[1] += y_range[0]
@@ -589,7 +964,8 @@ class Image(object):
         """
         if (radius == 0):
             return list(np.unravel_index(
-                self.image_res.argmin(), self.image_res.shape))
+                self.extremeIndex(self.image_res, 'min'),
+                self.image_res.shape))
         else:
             shapes = self.image_res.shape
             x_range = range(max(0, self.coord[0]-radius),
@@ -601,9 +977,8 @@ class Image(object):
             new_shape =  [x_range[-1]-x_range[0]+1,
                           y_range[-1]-y_range[0]+1,
                           z_range[-1]-z_range[0]+1]
-            arg_max = \
-                self.image_res[x_range,:,:][:,y_range,:][:,:,z_range]\
-                .argmin()
+            arg_max = self.extremeIndex(
+                self.image_res[x_range,:,:][:,y_range,:][:,:,z_range], 'min')
             arg_coord = list(np.unravel_index(arg_max, new_shape))
             arg_coord[0] += x_range[0]
             arg_coord[1] += y_range[0]
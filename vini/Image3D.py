@@ -1,6 +1,7 @@
 from .pyqtgraph_vini import *
 
 from .Image import Image
+from .InvalidMask import scanData
 from .ColorMapWidget import *
 # try:
 #     from pyvista import pyvista
@@ -22,7 +23,8 @@ class Image3D(Image):
         if 'filename' in kwargs:
             self.loadImageFromFile(kwargs['filename'])
         if 'image' in kwargs:
-            self.loadImageFromObject(kwargs['image'], kwargs['color'])
+            self.loadImageFromObject(
+                kwargs['image'], kwargs['color'], kwargs.get('scan'))
 
     def type(self):
         """
@@ -36,14 +38,16 @@ class Image3D(Image):
     def type_d(self):
         return "3D"
 
-    def loadImageFromObject(self, img, color=False):
+    def loadImageFromObject(self, img, color=False, scan=None):
 
         self.image = img
 
         self.image_res = img.get_fdata()
 
-        self.extremum[0] = img.get_fdata().min()
-        self.extremum[1] = img.get_fdata().max()
+        # 'scan' is what scanData returns for the data, if already known
+        if scan is None:
+            scan = scanData(img.get_fdata())
+        self.extremum[0], self.extremum[1], self.has_invalid = scan
 
         self.two_cm = color
         self.dialog.setPreferences(
@@ -1,20 +1,25 @@
 from .pyqtgraph_vini.Qt import QtCore, QtGui
 import sys
 import os.path
+import warnings
 import numpy as np
 from nibabel import load
 from nibabel.affines import apply_affine
 from nibabel.volumeutils import shape_zoom_affine
 from nibabel import Nifti1Image
 import copy
+from collections import OrderedDict
 
 from .pyqtgraph_vini import *
 
 from .FunctionalDialog import *
 from .AveragePlot import *
+from .ConditionAverage import averagingMatrix
 from .Image import Image
+from .InvalidMask import scanData
 from .resample import resample_image
 from .TimePlot import TimePlot
+from .Tracing import traced
 from .testInputs import testFloat, testInteger
 # try:
 #     from pyvista import pyvista
@@ -27,6 +32,12 @@ class Image4D(Image):
     Class to store 4 dimensional images.
     """
 
+    colormapFunction = staticmethod(makeARGB)
+
+    # frames are resampled one at a time (see also the slice state of the
+    # viewer)
+    lazy_capable = False
+
     def __init__(self, **kwargs):
 
         super(Image4D, self).__init__(filename=None)
@@ -37,6 +48,11 @@ class Image4D(Image):
         # better call this TR?
         self.frame_time = 1
         self.image_slice_res = [None, None, None]
+        # buffer with spare frames used when frames are appended
+        self.frame_store = None
+        # planes through the crosshair for all frames (see stackedSlice)
+        self.plane_stacks = None
+        self.plane_stacks_key = None
 
         # while playing don't use the fully resampled image for slices
         # This might not be needed  anymore
@@ -47,6 +63,20 @@ class Image4D(Image):
         self.time_averages = None
         self.design = None
 
+        # Region the time course is computed over: 'voxel', 'sphere', 'box'
+        # or 'mask', its radius in mm and the statistic over its voxels.
+        self.roi_shape = 'voxel'
+        self.roi_radius = 5.0
+        self.roi_statistic = 'mean'
+        # 3D images that can be used as mask and the selected one
+        self.roi_masks = []
+        self.roi_mask = None
+        # voxel offsets of the sphere or box for the current settings
+        self.roi_offsets = None
+        self.roi_offsets_key = None
+        # time courses by (region, frame range)
+        self.time_courses = OrderedDict()
+
         self.funcdialog = FunctionalDialog()
         self.funcdialog.sigChanged.connect(self.changedFuncProperties)
         self.funcdialog.sigDelDesMat.connect(self.delDesignFile)
@@ -56,7 +86,8 @@ class Image4D(Image):
         if 'filename' in kwargs:
             self.loadImageFromFile(kwargs['filename'])
         if 'image' in kwargs:
-            self.loadImageFromObject(kwargs['image'], kwargs['color'])
+            self.loadImageFromObject(
+                kwargs['image'], kwargs['color'], kwargs.get('scan'))
 
     def type(self):
         """
@@ -70,15 +101,17 @@ class Image4D(Image):
     def type_d(self):
         return "4D"
 
-    def loadImageFromObject(self, img, color=False):
+    def loadImageFromObject(self, img, color=False, scan=None):
 
         self.image = img
 
         self.image_res = img.get_data()[:,:,:,self.frame]
         self.time_dim = img.get_data().shape[3] # set beginning from zero.
 
-        self.extremum[0] = img.get_data().min()
-        self.extremum[1] = img.get_data().max()
+        # 'scan' is what scanData returns for the data, if already known
+        if scan is None:
+            scan = scanData(img.get_data())
+        self.extremum[0], self.extremum[1], self.has_invalid = scan
 
         self.two_cm = color
         self.dialog.setPreferences(two_cm=self.two_cm, clippings_pos=self.clippings_pos, clippings_neg=self.clippings_neg)
@@ -87,6 +120,62 @@ class Image4D(Image):
         self.setNegThresholdsDefault()
         self.slice()
 
+    def replaceData(self, image):
+        """
+        Replaces the image data, the number of frames may change.
+        """
+        self.image = image
+        self.frame_store = None
+        self.time_dim = image.get_data().shape[3]
+        self.frame = min(self.frame, self.time_dim-1)
+        self.extremum[0], self.extremum[1], self.has_invalid = scanData(
+            image.get_data())
+        self.hist_saved = False
+        self.res_key = None
+        self.time_courses.clear()
+
+    def appendFrames(self, frames):
+        """
+        Appends 3D volumes of the same shape as the frames at the end.
+
+        The data is kept in a buffer with room for more frames that is
+        doubled when full, so earlier frames are neither decoded nor copied
+        again for every new volume.
+        """
+        frames = [np.asarray(frame).reshape(frame.shape[:3])
+                  for frame in frames]
+        if len(frames) == 0:
+            return
+        shape = self.image.shape[:3]
+        for frame in frames:
+            if frame.shape != shape:
+                raise ValueError(
+                    "frame of shape {} does not match the image shape "
+                    "{}".format(frame.shape, shape))
+        new = len(frames)
+        if self.frame_store is None or \
+                self.time_dim + new > self.frame_store.shape[3]:
+            capacity = max(2*(self.time_dim + new), 8)
+            data = self.image.get_data()
+            dtype = np.result_type(data.dtype, *[f.dtype for f in frames])
+            store = np.empty(shape + (capacity,), dtype=dtype)
+            store[..., :self.time_dim] = data[..., :self.time_dim]
+            self.frame_store = store
+        for t, frame in enumerate(frames):
+            self.frame_store[..., self.time_dim+t] = frame
+        added = self.frame_store[..., self.time_dim:self.time_dim+new]
+        # the statistics and the NaN check only need the new frames
+        low, high, invalid = scanData(added)
+        self.has_invalid = self.has_invalid or invalid
+        self.time_dim += new
+        # a view on the buffer, the header takes its shape from the data
+        self.image = type(self.image)(
+            self.frame_store[..., :self.time_dim], self.image.affine,
+            self.image.header)
+        self.extremum[0] = min(self.extremum[0], low)
+        self.extremum[1] = max(self.extremum[1], high)
+        self.hist_saved = False
+
     def getIntensity(self, coord=None):
         """
         Returns the intensity at the current coordinate.
@@ -119,6 +208,12 @@ class Image4D(Image):
             self.frame = new_frame
             self.hist_saved = False
 
+    def releaseCaches(self):
+        super(Image4D, self).releaseCaches()
+        self.time_courses.clear()
+        self.plane_stacks = None
+        self.plane_stacks_key = None
+
     def getBounds(self):
         adim, bdim, cdim = self.image.shape[0:3]
         adim -= 1
@@ -136,59 +231,101 @@ class Image4D(Image):
         box = np.dot(self.image.affine, box)[:3]
         return list(zip(box.min(axis=-1), box.max(axis=-1)))
 
+    def resamplingKey(self, affine_res_inv, shape, affine_over):
+        """
+        Same as for 3D images but the resampled data depends on the frame.
+        """
+        return (super(Image4D, self).resamplingKey(
+            affine_res_inv, shape, affine_over) + (self.frame,))
+
+    def interpolatedData(self):
+        """
+        Same as for 3D images for the current frame.
+        """
+        data = self.image.get_data()[:,:,:,self.frame]
+        if self.interp_type > 1:
+            return self.splineCoefficients(data, self.frame)
+        return data, None
+
+    def cachedData(self):
+        """
+        Same as for 3D images, but 4D images are read with get_data.
+        """
+        return self.image.get_data(caching='unchanged')
+
     def resample_overaffine(self, shape, t_affine, over_affine):
         """
         Resamples the image to 'shape' with the transformation 'affine'
         overwriting its own transformation with 'over_affine'.
         """
-        self.affine_res_inv = np.dot(np.linalg.inv(over_affine), t_affine)
+        affine_res_inv = np.dot(np.linalg.inv(over_affine), t_affine)
+        if self.isResampled(affine_res_inv, shape, True):
+            return
+        self.affine_res_inv = affine_res_inv
         self.res_shape = shape
+        data, invalid = self.interpolatedData()
         self.image_res = resample_image(
-            self.image.get_data()[:,:,:,self.frame],
-            affine=self.affine_res_inv, shape=shape,
-            interpolation=self.interp_type)
+            data, affine=self.affine_res_inv, shape=shape,
+            interpolation=self.interp_type, prefilter=False, invalid=invalid)
         self.state_affine_over = True
+        self.res_key = self.resamplingKey(affine_res_inv, shape, True)
 
     def resample(self, shape, affine):
         """
         Resamples the image to 'shape' with the transformation 'affine'.
         """
         t_affine = np.dot(np.linalg.inv(self.image.affine), affine)
+        if self.isResampled(t_affine, shape):
+            return
         self.res_shape = shape
+        data, invalid = self.interpolatedData()
         self.image_res = resample_image(
-            self.image.get_data()[:,:,:,self.frame], affine=t_affine,
-            shape=shape, interpolation=self.interp_type)
-        self.affine_res_inv = np.dot(np.linalg.inv(self.image.affine), affine)
+            data, affine=t_affine, shape=shape,
+            interpolation=self.interp_type, prefilter=False, invalid=invalid)
+        self.affine_res_inv = t_affine
         self.state_affine_over = False
+        self.res_key = self.resamplingKey(t_affine, shape, False)
 
     def reresample(self):
         """
         Resample frame with already known affine.
         """
+        self.res_key = None
+        data, invalid = self.interpolatedData()
         self.image_res = resample_image(
-            self.image.get_data()[:,:,:,self.frame],
-            affine=self.affine_res_inv, shape=self.res_shape,
-            interpolation=self.interp_type)
+            data, affine=self.affine_res_inv, shape=self.res_shape,
+            interpolation=self.interp_type, prefilter=False, invalid=invalid)
 
     def resample_frame(self):
         """
         Same as reresample???
         """
+        self.res_key = None
+        data, invalid = self.interpolatedData()
         self.image_res = resample_image(
-            self.image.get_data()[:,:,:,self.frame],
-            affine=self.affine_res_inv, shape=self.res_shape,
-            interpolation=self.interp_type)
+            data, affine=self.affine_res_inv, shape=self.res_shape,
+            interpolation=self.interp_type, prefilter=False, invalid=invalid)
 
-    def resample_slice(self, shape, affine):
+    def sliceMapping(self, affine):
         """
-        Resamples only current slices.
+        Returns the mapping from the grid of the viewer with 'affine' to the
+        voxels of the image.
         """
-        
-        t_affine = np.dot(np.linalg.inv(self.image.affine), affine)
         if self.state_affine_over:
             # TODO: use this as default without if-clause?
             # doesn't hurt to leave this here
-            t_affine = self.affine_res_inv
+            return self.affine_res_inv
+        return np.dot(np.linalg.inv(self.image.affine), affine)
+
+    def resample_slice(self, shape, affine):
+        """
+        Resamples only current slices.
+        """
+        
+        t_affine = self.sliceMapping(affine)
+        # the spline coefficients of the frame are computed once for all
+        # three planes
+        data, invalid = self.interpolatedData()
 
         n_coord = np.dot(t_affine[0:3,0:3], self.coord)
         n_coord = np.zeros((3,1))
@@ -199,8 +336,9 @@ class Image4D(Image):
         shape_0 = np.copy(shape)
         shape_0[0] = 1
         self.image_slice_res_sa = resample_image(
-            self.image.get_data()[:,:,:,self.frame], affine=t_affine_0,
-            shape=shape_0, interpolation=self.interp_type)[0,:,:]
+            data, affine=t_affine_0, shape=shape_0,
+            interpolation=self.interp_type, prefilter=False,
+            invalid=invalid)[0,:,:]
         
         self.xhairval = self.image_slice_res_sa[self.coord[1], self.coord[2]]
         
@@ -215,8 +353,9 @@ class Image4D(Image):
        
         
         self.image_slice_res_co = resample_image(
-            self.image.get_data()[:,:,:,self.frame], affine=t_affine_1,
-            shape=shape_1, interpolation=self.interp_type)[:,0,:]
+            data, affine=t_affine_1, shape=shape_1,
+            interpolation=self.interp_type, prefilter=False,
+            invalid=invalid)[:,0,:]
         n_coord = np.zeros((3,1))
         n_coord[2] = self.coord[2]
         shift = np.dot(t_affine[0:3,0:3], n_coord)
@@ -225,58 +364,96 @@ class Image4D(Image):
         shape_2 = np.copy(shape)
         shape_2[2] = 1
         self.image_slice_res_tr = resample_image(
-            self.image.get_data()[:,:,:,self.frame], affine=t_affine_2,
-            shape=shape_2, interpolation=self.interp_type)[:,:,0]
-
-        [self.image_slices_pos[0], truth] = \
-            makeARGB(
-                self.image_slice_res_sa, lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-        [self.image_slices_pos[1], truth] = \
-            makeARGB(
-                self.image_slice_res_co, lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-        [self.image_slices_pos[2], truth] = \
-            makeARGB(
-                self.image_slice_res_tr, lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
+            data, affine=t_affine_2, shape=shape_2,
+            interpolation=self.interp_type, prefilter=False,
+            invalid=invalid)[:,:,0]
+
+        lut = self.getEffectiveLut()
+        self.slice_windows = [None, None, None]
+        self.image_slices[0] = np.take(
+            lut, self.quantizeSlice(self.image_slice_res_sa), axis=0)
+        self.image_slices[1] = np.take(
+            lut, self.quantizeSlice(self.image_slice_res_co), axis=0)
+        self.image_slices[2] = np.take(
+            lut, self.quantizeSlice(self.image_slice_res_tr), axis=0)
+
+    def planeStacksKey(self, shape, affine):
+        """
+        Returns what the plane stacks for the grid of 'shape' with 'affine'
+        depend on.
+        """
+        self.updateQuantization()
+        return (tuple(int(c) for c in self.coord),
+                tuple(int(n) for n in shape),
+                self.sliceMapping(affine).tobytes(), self.interp_type,
+                self.quant_range, self.quant_step, self.time_dim)
 
-        if self.two_cm:
-            [self.image_slices_neg[0], truth] = \
-                makeARGB(
-                    self.image_slice_res_sa, self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-            [self.image_slices_neg[1], truth] = \
-                makeARGB(
-                    self.image_slice_res_co, self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-            [self.image_slices_neg[2], truth] = \
-                makeARGB(
-                    self.image_slice_res_tr, self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-
-        # add positive and negative parts
-        if (self.two_cm and
-                float(self.threshold_neg[0]) != float(self.threshold_neg[1])):
-            self.image_slices[0] = self.image_slices_pos[0] + self.image_slices_neg[0]
-            self.image_slices[1] = self.image_slices_pos[1] + self.image_slices_neg[1]
-            self.image_slices[2] = self.image_slices_pos[2] + self.image_slices_neg[2]
-        else:
-            self.image_slices[0] = self.image_slices_pos[0]
-            self.image_slices[1] = self.image_slices_pos[1]
-            self.image_slices[2] = self.image_slices_pos[2]
-            
-        
+    def planeStacksArgs(self, shape, affine, colored=True):
+        """
+        Returns the arguments of PlaneStacks.planeStacks for the grid of
+        'shape' with 'affine', with colored stacks if 'colored'.
+        """
+        return (self.image.get_data(), self.sliceMapping(affine),
+                tuple(int(n) for n in shape), list(self.coord),
+                self.interp_type, self.quantizeSlice,
+                self.getEffectiveLut() if colored else None)
+
+    def planeStacksBytes(self, shape, colored=True):
+        """
+        Returns the bytes the plane stacks for the grid of 'shape' take.
+        """
+        shape = [int(n) for n in shape]
+        pixels = shape[1]*shape[2] + shape[0]*shape[2] + shape[0]*shape[1]
+        return pixels * self.time_dim * (6 if colored else 2)
+
+    def setPlaneStacks(self, stacks, key):
+        """
+        Sets the planeStacks computed for 'key' (see planeStacksKey).
+        """
+        self.plane_stacks = stacks
+        # the colored stacks are valid for this lookup table
+        self.plane_stacks['lut'] = self.getEffectiveLut()
+        self.plane_stacks_key = key
+
+    @traced('Image4D.stackedSlice')
+    def stackedSlice(self, shape, affine):
+        """
+        Sets the slices of the current frame from the plane stacks, if they
+        were computed for the crosshair and grid of 'shape' with 'affine'.
+        Returns whether they were.
+
+        Colored stacks are handed out as they are, otherwise (or if the
+        colormaps changed) only the planes of the frame are colored.
+        """
+        if self.plane_stacks is None:
+            return False
+        if self.plane_stacks_key != self.planeStacksKey(shape, affine):
+            # stale, e.g. the crosshair moved
+            self.plane_stacks = None
+            self.plane_stacks_key = None
+            return False
+        lut = self.getEffectiveLut()
+        rgba = self.plane_stacks['rgba']
+        if rgba is not None and self.plane_stacks['lut'] is not lut:
+            self.plane_stacks['rgba'] = rgba = None
+        self.slice_windows = [None, None, None]
+        for plane in range(3):
+            if rgba is not None:
+                self.image_slices[plane] = rgba[plane][self.frame]
+            else:
+                self.image_slices[plane] = np.take(
+                    lut, self.plane_stacks['indices'][plane][self.frame],
+                    axis=0)
+        self.image_slice_res_sa = None
+        self.image_slice_res_co = None
+        self.image_slice_res_tr = None
+        self.xhairval = self.plane_stacks['xhair'][self.frame]
+        return True
 
     def setPlaying(self, state):
         self.playing = state
 
+    @traced('Image.slice')
     def slice(self, coord=None):
         if self.image_res is None:
             return 0
@@ -288,52 +465,10 @@ class Image4D(Image):
         self.updateTimeData()
         self.updateTimeAverageData()
 
-        [self.image_slices_pos[0], truth] = \
-            makeARGB(
-                self.image_res[self.coord[0],:,:], lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-        [self.image_slices_pos[1], truth] = \
-            makeARGB(
-                self.image_res[:,self.coord[1],:], lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-        [self.image_slices_pos[2], truth] = \
-            makeARGB(
-                self.image_res[:,:,self.coord[2]], lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-
-        if self.two_cm:
-            [self.image_slices_neg[0], truth] = \
-                makeARGB(
-                    self.image_res[self.coord[0],:,:], self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-            [self.image_slices_neg[1], truth] = \
-                makeARGB(
-                    self.image_res[:,self.coord[1],:], self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-            [self.image_slices_neg[2], truth] = \
-                makeARGB(
-                    self.image_res[:,:,self.coord[2]], self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-
-        # add positive and negative parts
-        if (self.two_cm and
-                float(self.threshold_neg[0]) != float(self.threshold_neg[1])):
-            self.image_slices[0] = \
-                self.image_slices_pos[0] + self.image_slices_neg[0]
-            self.image_slices[1] = \
-                self.image_slices_pos[1] + self.image_slices_neg[1]
-            self.image_slices[2] = \
-                self.image_slices_pos[2] + self.image_slices_neg[2]
-        else:
-            self.image_slices[0] = self.image_slices_pos[0]
-            self.image_slices[1] = self.image_slices_pos[1]
-            self.image_slices[2] = self.image_slices_pos[2]
+        lut = self.getEffectiveLut()
+        for plane in range(3):
+            self.image_slices[plane] = np.take(
+                lut, self.getSliceIndices(plane), axis=0)
 
     def setTime(self, time):
         self.frame_time = 1 #time #TR =1 forever...
@@ -373,7 +508,7 @@ class Image4D(Image):
                 self.design = np.array(self.design)
                 # create colors
                 self.cond_colors = {}
-                self.conds = np.unique(self.design[:,0]).astype(np.int)
+                self.conds = np.unique(self.design[:,0]).astype(int)
                 for i in range(len(self.conds)):
                     color = QtGui.QColor()
                     color.setHsv(
@@ -395,24 +530,155 @@ class Image4D(Image):
             self.timeseries.delDesign()
             self.design = None
 
+    def setRoi(self, shape=None, radius=None, statistic=None, mask=False):
+        """
+        Sets the region the time course is computed over. 'mask' is a 3D
+        image (None for no mask), the other arguments are kept if not given.
+        """
+        if shape is not None:
+            self.roi_shape = shape
+        if radius is not None:
+            self.roi_radius = radius
+        if statistic is not None:
+            self.roi_statistic = statistic
+        if mask is not False:
+            self.roi_mask = mask
+
+    def setRoiMasks(self, images, names):
+        """
+        Sets the 3D images that can be selected as mask in the dialog.
+        """
+        self.roi_masks = list(images)
+        if self.roi_mask not in self.roi_masks:
+            # the mask was removed from the viewer
+            self.roi_mask = None
+        self.funcdialog.setMaskNames(
+            names, self.roi_masks.index(self.roi_mask)
+            if self.roi_mask is not None else -1)
+
+    def voxelRows(self):
+        """
+        Returns the data as (voxels, time) view and the order of the flat
+        voxel indices.
+        """
+        data = self.image.get_data()
+        # reshaping in the memory order of the data does not copy it
+        order = 'F' if data.flags.f_contiguous else 'C'
+        return data.reshape((-1, self.time_dim), order=order), order
+
+    def roiOffsets(self):
+        """
+        Returns the voxel offsets of the sphere or box around a voxel.
+        """
+        sizes = np.sqrt((self.image.affine[:3,:3]**2).sum(axis=0))
+        key = (self.roi_shape, self.roi_radius, tuple(sizes))
+        if key != self.roi_offsets_key:
+            half = np.floor(self.roi_radius/np.maximum(sizes, 1e-6))
+            grid = np.mgrid[-half[0]:half[0]+1, -half[1]:half[1]+1,
+                            -half[2]:half[2]+1].reshape(3, -1).T
+            if self.roi_shape == 'sphere':
+                dist = np.sqrt(((grid*sizes)**2).sum(axis=1))
+                grid = grid[dist <= self.roi_radius]
+            self.roi_offsets = grid.astype(np.intp)
+            self.roi_offsets_key = key
+        return self.roi_offsets
+
+    def roiIndices(self, voxel, order='C'):
+        """
+        Returns the flat indices of the voxels of the region, for a sphere or
+        box around 'voxel' (voxel coordinates of this image).
+        """
+        shape = np.array(self.image.shape[:3])
+        if self.roi_mask is not None and self.roi_shape == 'mask':
+            return self.maskIndices(self.roi_mask, order)
+        elif self.roi_shape in ('sphere', 'box'):
+            coords = self.roiOffsets() + np.asarray(voxel)
+        else:
+            coords = np.asarray(voxel).reshape(1, 3)
+        inside = np.all((coords >= 0) & (coords < shape), axis=1)
+        flat = np.ravel_multi_index(coords[inside].T, shape, order=order)
+        return np.unique(flat)
+
+    def maskIndices(self, mask, order='C'):
+        """
+        Returns the flat indices of the voxels of this image under the
+        non-zero voxels of the 3D image 'mask'.
+        """
+        shape = np.array(self.image.shape[:3])
+        # mask voxels mapped through world space to the nearest voxels of
+        # this image, the mask is not interpolated
+        mask_to_self = np.dot(np.linalg.inv(self.image.affine),
+                              mask.image.affine)
+        mask_voxels = mask.nonzeroVoxels()
+        coords = np.rint(np.dot(mask_voxels, mask_to_self[:3,:3].T) +
+                         mask_to_self[:3,3]).astype(np.intp)
+        inside = np.all((coords >= 0) & (coords < shape), axis=1)
+        flat = np.ravel_multi_index(coords[inside].T, shape, order=order)
+        return np.unique(flat)
+
+    def timeCourse(self, voxel):
+        """
+        Returns the mean or median time course of the current region.
+
+        The region is gathered with one flat-index lookup in the data and
+        reduced over the voxel axis. Results are cached per region and frame
+        range.
+        """
+        if self.roi_shape == 'mask':
+            if self.roi_mask is None:
+                return np.zeros((self.time_dim))
+            region = ('mask', id(self.roi_mask.image))
+        elif self.roi_shape in ('sphere', 'box'):
+            region = (self.roi_shape, self.roi_radius, tuple(voxel))
+        else:
+            region = ('voxel', tuple(voxel))
+        key = (region, self.roi_statistic, (0, self.time_dim))
+        if key in self.time_courses:
+            self.time_courses.move_to_end(key)
+            return self.time_courses[key]
+        rows, order = self.voxelRows()
+        indices = self.roiIndices(voxel, order)
+        if len(indices) == 0:
+            course = np.zeros((self.time_dim))
+        else:
+            # indexing gathers only the region, take would copy all of the
+            # strided view first
+            gathered = rows[indices]
+            # NaN voxels are left out of the region, frames where all of
+            # them are NaN stay NaN
+            nan_aware = self.has_invalid
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                if self.roi_statistic == 'median':
+                    course = (np.nanmedian if nan_aware else np.median)(
+                        gathered, axis=0)
+                else:
+                    course = (np.nanmean if nan_aware else np.mean)(
+                        gathered, axis=0)
+        self.time_courses[key] = course
+        # the crosshair visits many voxels, keep only the latest
+        while len(self.time_courses) > 256:
+            self.time_courses.popitem(last=False)
+        return course
+
+    def crosshairVoxel(self, coord=None):
+        """
+        Returns the voxel of this image at the crosshair, or at 'coord' of
+        the resampled grid.
+        """
+        if coord is None:
+            coord = self.coord
+        xyz = np.array([coord[0], coord[1], coord[2], 1])
+        return tuple(np.dot(self.affine_res_inv, xyz).astype(np.int32)[:3])
+
+    @traced('updateTimeData')
     def updateTimeData(self):
         """
         Updates the time plot when the coordinate is changed.
         """
         if self.affine_res_inv is not None and self.timeseries is not None:
-            xyz = np.array([self.coord[0], self.coord[1], self.coord[2], 1])
-            map_xyz = np.dot(self.affine_res_inv, xyz).astype(np.int32)
-            shp = self.image.get_data().shape
-            # TODO: make this a shorter comparison
-            if (map_xyz[0] >= 0 and map_xyz[0] < shp[0] and
-                    map_xyz[1] >= 0 and map_xyz[1] < shp[1] and
-                    map_xyz[2] >= 0 and map_xyz[2] < shp[2]):
-                self.timeseries.setData(
-                    self.image.get_data()[map_xyz[0],map_xyz[1],map_xyz[2],:],
-                    self.frame_time)
-            else:
-                self.timeseries.setData(
-                    np.zeros((self.time_dim)),self.frame_time)
+            self.timeseries.setData(
+                self.timeCourse(self.crosshairVoxel()), self.frame_time)
 
     def openFuncDialog(self):
         """
@@ -434,7 +700,13 @@ class Image4D(Image):
 
     def changedFuncProperties(self):
         self.frame_time = self.funcdialog.getFrameTime()
+        mask = None
+        if 0 <= self.funcdialog.roi_mask_index < len(self.roi_masks):
+            mask = self.roi_masks[self.funcdialog.roi_mask_index]
+        self.setRoi(self.funcdialog.roi_shape, self.funcdialog.roi_radius,
+                    self.funcdialog.roi_statistic, mask)
         self.updateTimeData()
+        self.updateTimeAverageData()
 
     def computeTA(self):
         """
@@ -442,8 +714,8 @@ class Image4D(Image):
         """
         if self.design is not None:
             # for every experimental condition:
-            self.num_pts = np.floor(
-                self.funcdialog.cond_time/self.funcdialog.cond_dx)
+            self.num_pts = int(np.floor(
+                self.funcdialog.cond_time/self.funcdialog.cond_dx))
             self.time_pts_cond = np.linspace(
                 0, self.num_pts*self.funcdialog.cond_dx, self.num_pts)
             self.time_pts = np.linspace(
@@ -468,7 +740,7 @@ class Image4D(Image):
                         self.x_pos[cond].append(self.time_pts_cond+interval[1])
 
             if self.time_averages is None:
-                self.time_averages = AveragePlot.AveragePlot()
+                self.time_averages = AveragePlot()
             # initialize plots & colors
             self.time_averages.reset()
             self.updateTimeAverageData()
@@ -477,6 +749,25 @@ class Image4D(Image):
             QtGui.QMessageBox.warning(self.funcdialog, "Warning",
                 "Error: No design file was loaded.")
 
+    def conditionAverageMatrices(self):
+        """
+        Returns the peri-stimulus time points, the conditions of the trial
+        average settings and for each of them the sparse matrix that averages
+        a time course over the trials of the condition (see averagingMatrix),
+        like computeTA and updateTimeAverageData do for the crosshair.
+        """
+        num_pts = int(np.floor(
+            self.funcdialog.cond_time/self.funcdialog.cond_dx))
+        times = np.linspace(0, num_pts*self.funcdialog.cond_dx, num_pts)
+        frame_times = np.linspace(
+            0, (self.time_dim-1)*self.frame_time, self.time_dim)
+        conds = [cond for cond in self.funcdialog.cond_conds
+                 if cond in self.conds]
+        matrices = [averagingMatrix(
+            self.design[self.design[:,0] == cond, 1], times, frame_times)
+            for cond in conds]
+        return times, conds, matrices
+
     def updateTimeAverageData(self):
         """
         Updates the time average data if the coordinate is changed.
@@ -485,17 +776,16 @@ class Image4D(Image):
             # set factor for stddev
             self.time_averages.setCStddev(self.funcdialog.cond_stddevs)
             # compute original data voxel
-            xyz = np.array([self.coord[0], self.coord[1], self.coord[2], 1])
-            map_xyz = np.dot(self.affine_res_inv, xyz)
+            map_xyz = self.crosshairVoxel()
             shp = self.image.get_data().shape
-            # if voxel is in the data
+            # if voxel is in the data (or a mask is used)
             # TODO: make this a nicer comparison
-            if (map_xyz[0] >= 0 and map_xyz[0] < shp[0] and
+            if (self.roi_shape == 'mask' or
+                    (map_xyz[0] >= 0 and map_xyz[0] < shp[0] and
                     map_xyz[1] >= 0 and map_xyz[1] < shp[1] and
-                    map_xyz[2] >= 0 and map_xyz[2] < shp[2]):
-                # retrieve voxel data
-                voxel_data = \
-                    self.image.get_data()[map_xyz[0],map_xyz[1],map_xyz[2],:]
+                    map_xyz[2] >= 0 and map_xyz[2] < shp[2])):
+                # retrieve the time course of the region
+                voxel_data = self.timeCourse(map_xyz)
                 # for every condition compute average over trials
                 for cond in range(self.num_cond):
                     data = np.zeros((self.num_pts, len(self.x_pos[cond])))
@@ -7,6 +7,7 @@ import time
 import copy
 import sys, os.path
 
+from .resample import INTERPOLATION_NAMES, INTERPOLATION_ORDERS
 from .testInputs import testFloat, testInteger
 
 
@@ -51,8 +52,8 @@ class ImageDialog(QtGui.QDialog):
 
         # Interpolation type
         self.interp_menu = QtGui.QComboBox()
-        self.interp_menu.addItem("nearest neighbor")
-        self.interp_menu.addItem("linear")
+        for name in INTERPOLATION_NAMES:
+            self.interp_menu.addItem(name)
         self.interp_menu.currentIndexChanged.connect(self.savePreferences)
         self.form.addRow("Interpolation type:", self.interp_menu)
 
@@ -102,7 +103,8 @@ class ImageDialog(QtGui.QDialog):
             self.alpha_le.setText(str(self.alpha))
         if 'interp' in kwargs:
             self.interpolation = kwargs['interp']
-            self.interp_menu.setCurrentIndex(self.interpolation)
+            self.interp_menu.setCurrentIndex(
+                INTERPOLATION_ORDERS.index(self.interpolation))
         if 'two_cm' in kwargs:
             self.two_colormaps = kwargs['two_cm']
             if self.two_colormaps:
@@ -128,7 +130,9 @@ class ImageDialog(QtGui.QDialog):
             self.comp_mode = QtGui.QPainter.CompositionMode_SourceOver
         else:
             self.comp_mode = QtGui.QPainter.CompositionMode_Plus
-        self.interpolation = self.interp_menu.currentIndex()
+        # the spline order of the interpolation
+        self.interpolation = INTERPOLATION_ORDERS[
+            self.interp_menu.currentIndex()]
         self.two_colormaps = self.color_menu.currentIndex() != 0
         self.clips_pos = [self.clip_cb_low_pos.isChecked(),
                           self.clip_cb_high_pos.isChecked()]
@@ -8,6 +8,8 @@ from .pyqtgraph_vini import functions as fn
 from .pyqtgraph_vini import Point
 from .pyqtgraph_vini import ItemGroup
 
+from .Tracing import traced
+
 
 class ImageItemMod(ImageItem):
     """
@@ -22,6 +24,64 @@ class ImageItemMod(ImageItem):
         See :func:`setImage <pyqtgraph.ImageItem.setImage>` for all allowed initialization arguments.
         """
         GraphicsObject.__init__(self)
+        # (dict, key) shared with the other items showing the same plane
+        self.render_cache = None
+        self.source_image = None
+        self.rect_key = None
+
+    def setImage(self, image=None, autoLevels=None, render_cache=None,
+                 **kargs):
+        """
+        Same as ImageItem.setImage. Items that are given the same array and
+        the same 'render_cache' (a dict and a key, e.g. one per image plane)
+        share the levels and the rendered QImage, so an array shown in
+        several windows is only converted once.
+        """
+        if image is None:
+            super(ImageItemMod, self).setImage(image, autoLevels, **kargs)
+            return
+        self.render_cache = render_cache
+        self.source_image = image
+        entry = None
+        if render_cache is not None:
+            entry = render_cache[0].get(render_cache[1])
+            if entry is not None and entry[0] is not image:
+                entry = None
+        if entry is not None and autoLevels is None and 'levels' not in kargs:
+            kargs['levels'] = entry[1]
+        super(ImageItemMod, self).setImage(image, autoLevels, **kargs)
+        if render_cache is not None and entry is None:
+            render_cache[0][render_cache[1]] = [image, self.levels, None]
+
+    def setRect(self, rect):
+        """
+        Same as ImageItem.setRect, but nothing is done if neither the rect
+        nor the size of the image changed.
+        """
+        key = (rect.getRect(), self.width(), self.height())
+        if key == self.rect_key:
+            return
+        self.rect_key = key
+        super(ImageItemMod, self).setRect(rect)
+
+    @traced('ImageItem.render')
+    def render(self):
+        entry = None
+        if self.render_cache is not None and not self.autoDownsample:
+            entry = self.render_cache[0].get(self.render_cache[1])
+            if (entry is None or entry[0] is not self.source_image or
+                    not np.array_equal(entry[1], self.levels)):
+                entry = None
+        if entry is not None and entry[2] is not None:
+            self.qimage = entry[2]
+            return
+        super(ImageItemMod, self).render()
+        if entry is not None:
+            entry[2] = self.qimage
+
+    @traced('ImageItem.paint')
+    def paint(self, p, *args):
+        super(ImageItemMod, self).paint(p, *args)
 
     def mouseDragEvent(self, ev):
         ev.accept()
@@ -0,0 +1,161 @@
+"""
+Reads image files in background threads so that the viewer stays responsive
+while large files are decoded and resampled.
+"""
+import os.path
+
+import numpy as np
+from .pyqtgraph_vini.Qt import QtCore
+
+from .InvalidMask import scanData
+from .MemoryUsage import formatBytes
+from .loadImage import readImageFile
+from .resample import resample_image
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+class LoadThread(QtCore.QThread):
+    """
+    Reads an image file and scans its values (see scanData), reporting the
+    progress. The viewer creates the image from the result.
+    """
+
+    # text and fraction done
+    sigProgress = QtCore.Signal(str, float)
+    # (nifti object, header, scan), the exception if the file could not be
+    # read, or None if loading was cancelled
+    sigLoaded = QtCore.Signal(object)
+
+    def __init__(self, filename, file_type=0, parent=None):
+        super(LoadThread, self).__init__(parent)
+        self.filename = filename
+        self.file_type = file_type
+        self.name = os.path.split(filename)[-1]
+        self.cancelled = False
+        # the last text and fraction reported
+        self.progress = ("Reading {}".format(self.name), 0.)
+
+    def cancel(self):
+        """
+        Stops reading after the current chunk of the file.
+        """
+        self.cancelled = True
+
+    def reportRead(self, done, total, shape):
+        if self.cancelled:
+            raise LoadCancelled()
+        fraction = done / float(max(total, 1))
+        if len(shape) == 4 and shape[3] > 1:
+            text = "Reading {}: frame {} of {}".format(
+                self.name, int(fraction * shape[3]), shape[3])
+        else:
+            text = "Reading {}: {} of {}".format(
+                self.name, formatBytes(done), formatBytes(total))
+        self.report(text, fraction)
+
+    def report(self, text, fraction):
+        self.progress = (text, fraction)
+        self.sigProgress.emit(text, fraction)
+
+    def run(self):
+        try:
+            image, hdr = readImageFile(self.filename, self.reportRead)
+            if image is None:
+                raise IOError("cannot read {}".format(self.filename))
+            if self.cancelled:
+                raise LoadCancelled()
+            self.report("Scanning {}".format(self.name), 1.)
+            result = (image, hdr, scanData(image.get_fdata()))
+        except LoadCancelled:
+            result = None
+        except Exception as e:
+            result = e
+        self.sigLoaded.emit(result)
+
+
+class RefineThread(QtCore.QThread):
+    """
+    Computes the resampled volume of a deferred image (see Image.deferred).
+    For an image shown as preview (see loadPreviewFromFile) the full data is
+    read first and resampled to the grid of the preview. Both report their
+    progress and stop when cancelled.
+    """
+
+    # text and fraction done
+    sigProgress = QtCore.Signal(str, float)
+
+    # Emits the image and the arguments for Image.replacePreview (the last
+    # two for Image.setResampled), or the exception if the file could not be
+    # read, or None if it was cancelled.
+    sigRefined = QtCore.Signal(object, object)
+
+    def __init__(self, img, name='', parent=None):
+        super(RefineThread, self).__init__(parent)
+        self.img = img
+        self.name = name
+        self.filename = getattr(img, 'filename', None)
+        self.cancelled = False
+        # whether the file has to be read
+        self.read = img.preview is not None
+        # the last text and fraction reported
+        if self.read:
+            self.progress = ("Reading the full data of {}".format(name), 0.)
+        else:
+            self.progress = ("Resampling {}".format(name), 0.)
+        self.data = None if self.read else img.image.get_fdata()
+        # The grid when the thread is started; the viewer may resample while
+        # the thread runs.
+        self.key = img.res_key
+        self.mapping = None
+        if img.affine_res_inv is not None and img.image_res is not None \
+                and not img.lazy:
+            self.mapping = np.array(img.affine_res_inv)
+            self.shape = tuple(np.asarray(img.res_shape).astype(int))
+            self.interpolation = img.interp_type
+
+    def cancel(self):
+        """
+        Stops after the current chunk of the file or slab of the volume.
+        """
+        self.cancelled = True
+
+    def reportRead(self, done, total, shape):
+        self.report("Reading the full data of {}: {} of {}".format(
+            self.name, formatBytes(done), formatBytes(total)),
+            done / float(max(total, 1)))
+
+    def reportResampled(self, done, total):
+        self.report("Resampling {}: slab {} of {}".format(
+            self.name, done, total), done / float(max(total, 1)))
+
+    def report(self, text, fraction):
+        if self.cancelled:
+            raise LoadCancelled()
+        self.progress = (text, fraction)
+        self.sigProgress.emit(text, fraction)
+
+    def run(self):
+        try:
+            image, scan, data = None, None, self.data
+            if self.read:
+                image, hdr = readImageFile(self.filename, self.reportRead)
+                if image is None:
+                    raise IOError("cannot read {}".format(self.filename))
+                data = image.get_fdata()
+                scan = scanData(data)
+            resampled = None
+            if self.mapping is not None:
+                self.report("Resampling {}".format(self.name), 0.)
+                resampled = resample_image(
+                    data, affine=self.mapping, shape=self.shape,
+                    interpolation=self.interpolation,
+                    progress=self.reportResampled)
+            result = (image, scan, resampled, self.key)
+        except LoadCancelled:
+            result = None
+        except Exception as e:
+            result = e
+        self.sigRefined.emit(self.img, result)
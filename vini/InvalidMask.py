@@ -0,0 +1,35 @@
+"""
+Voxels without a value (NaN) of an image, found in one pass over the data.
+"""
+import numpy as np
+
+
+def scanData(data, slab_size=2**18):
+    """
+    Returns the minimum and maximum of the values of 'data' that are not NaN
+    and whether there are NaNs.
+
+    The data is read once, in slabs of about 'slab_size' values along the
+    last axis, and never copied.
+    """
+    data = np.asanyarray(data)
+    if data.size == 0:
+        return 0.0, 0.0, False
+    if not np.issubdtype(data.dtype, np.floating):
+        return data.min(), data.max(), False
+    if data.ndim == 0:
+        data = data.reshape(1)
+    step = max(1, slab_size // max(1, int(np.prod(data.shape[:-1]))))
+    low, high = np.nan, np.nan
+    has_invalid = False
+    for first in range(0, data.shape[-1], step):
+        slab = data[..., first:first+step]
+        if not has_invalid:
+            has_invalid = bool(np.isnan(slab).any())
+        # fmin and fmax ignore NaNs
+        low = np.fmin(low, np.fmin.reduce(slab, axis=None))
+        high = np.fmax(high, np.fmax.reduce(slab, axis=None))
+    if np.isnan(low):
+        # all values are NaN
+        low, high = 0.0, 0.0
+    return low, high, has_invalid
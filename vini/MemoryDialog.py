@@ -0,0 +1,137 @@
+from .pyqtgraph_vini.Qt import QtCore, QtGui
+
+from .MemoryUsage import CATEGORIES, formatBytes, systemMemory
+
+
+class MemoryDialog(QtGui.QDialog):
+    """
+    Lists the memory held by each image and offers to release some of it.
+    """
+
+    # index of the image and whether it should be resampled lazily
+    sigLazy = QtCore.Signal(int, bool)
+    sigReleaseCaches = QtCore.Signal()
+    # budget in GB, 0 for three quarters of the physical memory
+    sigBudget = QtCore.Signal(float)
+    sigRefresh = QtCore.Signal()
+
+    def __init__(self):
+        super(MemoryDialog, self).__init__()
+        self.setWindowTitle("Memory usage")
+        self.resize(860, 300)
+        self.lazy_states = []
+        self.lazy_capable = []
+
+        self.layout = QtGui.QVBoxLayout()
+
+        self.table = QtGui.QTableWidget()
+        self.table.setColumnCount(len(CATEGORIES) + 2)
+        self.table.setHorizontalHeaderLabels(
+            [c.capitalize() for c in CATEGORIES] + ['Total', 'Mode'])
+        self.table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QtGui.QAbstractItemView.SingleSelection)
+        self.table.itemSelectionChanged.connect(self.updateButtons)
+        self.layout.addWidget(self.table)
+
+        self.budget_label = QtGui.QLabel()
+        self.layout.addWidget(self.budget_label)
+
+        form = QtGui.QFormLayout()
+        self.budget_box = QtGui.QDoubleSpinBox()
+        self.budget_box.setRange(0, 1e5)
+        self.budget_box.setDecimals(1)
+        self.budget_box.setSuffix(" GB")
+        self.budget_box.setSpecialValueText("automatic")
+        self.budget_box.setToolTip(
+            "Warn before resampling would use more memory than this.\n"
+            "Automatic: three quarters of the physical memory.")
+        self.budget_box.editingFinished.connect(
+            lambda: self.sigBudget.emit(self.budget_box.value()))
+        form.addRow("Memory budget:", self.budget_box)
+        self.layout.addLayout(form)
+
+        buttons = QtGui.QHBoxLayout()
+        self.lazy_button = QtGui.QPushButton("Resample lazily")
+        self.lazy_button.setCheckable(True)
+        self.lazy_button.setToolTip(
+            "Drop the resampled volume of the selected 3D image and resample\n"
+            "only the displayed planes when they are needed.")
+        self.lazy_button.clicked.connect(self.lazyClicked)
+        self.release_button = QtGui.QPushButton("Release caches")
+        self.release_button.setToolTip(
+            "Drop lookup tables, histograms, time courses and rendered\n"
+            "planes of all images. They are rebuilt when needed.")
+        self.release_button.clicked.connect(self.sigReleaseCaches.emit)
+        self.refresh_button = QtGui.QPushButton("Refresh")
+        self.refresh_button.clicked.connect(self.sigRefresh.emit)
+        self.close_button = QtGui.QPushButton("Close")
+        self.close_button.clicked.connect(self.close)
+        for button in [self.lazy_button, self.release_button,
+                       self.refresh_button, self.close_button]:
+            button.setFocusPolicy(QtCore.Qt.NoFocus)
+            buttons.addWidget(button)
+        self.layout.addLayout(buttons)
+
+        self.setLayout(self.layout)
+
+    def setRows(self, names, memories, lazy_states, lazy_capable, budget,
+                budget_bytes):
+        """
+        Shows the memory per image ('memories' as returned by imageMemory)
+        and the budget.
+        """
+        selected = self.selectedRow()
+        self.lazy_states = list(lazy_states)
+        self.lazy_capable = list(lazy_capable)
+        self.table.setRowCount(len(names) + 1)
+        self.table.setVerticalHeaderLabels(list(names) + ['All images'])
+        totals = [0] * (len(CATEGORIES) + 1)
+        for row, memory in enumerate(memories):
+            values = list(memory.values()) + [sum(memory.values())]
+            for column, value in enumerate(values):
+                self.setCell(row, column, formatBytes(value))
+                totals[column] += value
+            self.setCell(row, len(values),
+                         "lazy" if self.lazy_states[row] else "in memory")
+        for column, value in enumerate(totals):
+            self.setCell(len(names), column, formatBytes(value))
+        self.setCell(len(names), len(totals), "")
+        self.table.resizeColumnsToContents()
+        if selected is not None and selected < len(names):
+            self.table.selectRow(selected)
+
+        physical = systemMemory()
+        text = "Images hold %s" % formatBytes(totals[-1])
+        if budget_bytes is not None:
+            text += ", budget %s" % formatBytes(budget_bytes)
+        if physical is not None:
+            text += ", physical memory %s" % formatBytes(physical)
+        self.budget_label.setText(text + ".")
+        self.budget_box.blockSignals(True)
+        self.budget_box.setValue(budget)
+        self.budget_box.blockSignals(False)
+        self.updateButtons()
+
+    def setCell(self, row, column, text):
+        item = QtGui.QTableWidgetItem(text)
+        item.setTextAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        self.table.setItem(row, column, item)
+
+    def selectedRow(self):
+        rows = self.table.selectionModel().selectedRows()
+        if len(rows) == 0:
+            return None
+        return rows[0].row()
+
+    def updateButtons(self):
+        row = self.selectedRow()
+        enabled = row is not None and row < len(self.lazy_capable) and \
+            self.lazy_capable[row]
+        self.lazy_button.setEnabled(enabled)
+        self.lazy_button.setChecked(enabled and self.lazy_states[row])
+
+    def lazyClicked(self, state):
+        row = self.selectedRow()
+        if row is not None and row < len(self.lazy_states):
+            self.sigLazy.emit(row, state)
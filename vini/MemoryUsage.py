@@ -0,0 +1,113 @@
+"""
+Accounting of the memory held by the images of the viewer.
+"""
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+# categories of memory per image
+CATEGORIES = ['source', 'resampled', 'slices', 'caches', 'display']
+
+
+def systemMemory():
+    """
+    Returns the physical memory in bytes, or None if it is not known.
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def formatBytes(n):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(n) < 1024 or unit == 'GB':
+            return ("%d %s" if unit == 'B' else "%.1f %s") % (n, unit)
+        n /= 1024.
+
+
+class MemoryCounter(object):
+    """
+    Sums the bytes of arrays and QImages, counting every buffer only once
+    (views count as the array they were taken from).
+    """
+
+    def __init__(self):
+        self.seen = set()
+
+    def array(self, array):
+        if not isinstance(array, np.ndarray):
+            return 0
+        while isinstance(array.base, np.ndarray):
+            array = array.base
+        # memory mapped files are not held in memory
+        if isinstance(array, np.memmap) or id(array) in self.seen:
+            return 0
+        self.seen.add(id(array))
+        return array.nbytes
+
+    def qimage(self, image):
+        if image is None or ('qimage', image.cacheKey()) in self.seen:
+            return 0
+        self.seen.add(('qimage', image.cacheKey()))
+        if hasattr(image, 'sizeInBytes'):
+            return image.sizeInBytes()
+        return image.byteCount()
+
+
+def imageMemory(img, items=(), counter=None):
+    """
+    Returns the bytes held by an Image per category (see CATEGORIES):
+
+    source: the data as loaded or as nibabel holds it after reading the
+        file, or the cached bricks of a bricked image
+    resampled: the data resampled to the grid of the viewer
+    slices: the displayed planes (RGBA and lookup indices)
+    caches: lookup tables, histogram, time courses, plane stacks for
+        playback and spline coefficients
+    display: the rendered QImages of the ImageItemMods in 'items'
+    """
+    if counter is None:
+        counter = MemoryCounter()
+    memory = OrderedDict((category, 0) for category in CATEGORIES)
+
+    store = getattr(img, 'store', None)
+    if store is not None:
+        memory['source'] += sum(
+            counter.array(brick) for brick in list(store.cache.values()))
+    else:
+        # the array the image was made from, or the one nibabel read from
+        # the file and holds
+        if img.image.in_memory:
+            memory['source'] += counter.array(img.heldData())
+        memory['source'] += counter.array(getattr(img, 'frame_store', None))
+
+    # a lazily resampled image keeps the source data it samples from
+    memory['source'] += counter.array(getattr(img.image_res, 'data', None))
+    memory['resampled'] += counter.array(img.image_res)
+    for name in ['image_slice_res_sa', 'image_slice_res_co',
+                 'image_slice_res_tr']:
+        memory['resampled'] += counter.array(getattr(img, name, None))
+
+    for array in list(img.image_slices) + list(img.slice_indices):
+        memory['slices'] += counter.array(array)
+
+    caches = list(img.effective_lut.values())
+    if img.hist_saved:
+        caches += list(img.hist)
+    caches += list(getattr(img, 'time_courses', {}).values())
+    for coefficients, invalid in list(img.spline_cache.values()):
+        caches += [coefficients, invalid]
+    stacks = getattr(img, 'plane_stacks', None)
+    if stacks is not None:
+        caches += list(stacks['indices']) + list(stacks['rgba'] or [])
+    for array in caches:
+        memory['caches'] += counter.array(array)
+
+    for item in items:
+        if item is not None:
+            memory['display'] += counter.qimage(item.qimage)
+    for entry in list(img.render_cache.values()):
+        memory['display'] += counter.qimage(entry[2])
+    return memory
@@ -123,7 +123,8 @@ class MosaicDialog(QtGui.QDialog):
         Updates the possible dimensions.
         """
         if self.dims[0] != n_dims[0] or self.dims[1] != n_dims[1] or self.dims[2] != n_dims[2]:
-            self.dims = copy.copy(n_dims)
+            # the grid dimensions may be floats, Qt needs integers
+            self.dims = [int(dim) for dim in n_dims]
             self.reset()
 
     def closeEvent(self, ev=None):
@@ -0,0 +1,66 @@
+"""
+On-screen display of the frame rate and the latencies of the pipeline stages.
+"""
+from .pyqtgraph_vini.Qt import QtCore, QtGui
+
+from .Tracing import tracer
+
+
+class PerformanceOverlay(QtGui.QLabel):
+    """
+    Label drawn over the slice views showing the paints per second and the
+    median and 95th percentile duration of each traced stage.
+
+    Tracing is enabled while the overlay is shown.
+    """
+
+    def __init__(self, parent=None, interval=500):
+        super(PerformanceOverlay, self).__init__(parent)
+        self.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+        self.setStyleSheet(
+            "background-color: rgba(0, 0, 0, 180); color: #8f8;"
+            "font-family: monospace; padding: 4px;")
+        # viewport -> name of the view for counting paints
+        self.views = {}
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.interval = interval
+        self.tracing_before = tracer.enabled
+        self.hide()
+
+    def watch(self, name, view):
+        """
+        Counts the paints of the QGraphicsView 'view' for the frame rate.
+        """
+        self.views[view.viewport()] = name
+        view.viewport().installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QtCore.QEvent.Paint and obj in self.views:
+            tracer.frame(self.views[obj])
+        return False
+
+    def setActive(self, state):
+        if state:
+            self.tracing_before = tracer.enabled
+            tracer.enable()
+            self.refresh()
+            self.show()
+            self.raise_()
+            self.timer.start(self.interval)
+        else:
+            self.timer.stop()
+            self.hide()
+            tracer.enable(self.tracing_before)
+
+    def refresh(self):
+        lines = ["%6.1f fps" % tracer.fps(),
+                 "%-20s %5s %8s %8s" % ('stage', 'n', 'p50 ms', 'p95 ms')]
+        statistics = sorted(tracer.statistics().items(),
+                            key=lambda item: -item[1][2])
+        for name, (count, p50, p95) in statistics:
+            lines.append("%-20s %5d %8.2f %8.2f" % (
+                name[:20], count, 1e3*p50, 1e3*p95))
+        self.setText("\n".join(lines))
+        self.adjustSize()
+        self.move(8, 8)
@@ -0,0 +1,124 @@
+"""
+The displayed planes of a functional image for all frames at once, so that
+playing it back only hands out precomputed arrays (see
+Image4D.stackedSlice).
+"""
+from functools import partial
+
+import numpy as np
+from .ProgressThread import ProgressThread
+
+
+def planeVoxels(mapping, shape, plane, index):
+    """
+    Returns the (N, 3) voxel coordinates of the source of the plane 'plane'
+    at 'index' of the grid of 'shape', and the shape of the plane.
+    'mapping' maps grid voxels to source voxels.
+    """
+    axes = [np.arange(n) for n in shape]
+    axes[plane] = np.array([index])
+    grid = np.meshgrid(*axes, indexing='ij')
+    points = np.stack([g.ravel() for g in grid], axis=1)
+    voxels = np.dot(points, mapping[:3, :3].T) + mapping[:3, 3]
+    plane_shape = tuple(n for axis, n in enumerate(shape) if axis != plane)
+    return voxels, plane_shape
+
+
+def sampleFrames(data, voxels, interpolation, first, last):
+    """
+    Returns the values of the frames 'first' to 'last' of the 4D 'data' at
+    the (N, 3) voxel coordinates 'voxels' as (N, frames) array, with nearest
+    neighbour (0) or trilinear (1) interpolation. As for resample_image,
+    coordinates outside the volume are 0.
+
+    Every corner is one indexing of the data with the frames as slice, which
+    reads the time courses of the voxels in one strided access.
+    """
+    size = np.array(data.shape[:3])
+    inside = np.all((voxels >= 0) & (voxels <= size - 1), axis=1)
+    values = np.zeros((len(voxels), last - first))
+    points = voxels[inside]
+    if interpolation == 0:
+        # halves are rounded up like scipy.ndimage does
+        nearest = np.floor(points + 0.5).astype(np.intp)
+        values[inside] = data[nearest[:, 0], nearest[:, 1], nearest[:, 2],
+                              first:last]
+        return values
+    lower = np.minimum(np.floor(points).astype(np.intp),
+                       np.maximum(size - 2, 0))
+    fraction = points - lower
+    upper = np.minimum(lower + 1, size - 1)
+    result = np.zeros((len(points), last - first))
+    for corner in range(8):
+        index = []
+        weight = np.ones(len(points))
+        for axis in range(3):
+            if corner >> axis & 1:
+                index.append(upper[:, axis])
+                weight *= fraction[:, axis]
+            else:
+                index.append(lower[:, axis])
+                weight *= 1 - fraction[:, axis]
+        result += weight[:, np.newaxis] * data[
+            index[0], index[1], index[2], first:last]
+    values[inside] = result
+    return values
+
+
+def planeStacks(data, mapping, shape, coord, interpolation, quantize,
+                lut=None, progress=None, chunk_size=2**22):
+    """
+    Returns the quantised planes through 'coord' of the grid of 'shape' for
+    all frames of the 4D 'data' as dict:
+
+    indices: the uint16 indices (see Image.quantizeSlice) of the sagittal,
+        coronal and transverse plane as (frames, height, width) stacks
+    rgba: the stacks colored with 'lut' in one pass, or None without 'lut'
+    xhair: the value at the crosshair for every frame
+
+    The frames are sampled in chunks of about 'chunk_size' values.
+    progress(planes done, planes) counts the planes of all frames and is
+    called after every chunk, it may raise an exception to stop.
+    """
+    frames = data.shape[3]
+    result = {'indices': [], 'rgba': None if lut is None else [],
+              'xhair': None}
+    for plane in range(3):
+        voxels, plane_shape = planeVoxels(
+            mapping, shape, plane, int(coord[plane]))
+        indices = np.empty((frames,) + plane_shape, dtype=np.uint16)
+        step = max(1, chunk_size // max(1, len(voxels)))
+        for first in range(0, frames, step):
+            last = min(first + step, frames)
+            values = sampleFrames(data, voxels, interpolation, first, last)
+            indices[first:last] = quantize(values.T).reshape(
+                (last - first,) + plane_shape)
+            if plane == 0:
+                if result['xhair'] is None:
+                    result['xhair'] = np.empty(frames)
+                result['xhair'][first:last] = values.reshape(
+                    plane_shape + (last - first,))[
+                        int(coord[1]), int(coord[2])]
+            if progress is not None:
+                progress(plane * frames + last, 3 * frames)
+        result['indices'].append(indices)
+        if lut is not None:
+            result['rgba'].append(np.take(lut, indices, axis=0))
+    return result
+
+
+class StacksThread(ProgressThread):
+    """
+    Computes the planeStacks of a functional image in the background.
+    """
+
+    def __init__(self, img, key, args, name, parent=None):
+        """
+        'args' are the arguments of planeStacks besides 'progress' and 'key'
+        identifies the planes (see Image4D.planeStacksKey).
+        """
+        super(StacksThread, self).__init__(
+            partial(planeStacks, *args), "Preparing the playback", name,
+            "plane", parent)
+        self.img = img
+        self.key = key
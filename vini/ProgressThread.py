@@ -0,0 +1,53 @@
+"""
+Background computation that reports its progress and can be cancelled.
+"""
+from .pyqtgraph_vini.Qt import QtCore
+
+
+class Cancelled(Exception):
+    pass
+
+
+class ProgressThread(QtCore.QThread):
+    """
+    Runs function(progress=...) in the background. The function calls
+    progress(done, total) as it goes, which is reported as "<label> of
+    <name>: <unit> <done> of <total>" and raises Cancelled to stop the
+    function once cancel() was called.
+    """
+
+    # text and fraction done
+    sigProgress = QtCore.Signal(str, float)
+    # the result of the function, the exception if it failed, or None if it
+    # was cancelled
+    sigFinished = QtCore.Signal(object)
+
+    def __init__(self, function, label, name, unit, parent=None):
+        super(ProgressThread, self).__init__(parent)
+        self.function = function
+        self.label = label
+        self.name = name
+        self.unit = unit
+        self.cancelled = False
+        # the last text and fraction reported
+        self.progress = ("{} of {}".format(label, name), 0.)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def report(self, done, total):
+        if self.cancelled:
+            raise Cancelled()
+        self.progress = ("{} of {}: {} {} of {}".format(
+            self.label, self.name, self.unit, done, total),
+            done / float(max(total, 1)))
+        self.sigProgress.emit(*self.progress)
+
+    def run(self):
+        try:
+            result = self.function(progress=self.report)
+        except Cancelled:
+            result = None
+        except Exception as e:
+            result = e
+        self.sigFinished.emit(result)
@@ -0,0 +1,83 @@
+"""
+Per-frame quality traces of a time series (global mean, DVARS and an
+outlier score) to find bad volumes without playing through the run.
+"""
+from collections import OrderedDict
+from functools import partial
+
+import numpy as np
+from .ProgressThread import ProgressThread
+
+# the traces in the order they are plotted
+TRACES = ['global mean', 'DVARS', 'outlier score']
+
+
+def robustScores(trace):
+    """
+    Returns the deviations of 'trace' from its median in units of the
+    standard deviation estimated from the median absolute deviation.
+    """
+    finite = trace[np.isfinite(trace)]
+    if finite.size == 0:
+        return np.zeros_like(trace)
+    median = np.median(finite)
+    spread = 1.4826 * np.median(np.abs(finite - median))
+    if not spread > 0:
+        spread = finite.std()
+    if not spread > 0:
+        return np.zeros_like(trace)
+    return (trace - median) / spread
+
+
+def frameTraces(data, progress=None):
+    """
+    Returns the traces (see TRACES) of the frames of the 4D array 'data' as
+    OrderedDict of arrays with one value per frame:
+
+    global mean: the mean over all voxels
+    DVARS: the root mean square of the change of the voxels from the
+        previous frame (0 for the first frame)
+    outlier score: the larger robust score (see robustScores) of the
+        absolute global mean and of DVARS, above 3 or so a frame stands out
+
+    The frames are visited once, so besides two frames nothing is held.
+    NaN and infinite values are left out. progress(frames done, frames) is
+    called after every frame, it may raise an exception to stop.
+    """
+    frames = data.shape[3]
+    global_mean = np.full(frames, np.nan)
+    dvars = np.zeros(frames)
+    previous = None
+    for t in range(frames):
+        frame = np.array(data[..., t], dtype=np.float64)
+        finite = np.isfinite(frame)
+        if finite.all():
+            global_mean[t] = frame.mean()
+        elif finite.any():
+            global_mean[t] = frame[finite].mean()
+        if previous is not None:
+            change = frame - previous
+            change = change[np.isfinite(change)]
+            if change.size > 0:
+                dvars[t] = np.sqrt(np.dot(change, change) / change.size)
+        previous = frame
+        if progress is not None:
+            progress(t + 1, frames)
+
+    score = np.abs(robustScores(global_mean))
+    if frames > 1:
+        # the first frame has no change to score
+        dvars_score = robustScores(dvars[1:])
+        score[1:] = np.fmax(score[1:], dvars_score)
+    return OrderedDict(zip(TRACES, [global_mean, dvars, score]))
+
+
+class TracesThread(ProgressThread):
+    """
+    Computes frameTraces in the background, reporting the progress.
+    """
+
+    def __init__(self, data, name, parent=None):
+        super(TracesThread, self).__init__(
+            partial(frameTraces, data), "Computing the quality traces", name,
+            "frame", parent)
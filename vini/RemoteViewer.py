@@ -0,0 +1,331 @@
+"""
+Viewer running in a background process for non-blocking vini.show.
+
+Arrays are handed to the viewer through shared memory, the viewer maps the
+same memory and does not copy the data. The interpreter that called
+vini.show stays responsive and can update, replace or close the images.
+"""
+import atexit
+import os
+import subprocess
+import sys
+import numpy as np
+from multiprocessing.connection import Client, Listener
+
+
+class RemoteImage(object):
+    """
+    Handle of an image shown in the background viewer.
+
+    'array' is the shared memory seen by the viewer. Writing into it and
+    calling update() refreshes the image without any copy.
+    """
+
+    def __init__(self, viewer, image_id, name, array, shm):
+        self.viewer = viewer
+        self.image_id = image_id
+        self.name = name
+        self.array = array
+        self.shm = shm
+
+    def update(self, array=None):
+        """
+        Redisplays the image after its data changed. If 'array' is given it
+        is copied into the shared memory first and must have the same shape.
+        """
+        self.checkOpen()
+        if array is not None:
+            array = np.asarray(array)
+            if array.shape != self.array.shape:
+                raise ValueError(
+                    "update needs an array of shape {}, use replace for a "
+                    "different shape".format(self.array.shape))
+            np.copyto(self.array, array, casting='unsafe')
+        self.viewer.request('update', self.image_id)
+
+    def replace(self, array):
+        """
+        Shows a new array (any shape and type) instead of the current one.
+        Thresholds are reset to their defaults.
+        """
+        self.checkOpen()
+        array, shm = self.viewer.share(array)
+        try:
+            self.viewer.request(
+                'replace', self.image_id, shm.name, array.shape,
+                array.dtype.str)
+        except Exception:
+            self.viewer.release(shm)
+            raise
+        self.viewer.release(self.shm)
+        self.array = array
+        self.shm = shm
+
+    def close(self):
+        """
+        Removes the image from the viewer and frees the shared memory.
+        """
+        if self.shm is None:
+            return
+        try:
+            if self.viewer.isAlive():
+                self.viewer.request('close', self.image_id)
+        finally:
+            self.array = None
+            self.viewer.release(self.shm)
+            self.shm = None
+
+    def checkOpen(self):
+        if self.shm is None:
+            raise RuntimeError("image '{}' is closed".format(self.name))
+        if not self.viewer.isAlive():
+            raise RuntimeError("the viewer showing '{}' was closed".format(
+                self.name))
+
+    def __repr__(self):
+        return "<vini image '{}' {} {}>".format(
+            self.name, None if self.array is None else self.array.shape,
+            None if self.array is None else self.array.dtype)
+
+
+class RemoteViewer(object):
+    """
+    Starts and talks to the viewer process.
+    """
+
+    def __init__(self):
+        # A fresh interpreter instead of multiprocessing.Process: forking a
+        # process with Qt state is not safe and spawning would re-run the
+        # calling script.
+        authkey = os.urandom(32)
+        env = dict(os.environ)
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = package_dir + os.pathsep + env.get('PYTHONPATH', '')
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'vini.RemoteViewer'], env=env,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.process.stdin.write(authkey.hex().encode('ascii') + b'\n')
+        self.process.stdin.close()
+        address = self.process.stdout.readline().decode('utf-8').strip()
+        if not address:
+            raise RuntimeError("the viewer process could not be started")
+        self.conn = Client(address, authkey=authkey)
+        self.next_id = 0
+        self.shared = []
+
+    def isAlive(self):
+        return self.process.poll() is None
+
+    def share(self, array):
+        """
+        Copies the array once into new shared memory and returns the array
+        view of the shared memory and the shared memory object.
+        """
+        from multiprocessing import shared_memory
+        array = np.asarray(array)
+        shm = shared_memory.SharedMemory(
+            create=True, size=max(array.nbytes, 1))
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        shared[...] = array
+        self.shared.append(shm)
+        return shared, shm
+
+    def release(self, shm):
+        if shm in self.shared:
+            self.shared.remove(shm)
+        closeShared(shm)
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def request(self, *message):
+        """
+        Sends a command to the viewer and waits until it is carried out.
+        """
+        try:
+            self.conn.send(message)
+            while not self.conn.poll(0.1):
+                if not self.isAlive():
+                    raise EOFError
+            status, result = self.conn.recv()
+        except (EOFError, OSError):
+            raise RuntimeError("the viewer process was closed")
+        if status == 'error':
+            raise RuntimeError("viewer error: " + result)
+        return result
+
+    def show(self, array, name):
+        array, shm = self.share(array)
+        image_id = self.next_id
+        self.next_id += 1
+        try:
+            self.request(
+                'show', image_id, shm.name, array.shape, array.dtype.str, name)
+        except Exception:
+            self.release(shm)
+            raise
+        return RemoteImage(self, image_id, name, array, shm)
+
+    def close(self):
+        """
+        Closes the viewer and frees all shared memory.
+        """
+        if self.isAlive():
+            try:
+                self.request('quit')
+            except RuntimeError:
+                pass
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.conn.close()
+        for shm in list(self.shared):
+            self.release(shm)
+
+
+# viewer process the handles of this interpreter are attached to
+_viewer = None
+
+
+def getViewer():
+    """
+    Returns the running background viewer or starts a new one.
+    """
+    global _viewer
+    if _viewer is None or not _viewer.isAlive():
+        if _viewer is not None:
+            _viewer.close()
+        _viewer = RemoteViewer()
+    return _viewer
+
+
+def closeViewer():
+    global _viewer
+    if _viewer is not None:
+        _viewer.close()
+        _viewer = None
+
+atexit.register(closeViewer)
+
+
+def showRemote(arrays, names):
+    """
+    Shows the arrays in the background viewer and returns their handles.
+    """
+    viewer = getViewer()
+    return [viewer.show(array, name) for array, name in zip(arrays, names)]
+
+
+def closeShared(shm):
+    """
+    Closes the shared memory. If arrays still use it, it is freed together
+    with the last of them.
+    """
+    try:
+        shm.close()
+    except BufferError:
+        pass
+
+
+def attachShared(name, shape, dtype):
+    """
+    Maps shared memory created by the calling interpreter (viewer side).
+    """
+    from multiprocessing import shared_memory
+    # The calling interpreter owns and unlinks the memory, it must not be
+    # tracked (and unlinked on exit) by the viewer.
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    array = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=shm.buf)
+    # the viewer must never write into the caller's data
+    array.flags.writeable = False
+    return array, shm
+
+
+def serve(conn):
+    """
+    Main function of the viewer process.
+    """
+    from .pyqtgraph_vini.Qt import QtCore, QtGui
+    from .viewer import Viff
+
+    app = QtGui.QApplication([])
+    viewer = Viff()
+    # id -> [Image, shared memory, shared array]
+    shown = {}
+
+    def index(image_id):
+        return viewer.images.index(shown[image_id][0])
+
+    def handle(message):
+        command, args = message[0], message[1:]
+        if command == 'show':
+            image_id, name, shape, dtype, itemname = args
+            array, shm = attachShared(name, shape, dtype)
+            first = len(viewer.images) == 0
+            viewer.loadImagesFromNumpy(array, itemname)
+            if first:
+                viewer.checkIf2DAndRemovePanes()
+            shown[image_id] = [viewer.images[0], shm, array]
+        elif command == 'update':
+            image_id, = args
+            viewer.replaceImageData(index(image_id), shown[image_id][2])
+        elif command == 'replace':
+            image_id, name, shape, dtype = args
+            array, shm = attachShared(name, shape, dtype)
+            img = shown[image_id][0]
+            if (array.ndim == 4) == (img.type_d() == "4D"):
+                viewer.replaceImageData(
+                    index(image_id), array, reset_thresholds=True)
+            else:
+                # 3D and 4D images are different classes, load it anew
+                itemname = viewer.imagelist.item(index(image_id)).text()
+                viewer.deleteImageIndex(index(image_id))
+                viewer.loadImagesFromNumpy(array, itemname)
+                shown[image_id][0] = viewer.images[0]
+            closeShared(shown[image_id][1])
+            shown[image_id][1:] = [shm, array]
+        elif command == 'close':
+            image_id, = args
+            viewer.deleteImageIndex(index(image_id))
+            closeShared(shown.pop(image_id)[1])
+        elif command == 'quit':
+            app.quit()
+
+    def poll():
+        try:
+            while conn.poll():
+                message = conn.recv()
+                try:
+                    handle(message)
+                    conn.send(('ok', None))
+                except Exception as e:
+                    conn.send(('error', repr(e)))
+        except (EOFError, OSError):
+            # the calling interpreter is gone
+            app.quit()
+
+    timer = QtCore.QTimer()
+    timer.timeout.connect(poll)
+    timer.start(20)
+    viewer.show()
+    app.exec_()
+    conn.close()
+
+
+if __name__ == '__main__':
+    # Started by RemoteViewer: read the key from stdin, report the address
+    # to connect to on stdout and serve the first connection.
+    authkey = bytes.fromhex(sys.stdin.readline().strip())
+    listener = Listener(authkey=authkey)
+    sys.stdout.write(str(listener.address) + '\n')
+    sys.stdout.flush()
+    connection = listener.accept()
+    listener.close()
+    serve(connection)
@@ -0,0 +1,91 @@
+"""
+Correlation of the time courses of all voxels of a time series with the
+time course of a seed region, fast enough to follow the crosshair.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class CorrelationEngine(object):
+    """
+    Holds the time courses of the voxels of a time series demeaned and
+    scaled to unit norm as float32 (voxels, frames) matrix, so that the
+    correlations with a seed time course are one matrix-vector product.
+
+    The matrix is built and multiplied in chunks of 'chunk_size' voxels by
+    a pool of 'workers' threads (by default one per core, at most 4).
+    """
+
+    def __init__(self, rows, shape, order='C', indices=None,
+                 chunk_size=16384, workers=None):
+        """
+        'rows' are the (voxels, frames) time courses of a volume of 'shape'
+        with flat voxel indices in 'order' (see Image4D.voxelRows).
+        'indices' are the flat indices of the voxels to correlate, all by
+        default.
+        """
+        self.shape = tuple(shape)
+        self.order = order
+        self.size = rows.shape[0]
+        self.chunk_size = chunk_size
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.indices = indices
+        n = self.size if indices is None else len(indices)
+        self.normalized = np.empty((n, rows.shape[1]), dtype=np.float32)
+        # voxels that are constant or have NaNs have no correlation
+        self.valid = np.empty(n, dtype=bool)
+
+        def normalize(first):
+            last = min(first + chunk_size, n)
+            if indices is None:
+                chunk = np.array(rows[first:last], dtype=np.float64)
+            else:
+                chunk = rows[indices[first:last]].astype(np.float64)
+            chunk -= chunk.mean(axis=1)[:, np.newaxis]
+            norm = np.sqrt(np.einsum('ij,ij->i', chunk, chunk))
+            valid = np.isfinite(norm) & (norm > 0)
+            chunk[~valid] = 0
+            norm[~valid] = 1
+            self.normalized[first:last] = chunk / norm[:, np.newaxis]
+            self.valid[first:last] = valid
+
+        list(self.pool.map(normalize, range(0, n, chunk_size)))
+
+    @property
+    def nbytes(self):
+        return self.normalized.nbytes
+
+    def correlate(self, course):
+        """
+        Returns the volume of the correlations of the voxels with the time
+        course 'course'. Voxels without correlation are NaN.
+        """
+        result = np.full(self.size, np.nan, dtype=np.float32)
+        seed = np.asarray(course, dtype=np.float64)
+        seed = seed - seed.mean()
+        norm = np.sqrt(np.dot(seed, seed))
+        if np.isfinite(norm) and norm > 0:
+            seed = (seed / norm).astype(np.float32)
+            values = np.empty(len(self.normalized), dtype=np.float32)
+
+            def correlate(first):
+                last = min(first + self.chunk_size, len(values))
+                np.dot(self.normalized[first:last], seed,
+                       out=values[first:last])
+
+            list(self.pool.map(
+                correlate, range(0, len(values), self.chunk_size)))
+            values[~self.valid] = np.nan
+            if self.indices is None:
+                result = values
+            else:
+                result[self.indices] = values
+        return result.reshape(self.shape, order=self.order)
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+        self.normalized = None
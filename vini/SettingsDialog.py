@@ -9,6 +9,7 @@ import sys, os.path
 from .pyqtgraph_vini import *
 
 from .ColorMapWidget import *
+from .resample import INTERPOLATION_NAMES, INTERPOLATION_ORDERS
 from .testInputs import testFloat, testInteger
 
 
@@ -82,8 +83,8 @@ class SettingsDialog(QtGui.QDialog):
         self.l_resample = QtGui.QFormLayout()
         self.tab_resample.setLayout(self.l_resample)
         self.interp_menu = QtGui.QComboBox()
-        self.interp_menu.addItem("nearest neighbor")
-        self.interp_menu.addItem("linear")
+        for name in INTERPOLATION_NAMES:
+            self.interp_menu.addItem(name)
         self.l_resample.addRow("Interpolation:", self.interp_menu)
         self.method_box = QtGui.QComboBox()
         self.method_box.addItem("use affine information")
@@ -138,7 +139,8 @@ class SettingsDialog(QtGui.QDialog):
             self.preferences['clip_neg_low'])
 
         # Resampling
-        self.interp_menu.setCurrentIndex(self.preferences['interpolation'])
+        self.interp_menu.setCurrentIndex(
+            INTERPOLATION_ORDERS.index(self.preferences['interpolation']))
         self.method_box.setCurrentIndex(self.preferences['res_method'])
 
     def savePreferences(self):
@@ -162,7 +164,8 @@ class SettingsDialog(QtGui.QDialog):
         self.preferences['clip_neg_low'] = self.clip_cb_over_low_neg.isChecked()
 
         # Resampling
-        self.preferences['interpolation'] = self.interp_menu.currentIndex()
+        self.preferences['interpolation'] = INTERPOLATION_ORDERS[
+            self.interp_menu.currentIndex()]
         self.preferences['res_method'] = self.method_box.currentIndex()
 
         self.sigSaveSettings.emit()
@@ -0,0 +1,113 @@
+"""
+Single-instance mode: a running viewer listens on a local socket and further
+invocations hand their files over instead of starting a new viewer.
+"""
+from PyQt5 import QtNetwork
+from .pyqtgraph_vini.Qt import QtCore
+import getpass
+import json
+import os
+
+
+def serverName():
+    """
+    Returns the name of the local socket, one per user.
+    """
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = 'user'
+    return 'vini-' + user
+
+
+def sendToRunningInstance(filenames, z_filenames, func_filenames,
+                          timeout=1000):
+    """
+    Sends the files to an already running viewer.
+
+    Returns True if a viewer received them and False if there is no viewer
+    listening.
+    """
+    socket = QtNetwork.QLocalSocket()
+    socket.connectToServer(serverName())
+    if not socket.waitForConnected(timeout):
+        return False
+    message = {
+        'input': [os.path.abspath(f) for f in filenames],
+        'zmap': [os.path.abspath(f) for f in z_filenames],
+        'func': [os.path.abspath(f) for f in func_filenames],
+    }
+    socket.write((json.dumps(message) + '\n').encode('utf-8'))
+    while socket.bytesToWrite() > 0:
+        if not socket.waitForBytesWritten(timeout):
+            return False
+    socket.disconnectFromServer()
+    return True
+
+
+class InstanceServer(QtCore.QObject):
+    """
+    Listens for files sent by other vini invocations.
+    """
+
+    # Emits the received lists of filenames (normal, z-map, functional).
+    sigOpenFiles = QtCore.Signal(object, object, object)
+
+    def __init__(self, parent=None):
+        super(InstanceServer, self).__init__(parent)
+        self.server = QtNetwork.QLocalServer(self)
+        self.server.newConnection.connect(self.newConnection)
+        self.buffers = {}
+
+    def listen(self, timeout=200):
+        """
+        Starts listening. Returns False if the socket could not be created or
+        another viewer is already listening on it.
+        """
+        if not self.server.listen(serverName()):
+            # A socket left over from a crashed viewer blocks the name, but
+            # only remove it if no viewer answers on it: a viewer started at
+            # the same time may just have created it.
+            probe = QtNetwork.QLocalSocket()
+            probe.connectToServer(serverName())
+            if probe.waitForConnected(timeout):
+                probe.disconnectFromServer()
+                print("Warning: single-instance server not started, another "
+                      "viewer is already listening.")
+                return False
+            QtNetwork.QLocalServer.removeServer(serverName())
+            if not self.server.listen(serverName()):
+                print("Warning: single-instance server could not be started: "
+                      + self.server.errorString())
+                return False
+        return True
+
+    def close(self):
+        self.server.close()
+
+    def newConnection(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            self.buffers[socket] = b''
+            socket.readyRead.connect(
+                lambda socket=socket: self.readSocket(socket))
+            socket.disconnected.connect(
+                lambda socket=socket: self.closeSocket(socket))
+
+    def readSocket(self, socket):
+        self.buffers[socket] += bytes(socket.readAll())
+        while b'\n' in self.buffers[socket]:
+            line, self.buffers[socket] = \
+                self.buffers[socket].split(b'\n', 1)
+            try:
+                message = json.loads(line.decode('utf-8'))
+            except ValueError:
+                print("Warning: invalid message on the vini socket.")
+                continue
+            self.sigOpenFiles.emit(
+                message.get('input', []), message.get('zmap', []),
+                message.get('func', []))
+
+    def closeSocket(self, socket):
+        self.buffers.pop(socket, None)
+        socket.deleteLater()
@@ -197,7 +197,13 @@ class SliceWidget(GraphicsLayoutWidget):
         """
         self.sb.addItem(image_item)
         image_item.sigImageChanged.connect(self.update)
-        self.image_dimensions[0:1] = image_item.image.shape
+        # The item may only show a window of the plane, the foreground keeps
+        # the size of the whole plane.
+        shape = image_item.image.shape
+        self.image_dimensions = [
+            max(int(self.image_dimensions[0]), shape[0]),
+            max(int(self.image_dimensions[1]), shape[1])] + \
+            list(self.image_dimensions[2:3])
         # Resizing foreground might not be necessary.
         self.foreground.setImage(
             np.zeros((self.image_dimensions[0],self.image_dimensions[1],4)))
@@ -0,0 +1,134 @@
+"""
+Statistics over time of every voxel of a time series (mean, standard
+deviation, tSNR, minimum and maximum), computed in one pass over the frames
+and cached next to the file of the series.
+"""
+import os
+from collections import OrderedDict
+from functools import partial
+
+import numpy as np
+from .ProgressThread import ProgressThread
+
+# the statistics in the order they are added as images
+STATISTICS = ['mean', 'std', 'tsnr', 'min', 'max']
+
+
+def temporalStatistics(data, progress=None):
+    """
+    Returns the statistics (see STATISTICS) over the last axis of the 4D
+    array 'data' as OrderedDict of float64 volumes.
+
+    The frames are visited once with Welford's running mean and sum of
+    squared deviations, so besides the results only one frame is converted
+    to float64 at a time. NaN and infinite values are left out; voxels with
+    fewer than two values have no standard deviation and voxels without
+    deviation no tSNR (NaN). progress(frames done, frames) is called after
+    every frame, it may raise an exception to stop.
+    """
+    shape = data.shape[:3]
+    frames = data.shape[3]
+    count = np.zeros(shape)
+    mean = np.zeros(shape)
+    squares = np.zeros(shape)
+    minimum = np.full(shape, np.inf)
+    maximum = np.full(shape, -np.inf)
+    for t in range(frames):
+        frame = np.array(data[..., t], dtype=np.float64)
+        finite = np.isfinite(frame)
+        if finite.all():
+            count += 1
+            np.minimum(minimum, frame, out=minimum)
+            np.maximum(maximum, frame, out=maximum)
+        else:
+            frame[~finite] = np.nan
+            np.fmin(minimum, frame, out=minimum)
+            np.fmax(maximum, frame, out=maximum)
+            # a value equal to the mean leaves mean and squares unchanged
+            frame[~finite] = mean[~finite]
+            count += finite
+        delta = frame - mean
+        mean += delta / np.maximum(count, 1)
+        squares += delta * (frame - mean)
+        if progress is not None:
+            progress(t + 1, frames)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(squares / (count - 1))
+        std[count < 2] = np.nan
+        tsnr = mean / std
+    tsnr[~(std > 0)] = np.nan
+    empty = count == 0
+    for array in [mean, minimum, maximum]:
+        array[empty] = np.nan
+    return OrderedDict(zip(STATISTICS, [mean, std, tsnr, minimum, maximum]))
+
+
+def cacheFilename(filename):
+    return filename + '.stats.npz'
+
+
+def fileStamp(filename):
+    """
+    Returns the size and modification time of 'filename', which change when
+    the file is written.
+    """
+    status = os.stat(filename)
+    return np.array([status.st_size, status.st_mtime_ns], dtype=np.int64)
+
+
+def loadStatistics(filename, shape):
+    """
+    Returns the statistics of the series in 'filename' of 'shape' from the
+    cache next to it, or None if they were not cached or the file changed.
+    """
+    try:
+        with np.load(cacheFilename(filename)) as cache:
+            if not np.array_equal(cache['stamp'], fileStamp(filename)) or \
+                    tuple(cache['shape']) != tuple(shape):
+                return None
+            return OrderedDict((name, cache[name]) for name in STATISTICS)
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def saveStatistics(filename, shape, statistics, stamp):
+    """
+    Caches the statistics of the series in 'filename' of 'shape', read when
+    the file had the fileStamp 'stamp', next to it. Nothing is cached if the
+    directory can't be written.
+    """
+    cache = cacheFilename(filename)
+    # written under another name first, so that the cache is never partial
+    temporary = cache + '.part'
+    try:
+        with open(temporary, 'wb') as fileobj:
+            np.savez(fileobj, stamp=stamp, shape=np.array(shape),
+                     **statistics)
+        os.replace(temporary, cache)
+    except (IOError, OSError):
+        print("Cannot cache the statistics of {}".format(filename))
+
+
+def cachedStatistics(data, filename=None, stamp=None, progress=None):
+    """
+    Returns the temporalStatistics of 'data' and caches them if the series
+    was read from 'filename' with the fileStamp 'stamp'.
+    """
+    statistics = temporalStatistics(data, progress)
+    if filename is not None:
+        saveStatistics(filename, data.shape, statistics, stamp)
+    return statistics
+
+
+class StatisticsThread(ProgressThread):
+    """
+    Computes temporalStatistics in the background, reporting the progress,
+    and caches them if the series was read from 'filename'.
+    """
+
+    def __init__(self, data, name, filename=None, parent=None):
+        stamp = None if filename is None else fileStamp(filename)
+        super(StatisticsThread, self).__init__(
+            partial(cachedStatistics, data, filename, stamp),
+            "Computing the statistics", name, "frame", parent)
@@ -2,6 +2,47 @@ from .pyqtgraph_vini.Qt import QtGui, QtCore
 import numpy as np
 
 from .pyqtgraph_vini import *
+from .pyqtgraph_vini import functions as fn
+from .QualityControl import robustScores
+
+
+class DesignItem(UIGraphicsItem):
+    """
+    Draws the intervals of all experimental conditions as vertical bands.
+
+    The intervals of a condition are kept in one path, so the plot only
+    holds one item however long the design is.
+    """
+
+    def __init__(self, des_mat, colors):
+        super(DesignItem, self).__init__()
+        self.paths = []
+        for cond in np.unique(des_mat[:,0]):
+            rows = des_mat[des_mat[:,0] == cond]
+            path = QtGui.QPainterPath()
+            # overlapping intervals must not cancel out
+            path.setFillRule(QtCore.Qt.WindingFill)
+            for onset, duration in rows[:,1:3]:
+                # unit height, scaled to the view when painted
+                path.addRect(QtCore.QRectF(onset, 0, duration, 1))
+            self.paths.append((path, mkBrush(colors[cond])))
+        self.x_bounds = (des_mat[:,1].min(),
+                         (des_mat[:,1] + des_mat[:,2]).max())
+        self.setZValue(-10)
+
+    def paint(self, p, *args):
+        view = self.boundingRect()
+        p.setPen(fn.mkPen(None))
+        p.translate(0, view.top())
+        p.scale(1, view.height())
+        for path, brush in self.paths:
+            p.setBrush(brush)
+            p.drawPath(path)
+
+    def dataBounds(self, axis, frac=1.0, orthoRange=None):
+        if axis == 0:
+            return self.x_bounds
+        return None
 
 
 class TimePlot(GraphicsWindow):
@@ -9,23 +50,32 @@ class TimePlot(GraphicsWindow):
     Plots the time series of a voxel of a functional image.
     """
 
-    def __init__(self, time_step = None, title="time plot"):
-        super(TimePlot, self).__init__()
+    def __init__(self, time_step = None, title="time plot", parent=None):
+        super(TimePlot, self).__init__(parent=parent)
 
         self.resize(720,320)
         self.setWindowTitle('Time series')
 
         self.time = time_step
 
-        # Linear region items' list for indicating experimental conditions.
-        self.lri = []
+        # Item indicating the experimental conditions.
+        self.design_item = None
+
+        # The x values are only recomputed if the number of volumes or the
+        # frame time change.
+        self.x = None
+        self.x_key = None
 
         # Set the text and line color to black.
         setConfigOption('foreground', 'k')
 
         # Open a new plot with black pen.
         self.plot = self.addPlot(title="time plot: %s" %title, pen='k', labels={'left': "signal", 'bottom': "volumes"})
-        self.curve = self.plot.plot(pen='k')
+        # Long time series are reduced to the minimum and maximum of the
+        # samples under each pixel, and only the visible part is drawn.
+        self.curve = self.plot.plot(pen='k', autoDownsampleFactor=1.)
+        self.plot.setDownsampling(auto=True, mode='peak')
+        self.plot.setClipToView(True)
         self.setBackground('w')
         # Set configuration back to white for other widgets.
         setConfigOption('foreground', 'w')
@@ -49,36 +99,109 @@ class TimePlot(GraphicsWindow):
         Refresh the data.
         """
         self.time = time
-        # TODO: only compute x once
-        self.x = np.linspace(0.0, self.time*data.shape[0],
-                             num=data.shape[0], endpoint=False)
+        x_key = (data.shape[0], time)
+        if x_key != self.x_key:
+            self.x = np.linspace(0.0, self.time*data.shape[0],
+                                 num=data.shape[0], endpoint=False)
         self.curve.setData(x=self.x, y=data)
-        self.plot.autoRange()
+        if x_key != self.x_key:
+            self.x_key = x_key
+            self.plot.autoRange()
+        else:
+            # keep the time range (the user may have zoomed in)
+            finite = data[np.isfinite(data)]
+            if finite.size > 0:
+                self.setYRange(finite.min(), finite.max())
 
     def delDesign(self):
         """
         If the design file is deleted the linear regions are removed here.
         """
-        for i in self.lri:
-            self.plot.removeItem(i)
-        self.lri = []
+        if self.design_item is not None:
+            self.plot.removeItem(self.design_item)
+            self.design_item = None
 
     def setDesign(self, des_mat, colors):
         """
-        Set new linear regions for the different experimental conditions.
+        Shows the intervals of the different experimental conditions.
+        """
+        self.delDesign()
+        if des_mat.shape[0] == 0:
+            return
+        self.design_item = DesignItem(des_mat, colors)
+        self.plot.addItem(self.design_item)
+
+
+class QualityPlot(TimePlot):
+    """
+    Strip of the per-frame quality traces of a functional image (see
+    QualityControl.frameTraces) with a line at the current frame. Clicking
+    selects the frame with the highest outlier score near the click.
+    """
+
+    # the frame clicked on
+    sigFrameSelected = QtCore.Signal(int)
+
+    def __init__(self, parent=None):
+        super(QualityPlot, self).__init__(title="quality", parent=parent)
+        self.plot.setTitle(None)
+        self.plot.setLabel('left', "score")
+        self.plot.setMouseEnabled(y=False)
+        self.setFixedHeight(150)
+        # the raw traces
+        self.traces = None
+        self.frame = 0
+        # The global mean and DVARS are shown as robust scores like the
+        # outlier score, so that they share the axis. The strip has no room
+        # for a legend, the tooltip explains the colors.
+        self.global_curve = self.plot.plot(pen=mkPen((40, 90, 200)))
+        self.dvars_curve = self.plot.plot(pen=mkPen((200, 60, 40)))
+        self.curve.setZValue(1)
+        self.frame_line = InfiniteLine(
+            angle=90, movable=False, pen=mkPen((0, 160, 0)))
+        self.plot.addItem(self.frame_line)
+        self.scene().sigMouseClicked.connect(self.selectFrame)
+
+    def setTraces(self, traces):
+        """
+        Shows the OrderedDict 'traces' of frameTraces.
+        """
+        self.traces = traces
+        global_mean, dvars, score = list(traces.values())
+        x = np.arange(len(score))
+        self.global_curve.setData(x=x, y=robustScores(global_mean))
+        # the first frame has no DVARS
+        self.dvars_curve.setData(x=x[1:], y=robustScores(dvars[1:]))
+        self.curve.setData(x=x, y=score)
+        self.plot.autoRange()
+        self.setFrame(self.frame)
+
+    def setFrame(self, frame):
+        """
+        Moves the frame line and shows the traces of 'frame'.
         """
-        # Remove old ones.
-        for i in self.lri:
-            self.plot.removeItem(i)
-        # Create new ones.
-        for i in range(0,des_mat.shape[0]):
-            brush = mkBrush(colors[des_mat[i,0]])
-            lr = LinearRegionItem(brush=brush, values=[des_mat[i,1],
-                                     des_mat[i,1]+des_mat[i,2]])
-            lr.setMovable(False)
-            lr.setZValue(-10)
-            self.lri.append(lr)
-
-        # Add them to the plot.
-        for i in self.lri:
-            self.plot.addItem(i)
+        self.frame = frame
+        self.frame_line.setValue(frame)
+        if self.traces is not None and frame < len(self.traces['DVARS']):
+            self.setToolTip(
+                "outlier score (black), global mean (blue) and DVARS (red) "
+                "as scores, click to show a volume\nvolume {}: ".format(
+                    frame) + ", ".join(
+                    "{} {:.4g}".format(name, trace[frame])
+                    for name, trace in self.traces.items()))
+
+    def selectFrame(self, ev):
+        if self.traces is None or not ev.button() & QtCore.Qt.LeftButton:
+            return
+        view = self.plot.vb
+        if not view.sceneBoundingRect().contains(ev.scenePos()):
+            return
+        score = self.traces['outlier score']
+        x = view.mapSceneToView(ev.scenePos()).x()
+        # a spike is a few pixels wide at most, whatever the zoom
+        reach = max(1, int(round(3 * view.viewPixelSize()[0])))
+        first = int(np.clip(round(x) - reach, 0, len(score) - 1))
+        last = int(np.clip(round(x) + reach, 0, len(score) - 1))
+        window = np.nan_to_num(score[first:last+1], nan=-np.inf)
+        ev.accept()
+        self.sigFrameSelected.emit(first + int(np.argmax(window)))
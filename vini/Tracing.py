@@ -0,0 +1,143 @@
+"""
+Timing of the stages of the display pipeline.
+
+Functions decorated with 'traced' and blocks in a 'span' are recorded by the
+module's 'tracer' while it is enabled; otherwise they only cost a flag check.
+The recorded spans can be saved as a Chrome trace (chrome://tracing or
+https://ui.perfetto.dev) and are summarised as percentiles for the
+performance overlay. Setting the environment variable VINI_TRACE to a
+filename enables tracing at start-up and saves the trace there at exit.
+"""
+import atexit
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class Tracer(object):
+    """
+    Records named spans (start and duration) and frame times.
+    """
+
+    def __init__(self, capacity=200000, window=300):
+        self.enabled = False
+        # (name, start, duration, thread id), times in seconds
+        self.events = collections.deque(maxlen=capacity)
+        # name -> durations of the last 'window' spans
+        self.durations = {}
+        self.window = window
+        # view name -> times of the last paints
+        self.frames = {}
+        self.origin = time.perf_counter()
+
+    def enable(self, state=True):
+        self.enabled = state
+
+    def clear(self):
+        self.events.clear()
+        self.durations = {}
+        self.frames = {}
+
+    def record(self, name, start, duration):
+        self.events.append((name, start, duration, threading.get_ident()))
+        if name not in self.durations:
+            self.durations[name] = collections.deque(maxlen=self.window)
+        self.durations[name].append(duration)
+
+    def frame(self, view):
+        """
+        Marks that 'view' was painted.
+        """
+        if not self.enabled:
+            return
+        if view not in self.frames:
+            self.frames[view] = collections.deque(maxlen=1000)
+        self.frames[view].append(time.perf_counter())
+
+    def fps(self, period=1.0):
+        """
+        Returns the paints per second of the most often painted view during
+        the last 'period' seconds.
+        """
+        now = time.perf_counter()
+        counts = [sum(1 for t in times if now - t <= period)
+                  for times in list(self.frames.values())]
+        return max(counts + [0]) / float(period)
+
+    def statistics(self):
+        """
+        Returns {name: (count, p50, p95)} over the last spans of each stage,
+        durations in seconds.
+        """
+        result = {}
+        for name, durations in list(self.durations.items()):
+            values = np.array(durations)
+            if len(values) > 0:
+                result[name] = (len(values), np.percentile(values, 50),
+                                np.percentile(values, 95))
+        return result
+
+    def chromeTrace(self):
+        """
+        Returns the recorded spans in the Chrome trace event format.
+        """
+        pid = os.getpid()
+        events = [{
+            'name': name, 'cat': 'vini', 'ph': 'X', 'pid': pid, 'tid': tid,
+            'ts': 1e6 * (start - self.origin), 'dur': 1e6 * duration,
+        } for name, start, duration, tid in list(self.events)]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.chromeTrace(), f)
+
+
+tracer = Tracer()
+
+
+class span(object):
+    """
+    Context manager recording the enclosed block as stage 'name'.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter() if tracer.enabled else None
+        return self
+
+    def __exit__(self, *args):
+        if self.start is not None:
+            tracer.record(self.name, self.start,
+                          time.perf_counter() - self.start)
+        return False
+
+
+def traced(name):
+    """
+    Decorator recording every call of the function as stage 'name'.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                tracer.record(name, start, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+if os.environ.get('VINI_TRACE'):
+    tracer.enable()
+    atexit.register(tracer.save, os.environ['VINI_TRACE'])
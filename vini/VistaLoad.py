@@ -3,7 +3,6 @@
 vista loader, native python implementation
 """
 
-import scipy.io as sio
 import numpy as np
 import subprocess
 import nibabel as nib
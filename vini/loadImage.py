@@ -12,6 +12,9 @@ from nibabel import load
 from nibabel.affines import apply_affine
 from nibabel.volumeutils import shape_zoom_affine
 from nibabel import Nifti2Image
+from nibabel.arrayproxy import ArrayProxy
+from nibabel.openers import ImageOpener
+from nibabel.volumeutils import apply_read_scaling
 
 from .pyqtgraph_vini import *
 
@@ -21,7 +24,10 @@ from .ColorMapWidget import *
 from .ImageDialog import *
 from .Image3D import *
 from .Image4D import *
+from .BrickStore import BrickStore
+from .BrickedImage3D import BrickedImage3D
 from .VistaLoad import load_vista
+from .Tracing import traced
 
 # try:
 #     import pyvista
@@ -30,6 +36,10 @@ from .VistaLoad import load_vista
 
 from .quaternions import fillpositive, quat2mat, mat2quat
 
+# Large 3D images are shown as a strided subsample of about this many voxels
+# first (see loadPreviewFromFile).
+PREVIEW_VOXELS = 2**21
+
 
 def calculateQFormAffine(pixdim, qform_code, quats):
     bcd = [quats[0], quats[1], quats[2]]
@@ -50,25 +60,26 @@ def calculateQFormAffine(pixdim, qform_code, quats):
     out[0:3, 3] = [quats[3], quats[4], quats[5]]
     return out
 
-def setPreferences(image, hdr, pref, f_type):
+def setPreferences(image, hdr, pref, f_type, scan=None):
+    """
+    Returns the image for the nifti object 'image' with the preferences set.
+    'scan' is what scanData returns for the data if it is already known.
+    """
     color_cm = False
     if f_type != 0:
         color_cm = True
     
-    # if data contain NaNs convert to zero
-    if np.isnan(image.get_fdata()).any():
-        notnan = image.get_fdata()
-        notnan[np.isnan(image.get_fdata())] = 0
-        image = Nifti2Image(notnan, image.affine)
+    # NaNs are kept, the images note whether there are any in one pass over
+    # the data (scanData) and show them transparent.
 
     # allow 2d-images here:
     if len(image.get_fdata().shape) == 2:
        image = Nifti2Image(np.atleast_3d(image.get_fdata()), image.affine)
 
     if len(image.get_fdata().shape) == 3:
-        img = Image3D(image=image, color=color_cm)
+        img = Image3D(image=image, color=color_cm, scan=scan)
     elif len(image.get_fdata().shape) == 4:
-        img = Image4D(image=image, color=color_cm)
+        img = Image4D(image=image, color=color_cm, scan=scan)
         frame_time = hdr['pixdim'][4]
         if frame_time > 15:
             frame_time = frame_time/1000
@@ -78,7 +89,13 @@ def setPreferences(image, hdr, pref, f_type):
     else:
         print ("image error: image is neither 3D nor 4D.")
 
+    applyPreferences(img, hdr, pref, f_type)
+    return img
 
+def applyPreferences(img, hdr, pref, f_type):
+    """
+    Sets the colormaps, clippings and interpolation of the preferences.
+    """
     if 'sform_code' in hdr.keys():
         img.sform_code = hdr['sform_code']
     
@@ -103,6 +120,15 @@ def setPreferences(image, hdr, pref, f_type):
             img.setInterpolation(pref['interpolation'])
 
     img.writeProps()
+
+def loadBrickedImage(filename, pref, f_type):
+    """
+    Opens a bricked multiresolution volume (see BrickStore), its data stays
+    on disk.
+    """
+    store = BrickStore(filename)
+    img = BrickedImage3D(store, color=(f_type != 0))
+    applyPreferences(img, store.header, pref, f_type)
     return img
 
 def loadImageFromNifti(fileobject, pref, f_type):
@@ -116,8 +142,10 @@ def loadImageFromNifti(fileobject, pref, f_type):
     return img
 
 
-def loadImageFromNumpy(array, pref, f_type=0):
-    image = Nifti2Image(array, np.eye(4))
+def loadImageFromNumpy(array, pref, f_type=0, affine=None):
+    if affine is None:
+        affine = np.eye(4)
+    image = Nifti2Image(array, affine)
     hdr = image.header
     img = setPreferences(image, hdr, pref, f_type)
     return img
@@ -133,21 +161,66 @@ def loadImageFromNumpyFile(filename):
 
 
 
-def loadImageFromFile(filename, pref, f_type):
+def readData(image, progress=None, chunk_size=2**22):
+    """
+    Returns the data of the nibabel image 'image' like get_fdata does.
 
+    With 'progress' the file is read in chunks of 'chunk_size' bytes and
+    progress(bytes read, total bytes, shape) is called after each of them.
+    It may raise an exception to stop reading.
+    """
+    proxy = image.dataobj
+    if progress is None or not isinstance(proxy, ArrayProxy):
+        return image.get_fdata()
+    dtype = np.dtype(proxy.dtype)
+    shape = tuple(proxy.shape)
+    total = int(np.prod(shape)) * dtype.itemsize
+    raw = np.empty(total, dtype=np.uint8)
+    view = memoryview(raw)
+    progress(0, total, shape)
+    with ImageOpener(proxy.file_like) as fileobj:
+        fileobj.seek(proxy.offset)
+        done = 0
+        while done < total:
+            n = fileobj.readinto(view[done:done+chunk_size])
+            if not n:
+                raise IOError("the file ends after {} of {} bytes".format(
+                    done, total))
+            done += n
+            progress(done, total, shape)
+    data = raw.view(dtype).reshape(shape, order=proxy.order)
+    # scaled and converted as nibabel does in get_fdata
+    slope = np.asanyarray(proxy.slope)
+    inter = np.asanyarray(proxy.inter)
+    if np.can_cast(slope, np.float64):
+        slope = slope.astype(np.float64)
+    if np.can_cast(inter, np.float64):
+        inter = inter.astype(np.float64)
+    return np.asarray(
+        apply_read_scaling(data, slope, inter), dtype=np.float64)
+
+
+def readImageFile(filename, progress=None):
+    """
+    Reads a .nii, .nii.gz, .hdr/.img, .v or .npy file and returns the nifti
+    object with its data and the header, or (None, None) if it can't be read.
+    'progress' is passed to readData for .nii, .nii.gz and .hdr/.img files.
+    """
+    image, hdr = None, None
     filetype = os.path.splitext(filename)[1]
     if (filetype=='.nii' or filetype=='.gz'):
         try:
             temp_img = load(filename)
-            image = Nifti2Image(temp_img.get_fdata(), temp_img.affine)
+            image = Nifti2Image(
+                readData(temp_img, progress), temp_img.affine)
             hdr = temp_img.header
         except RuntimeError:
             print("Cannot load .nii or nii.gz file: {}".format(filename))
     elif (filetype=='.hdr' or filetype=='.img'):
         try:
             temp_img = load(filename)
-            image = Nifti2Image(temp_img.get_fdata(), temp_img.affine)
-            image.dataobj[np.isnan(image.dataobj)] = 0
+            image = Nifti2Image(
+                readData(temp_img, progress), temp_img.affine)
             hdr = temp_img.header
         except RuntimeError:
             print("Cannot load img/hdr pair file: {}".format(filename))
@@ -165,12 +238,69 @@ def loadImageFromFile(filename, pref, f_type):
             hdr = image.header
         except RuntimeError:
             print("Cannot load numpy file: {}".format(filename))
-    
-    
+
     else:
         print("ERROR!! CANNOT LOAD THIS IMAGE!")
+    return image, hdr
+
+
+def previewStride(shape, voxels=PREVIEW_VOXELS):
+    """
+    Returns the stride that subsamples a volume of 'shape' to at most about
+    'voxels' voxels, 1 if it is small enough.
+    """
+    n = float(np.prod(shape[:3]))
+    if n <= voxels:
+        return 1
+    return int(np.ceil((n / voxels) ** (1. / 3)))
+
+
+def loadPreviewFromFile(filename, pref, f_type):
+    """
+    Returns an image of a large 3D .nii, .nii.gz or .hdr/.img file that
+    shows a strided subsample of the data until the full data is read with
+    readImageFile and set with Image.replacePreview. Returns None for other
+    files, which are loaded with loadImageFromFile.
+    """
+    filetype = os.path.splitext(filename)[1]
+    if filetype not in ('.nii', '.gz', '.hdr', '.img'):
+        return None
+    try:
+        temp_img = load(filename)
+    except Exception:
+        return None
+    if len(temp_img.shape) != 3:
+        return None
+    stride = previewStride(temp_img.shape)
+    if stride == 1:
+        return None
+    # only the voxels of the subsample are read (uncompressed files) and
+    # converted
+    data = np.asarray(
+        temp_img.dataobj[::stride, ::stride, ::stride], dtype=np.float64)
+    affine = np.dot(temp_img.affine, np.diag([stride]*3 + [1]))
+    img = setPreferences(
+        Nifti2Image(data, affine), temp_img.header, pref, f_type)
+    # the header and affine of the full image with the data of the preview
+    img.image = temp_img
+    img.preview = (data, stride)
+    img.filename = filename
+    return img
+
+
+@traced('loadImageFromFile')
+def loadImageFromFile(filename, pref, f_type):
+
+    filetype = os.path.splitext(filename)[1]
+    if (filetype == '.bricks'):
+        img = loadBrickedImage(filename, pref, f_type)
+        img.filename = filename
+        return img
+
+    image, hdr = readImageFile(filename)
+    if image is None:
         return
-    
+
     # import pdb; pdb.set_trace()
 
     img = setPreferences(image, hdr, pref, f_type)
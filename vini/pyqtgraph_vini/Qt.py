@@ -136,7 +136,7 @@ elif QT_LIB == PYQT5:
     
     # We're using PyQt5 which has a different structure so we're going to use a shim to
     # recreate the Qt4 structure for Qt5
-    from PyQt5 import QtGui, QtCore, QtWidgets, uic
+    from PyQt5 import QtGui, QtCore, QtWidgets
     try:
         from PyQt5 import QtSvg
     except ImportError:
@@ -209,7 +209,13 @@ if QT_LIB.startswith('PyQt'):
     import sip
     def isQObjectAlive(obj):
         return not sip.isdeleted(obj)
-    loadUiType = uic.loadUiType
+    def loadUiType(uiFile):
+        # uic is only needed for designer files, import it on first use
+        if QT_LIB == PYQT5:
+            from PyQt5 import uic
+        else:
+            from PyQt4 import uic
+        return uic.loadUiType(uiFile)
 
     QtCore.Signal = QtCore.pyqtSignal
     
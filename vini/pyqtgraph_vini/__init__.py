@@ -149,6 +149,9 @@ if __version__ is None and not hasattr(sys, 'frozen') and sys.version_info[0] ==
 ## Import almost everything to make it available from a single namespace
 ## don't import the more complex systems--canvas, parametertree, flowchart, dockarea
 ## these must be imported separately.
+## The same holds for the widgets that vini does not use (MultiPlot,
+## ScatterPlot, ColorMap, CheckTable, DataFilter, Joystick, DataTree and Table
+## widgets), they pull in parametertree and metaarray at startup.
 #from . import frozenSupport
 #def importModules(path, globals, locals, excludes=()):
     #"""Import all modules residing within *path*, return a dict of name: module pairs.
@@ -228,7 +231,6 @@ from .graphicsItems.GraphicsWidgetAnchor import *
 from .graphicsItems.PlotCurveItem import * 
 from .graphicsItems.ButtonItem import * 
 from .graphicsItems.GradientEditorItem import * 
-from .graphicsItems.MultiPlotItem import * 
 from .graphicsItems.ErrorBarItem import * 
 from .graphicsItems.IsocurveItem import * 
 from .graphicsItems.LinearRegionItem import * 
@@ -237,30 +239,22 @@ from .graphicsItems.LegendItem import *
 from .graphicsItems.ScatterPlotItem import * 
 from .graphicsItems.ItemGroup import * 
 
-from .widgets.MultiPlotWidget import * 
-from .widgets.ScatterPlotWidget import * 
-from .widgets.ColorMapWidget import * 
 from .widgets.FileDialog import * 
 from .widgets.ValueLabel import * 
 from .widgets.HistogramLUTWidget import * 
-from .widgets.CheckTable import * 
 from .widgets.BusyCursor import * 
 from .widgets.PlotWidget import * 
 from .widgets.ComboBox import * 
 from .widgets.GradientWidget import * 
-from .widgets.DataFilterWidget import * 
 from .widgets.SpinBox import * 
-from .widgets.JoystickButton import * 
 from .widgets.GraphicsLayoutWidget import * 
 from .widgets.TreeWidget import * 
 from .widgets.PathButton import * 
 from .widgets.VerticalLabel import * 
 from .widgets.FeedbackButton import * 
 from .widgets.ColorButton import * 
-from .widgets.DataTreeWidget import * 
 from .widgets.GraphicsView import * 
 from .widgets.LayoutWidget import * 
-from .widgets.TableWidget import * 
 from .widgets.ProgressDialog import *
 
 from .imageview import *
@@ -44,12 +44,6 @@ elif QT_LIB == 'PyQt5':
 
 __all__ = ['PlotItem']
 
-try:
-    from metaarray import *
-    HAVE_METAARRAY = True
-except:
-    HAVE_METAARRAY = False
-
 
 
 
@@ -1611,11 +1611,14 @@ class ViewBox(GraphicsWidget):
         vr = self.viewRect()
         if vr.height() == 0 or vr.width() == 0:
             return
-        scale = Point(bounds.width()/vr.width(), bounds.height()/vr.height())
+        # plain floats: Point indexing and arithmetic round to int, which
+        # collapses views showing more than one unit per pixel
+        scale_x = bounds.width()/vr.width()
+        scale_y = bounds.height()/vr.height()
         if not self.state['yInverted']:
-            scale = scale * Point(1, -1)
+            scale_y = -scale_y
         if self.state['xInverted']:
-            scale = scale * Point(-1, 1)
+            scale_x = -scale_x
         m = QtGui.QTransform()
 
         ## First center the viewport at 0
@@ -1623,9 +1626,9 @@ class ViewBox(GraphicsWidget):
         m.translate(center.x(), center.y())
 
         ## Now scale and translate properly
-        m.scale(scale[0], scale[1])
-        st = Point(vr.center())
-        m.translate(-st[0], -st[1])
+        m.scale(scale_x, scale_y)
+        st = vr.center()
+        m.translate(-st.x(), -st.y())
 
         self.childGroup.setTransform(m)
 
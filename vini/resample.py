@@ -2,37 +2,443 @@
 Resampling methods to resample the image data.
 """
 
-from multiprocessing import Process
-from multiprocessing import sharedctypes
+import itertools
 import os
-import warnings
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from numpy import ctypeslib
-import scipy as sp
-from scipy import ndimage, linalg
 
-def resample_image(data, affine, shape, interpolation):
+from .Tracing import traced
+
+# the interpolations offered as spline orders and their names
+INTERPOLATION_ORDERS = [0, 1, 3]
+INTERPOLATION_NAMES = ["nearest neighbor", "linear", "cubic"]
+
+
+def spline_coefficients(data, order):
+    """
+    Returns the coefficients of the spline of 'order' (> 1) through 'data'
+    that resample_image interpolates with prefilter=False. NaN and infinite
+    values are taken as 0, as they would spread along whole rows.
+    """
+    from scipy import ndimage
+
+    data = np.asarray(data, dtype=np.float64)
+    finite = np.isfinite(data)
+    if not finite.all():
+        data = np.where(finite, data, 0.)
+    return ndimage.spline_filter(
+        data, order=order, output=np.float64, mode='constant')
+
+
+def invalid_voxels(data):
+    """
+    Returns where 'data' is NaN or infinite, or None if it is finite
+    everywhere.
+    """
+    finite = np.isfinite(data)
+    if finite.all():
+        return None
+    return ~finite
+
+
+def mark_invalid(result, invalid, affine, shape, workers=None,
+                 slab_size=2**18):
+    """
+    Sets the voxels of 'result' (resampled with spline interpolation from
+    data with the 'invalid' voxels) to NaN where linear interpolation would
+    use an invalid voxel, as the spline coefficients have none.
+    """
+    near = resample_image(invalid.view(np.uint8), affine, shape, 1,
+                          workers=workers, slab_size=slab_size)
+    result[near > 0] = np.nan
+
+
+def axis_mapping(affine):
+    """
+    Returns for every input axis the output axis it is sampled along if the
+    affine (output voxels to input voxels) maps every output axis to one
+    input axis, i.e. has no rotation or shear. Returns None otherwise.
+    """
+    A = np.asarray(affine, dtype=float)[0:3,0:3]
+    nonzero = A != 0
+    if not np.all(nonzero.sum(axis=1) == 1) or \
+            not np.all(nonzero.sum(axis=0) == 1):
+        return None
+    return [int(np.flatnonzero(row)[0]) for row in nonzero]
+
+
+def axis_indices(coords, size, interpolation):
+    """
+    Returns the input indices sampled at the coordinates 'coords' along an
+    axis of 'size' voxels, with -1 for coordinates outside, as
+    scipy.ndimage does with mode 'constant'. Returns None if the values
+    would have to be interpolated.
+    """
+    inside = (coords >= 0) & (coords <= size - 1)
+    if interpolation == 0:
+        # halves are rounded up
+        indices = np.floor(coords + 0.5)
+    elif np.all(coords == np.floor(coords)):
+        indices = coords
+    else:
+        return None
+    return np.where(inside, indices, -1).astype(np.intp)
+
+
+def axis_sampler(indices):
+    """
+    Returns a slice and the repetitions of its elements (None if all are
+    taken once) that produce the valid entries of 'indices', or the indices
+    themselves if they don't form a run (e.g. zoomed in and out).
+    """
+    values, counts = np.unique(indices, return_counts=True)
+    if len(values) > 1:
+        steps = np.diff(indices)
+        step = values[1] - values[0] if steps.sum() > 0 else \
+            values[0] - values[1]
+        if not np.all((steps == 0) | (steps == step)) or \
+                not np.all(np.diff(values) == values[1] - values[0]):
+            return indices
+        if step < 0:
+            counts = counts[::-1]
+        stop = indices[-1] + step
+        run = slice(indices[0], None if stop < 0 else stop, step)
+    else:
+        run = slice(indices[0], indices[0] + 1)
+    return run, None if np.all(counts == 1) else counts
+
+
+def repeat_blocks(array, repeats, out):
+    """
+    Writes the 3D 'array' with its elements along every axis repeated by
+    the numbers in 'repeats' (None: once each) into 'out'.
+
+    Runs of elements repeated equally often (e.g. all but the first and
+    last for an integer zoom) are written as blocks in one pass.
+    """
+    segments = []
+    for axis, counts in enumerate(repeats):
+        if counts is None:
+            segments.append([(slice(None), slice(None), 1)])
+            continue
+        changes = np.flatnonzero(np.diff(counts)) + 1
+        starts = [0] + list(changes)
+        ends = list(changes) + [len(counts)]
+        if len(starts) > 3:
+            # no blocks, e.g. a fractional zoom
+            for axis, counts in enumerate(repeats):
+                if counts is not None:
+                    array = np.repeat(array, counts, axis=axis)
+            out[...] = array
+            return
+        axis_segments = []
+        position = 0
+        for first, last in zip(starts, ends):
+            factor = int(counts[first])
+            length = (last - first) * factor
+            axis_segments.append(
+                (slice(first, last), slice(position, position + length),
+                 factor))
+            position += length
+        segments.append(axis_segments)
+    for (s0, d0, f0), (s1, d1, f1), (s2, d2, f2) in \
+            itertools.product(*segments):
+        source = array[s0, s1, s2]
+        n = source.shape
+        # splitting the axes of the target gives a view to write to
+        out[d0, d1, d2].reshape(n[0], f0, n[1], f1, n[2], f2)[...] = \
+            source[:, np.newaxis, :, np.newaxis, :, np.newaxis]
+
+
+def resample_axes(data, affine, shape, interpolation):
+    """
+    Returns the data resampled like affine_transform does for affines
+    without rotation or shear (see axis_mapping) if no value has to be
+    interpolated, else None.
+
+    Identities and flips give a view of the data, permutations a transposed
+    view. Integer zoom factors repeat blocks of voxels (nearest neighbour),
+    other axes are indexed. Voxels outside of the data are 0.
+    """
+    mapping = axis_mapping(affine)
+    if mapping is None or interpolation > 1:
+        return None
+    A = np.asarray(affine, dtype=float)[0:3,0:3]
+    b = np.asarray(affine, dtype=float)[0:3,3]
+    # the coordinates exactly as affine_transform computes them, for a
+    # diagonal matrix it zooms the shifted output voxels
+    diagonal = np.all(np.diag(np.diag(A)) == A)
+    indices = [None] * 3
+    for axis, out_axis in enumerate(mapping):
+        scale = A[axis, out_axis]
+        if diagonal:
+            coords = (np.arange(shape[out_axis]) + b[axis] / scale) * scale
+        else:
+            coords = np.arange(shape[out_axis]) * scale + b[axis]
+        indices[axis] = axis_indices(coords, data.shape[axis], interpolation)
+        if indices[axis] is None:
+            return None
+    # the output voxels that fall into the data, a range per axis
+    valid = [np.flatnonzero(i >= 0) for i in indices]
+    if any(len(v) == 0 for v in valid):
+        return np.zeros(shape)
+    if interpolation > 0 and not np.isfinite(data).all():
+        # interpolation makes NaN spread to the neighbours even at whole
+        # voxels
+        return None
+    sampled = data
+    repeats = [None] * 3
+    for axis in range(3):
+        sampler = axis_sampler(indices[axis][valid[axis][0]:
+                                             valid[axis][-1] + 1])
+        index = [slice(None)] * 3
+        if isinstance(sampler, tuple):
+            index[axis] = sampler[0]
+            sampled = sampled[tuple(index)]
+            repeats[axis] = sampler[1]
+        else:
+            sampled = sampled.take(sampler, axis=axis)
+    # input axes in the order of the output axes
+    order = [mapping.index(out_axis) for out_axis in range(3)]
+    bounds = [valid[order[out_axis]] for out_axis in range(3)]
+    if all(counts is None for counts in repeats) and \
+            sampled.shape == tuple(shape[axis] for axis in mapping):
+        return np.asarray(sampled.transpose(order), dtype=float)
+    # zeros are allocated lazily, only the sampled part is written
+    result = np.zeros(shape)
+    inside = result[tuple(slice(v[0], v[-1] + 1) for v in bounds)]
+    repeat_blocks(sampled, repeats, inside.transpose(np.argsort(order)))
+    return result
+
+
+@traced('resample_image')
+def resample_image(data, affine, shape, interpolation, prefilter=True,
+                   workers=None, slab_size=2**18, progress=None,
+                   invalid=None):
+    """
+    Resamples 'data' to 'shape' with the affine mapping output voxels to
+    input voxels, by nearest neighbour (0), linear (1) or spline
+    interpolation of higher order. With prefilter=False 'data' are already
+    the spline_coefficients, which saves computing them for every call,
+    and 'invalid' the invalid_voxels of the data. Invalid voxels make the
+    result NaN where linear interpolation would use them (see
+    mark_invalid).
 
-    A = affine[0:3,0:3]
-    b = affine[0:3,3]
+    Without rotation or shear and with whole input voxels (see
+    resample_axes) the data is copied or viewed instead of interpolated;
+    the result is the same. A view of 'data' must not be written to.
 
-    # The following is necessary because of an inconsistency in scipy's
-    # resampling method for versions < 0.18.0.
-    if np.all(np.diag(np.diag(A)) == A):        
-        A = np.diag(A)
+    Otherwise the output is resampled in slabs of about 'slab_size' voxels
+    along the first axis by a pool of 'workers' threads (by default one per
+    core, at most 8), as scipy releases the GIL while it interpolates. Each
+    slab is sampled at the coordinates affine_transform computes for the
+    whole grid, so the result is bit for bit that of one affine_transform
+    call, whatever the slabs and 'workers'.
+    progress(slabs done, slabs) is called after each slab in the calling
+    thread; it may raise an exception to stop, the slabs not started yet
+    are then dropped.
+    """
+    # scipy is imported on first use to keep the start-up of vini fast
+    from scipy import ndimage
 
     shape = tuple(np.asarray(shape).astype(int))
+    result = resample_axes(data, affine, shape, interpolation)
+    if result is not None:
+        return result
+    if interpolation > 1 and prefilter:
+        invalid = invalid_voxels(data)
+        data = spline_coefficients(data, interpolation)
+
+    A = np.asarray(affine, dtype=float)[0:3,0:3]
+    b = np.asarray(affine, dtype=float)[0:3,3]
+
+    # affine_transform zooms and shifts for diagonal matrices (which was
+    # inconsistent with the general case for scipy versions < 0.18.0)
+    diagonal = np.all(np.diag(np.diag(A)) == A)
+    zooms = np.diag(A)
 
     result = np.empty(shape,  dtype=float)
-    
-    
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore", UserWarning)
-        ndimage.affine_transform(data, A, b, output_shape=shape, output=result, order=interpolation)
+    step = max(1, slab_size // max(1, shape[1] * shape[2]))
+
+    def resample_slab(first):
+        last = min(first + step, shape[0])
+        # the coordinates of the output voxels in the order of operations of
+        # affine_transform, computed separately they would differ slightly
+        axes = np.ix_(np.arange(first, last, dtype=float),
+                      np.arange(shape[1], dtype=float),
+                      np.arange(shape[2], dtype=float))
+        coords = np.empty((3, last - first) + shape[1:])
+        for axis in range(3):
+            if diagonal:
+                coords[axis] = (axes[axis] + b[axis] / zooms[axis]) * \
+                    zooms[axis]
+            else:
+                coords[axis] = axes[0] * A[axis,0] + axes[1] * A[axis,1] + \
+                    axes[2] * A[axis,2] + b[axis]
+        ndimage.map_coordinates(
+            data, coords, output=result[first:last], order=interpolation,
+            prefilter=False)
 
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
+    firsts = range(0, shape[0], step)
+    if workers > 1 and len(firsts) > 1:
+        with ThreadPoolExecutor(
+                max_workers=min(workers, len(firsts))) as pool:
+            slabs = [pool.submit(resample_slab, first) for first in firsts]
+            try:
+                for done, slab in enumerate(slabs, 1):
+                    slab.result()
+                    if progress is not None:
+                        progress(done, len(slabs))
+            except BaseException:
+                for slab in slabs:
+                    slab.cancel()
+                raise
+    else:
+        for done, first in enumerate(firsts, 1):
+            resample_slab(first)
+            if progress is not None:
+                progress(done, len(firsts))
+
+    if interpolation > 1 and invalid is not None:
+        mark_invalid(result, invalid, affine, shape, workers, slab_size)
     return result
 
+def sample_coordinates(data, coords, interpolation=0):
+    """
+    Samples 'data' at N voxel coordinates given as (N, 3) array with
+    nearest neighbour (0) or trilinear (1) interpolation. Returns (N,) for
+    3D data and (N, T) for 4D data, coordinates outside are NaN.
+    """
+    from scipy import ndimage
+
+    coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+    if data.ndim == 4:
+        # all frames in one call, the time coordinate is always integer
+        n_frames = data.shape[3]
+        coords = np.concatenate([
+            np.repeat(coords, n_frames, axis=0),
+            np.tile(np.arange(n_frames), len(coords))[:,np.newaxis]], axis=1)
+    # the values are float64 whatever the type of the data
+    values = ndimage.map_coordinates(
+        data, coords.T, order=interpolation, mode='constant', cval=np.nan,
+        output=np.float64)
+    if data.ndim == 4:
+        values = values.reshape(-1, data.shape[3])
+    return values
+
+
+class ResampledGrid(object):
+    """
+    Read-only stand-in for resampled data that only resamples the voxels
+    that are indexed (lazy mode).
+
+    Integers, slices and one sequence of indices are accepted per axis, as
+    for a numpy array. 'mapping' maps grid voxels to voxels of 'data'.
+    With prefilter=False 'data' are the spline_coefficients for an
+    'interpolation' of higher order and 'invalid' the invalid_voxels of the
+    data (see resample_image).
+    """
+
+    ndim = 3
+    dtype = np.dtype(np.float64)
+
+    def __init__(self, data, mapping, shape, interpolation, prefilter=True,
+                 invalid=None):
+        if interpolation > 1 and prefilter:
+            # computed once instead of for every sample
+            invalid = invalid_voxels(data)
+            data = spline_coefficients(data, interpolation)
+        self.data = data
+        self.invalid = invalid if interpolation > 1 else None
+        self.mapping = np.asarray(mapping, dtype=float)
+        self.shape = tuple(int(n) for n in shape)
+        self.interpolation = interpolation
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (3 - len(key))
+        if len(key) != 3:
+            raise IndexError("resampled data has three dimensions")
+        axes = []
+        integers = []
+        for axis, k in enumerate(key):
+            if isinstance(k, slice):
+                axes.append(np.arange(self.shape[axis])[k])
+            elif np.ndim(k) == 1:
+                axes.append(np.arange(self.shape[axis])[np.asarray(k)])
+            else:
+                k = int(k)
+                if k < 0:
+                    k += self.shape[axis]
+                if not 0 <= k < self.shape[axis]:
+                    raise IndexError(
+                        "index {} is out of bounds for axis {} with size "
+                        "{}".format(k, axis, self.shape[axis]))
+                axes.append(np.array([k]))
+                integers.append(axis)
+        if sum(np.ndim(k) == 1 for k in key) > 1:
+            raise IndexError("only one axis can be indexed by a sequence")
+        grid = np.meshgrid(*axes, indexing='ij')
+        points = np.stack([g.ravel() for g in grid], axis=1)
+        voxels = np.dot(points, self.mapping[:3, :3].T) + self.mapping[:3, 3]
+        values = self.sample(voxels, integers)
+        values = values.reshape(grid[0].shape).squeeze(axis=tuple(integers))
+        if values.ndim == 0:
+            return values[()]
+        return values
+
+    def sample(self, voxels, integers):
+        """
+        Returns the values at the (N, 3) voxel coordinates of the source.
+        'integers' are the axes indexed by an integer.
+        """
+        from scipy import ndimage
+
+        values = ndimage.map_coordinates(
+            self.data, voxels.T, order=self.interpolation, mode='constant',
+            cval=0.0, prefilter=False)
+        if self.invalid is not None:
+            # as mark_invalid does for resample_image
+            near = ndimage.map_coordinates(
+                self.invalid.view(np.uint8), voxels.T, order=1,
+                mode='constant', cval=0.0, output=np.float64)
+            values[near > 0] = np.nan
+        return values
+
+    def argExtreme(self, arg):
+        """
+        Returns the flat index of the extreme value found by 'arg' (e.g.
+        np.nanargmax), resampled slab by slab along the first axis so that the
+        whole grid is never held in memory.
+        """
+        step = max(1, 2**22 // max(1, self.shape[1] * self.shape[2]))
+        best = None
+        for first in range(0, self.shape[0], step):
+            slab = self[first:first+step]
+            try:
+                index = arg(slab)
+            except ValueError:
+                # the nan variants fail on slabs of NaNs only
+                continue
+            value = slab.ravel()[index]
+            # the first occurrence wins as for numpy
+            if best is None or arg([best[1], value]) == 1:
+                best = (first * self.shape[1] * self.shape[2] + index, value)
+        return 0 if best is None else best[0]
+
+    def argmax(self):
+        return self.argExtreme(np.nanargmax)
+
+    def argmin(self):
+        return self.argExtreme(np.nanargmin)
+
+
 if __name__ == "__main__":
+    from scipy import ndimage
 
     # small test of scipy's ndimage.affine_transform
     A = np.zeros((4,4))
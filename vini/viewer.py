@@ -38,7 +38,6 @@ verbose_level = 5
 from .QxtSpanSlider import QxtSpanSlider
 
 from .pyqtgraph_vini.Qt import QtCore, QtGui
-from .pyqtgraph_vini.exporters import ImageExporter
 
 import numpy as np
 import math
@@ -67,6 +66,7 @@ from .SliceWidget import *
 from .SingleSlice import *
 from .Image3D import *
 from .Image4D import *
+from .BrickedImage3D import BrickedImage3D
 from .loadImage import *
 from .ImageItemMod import *
 from .SliceWindow import *
@@ -77,6 +77,24 @@ from .MosaicDialog import *
 from .MosaicView import *
 # for functional movie mode:
 from .JumpSlider import JumpSlider
+# for handing files to a running viewer:
+from .SingleInstance import InstanceServer, sendToRunningInstance
+from .FrameWatcher import FrameWatcher
+from .ImageLoader import LoadThread, RefineThread
+from .ConditionAverage import AverageThread
+from .SeedCorrelation import CorrelationEngine
+from .TemporalStatistics import STATISTICS, StatisticsThread, loadStatistics
+from .QualityControl import TracesThread
+from .TimePlot import QualityPlot
+from .PlaneStacks import StacksThread
+from .CoordinateTable import readCoordinates, writeValues
+# for timing the display pipeline:
+from .Tracing import tracer, traced
+from .PerformanceOverlay import PerformanceOverlay
+# for the memory panel:
+from .MemoryDialog import MemoryDialog
+from .MemoryUsage import MemoryCounter, imageMemory, systemMemory, formatBytes
+from .resample import ResampledGrid
 # testing input
 from .testInputs import testFloat, testInteger
 # print infos if necessary
@@ -84,9 +102,6 @@ from .Verboseprint import verboseprint
 import time
 import re
 import traceback
-import matplotlib
-from matplotlib.image import imsave
-import pkg_resources
 
 try:
     _fromUtf8 = QtCore.QString.fromUtf8
@@ -114,6 +129,13 @@ def get_time():
     str_time = time.strftime('%H%M%S', current_time)
     return str_time
 
+def iconPath(name):
+    """
+    Returns the path of an icon shipped in vini/icons.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'icons',
+                        name)
+
 def unicode(string):
     try:
         res = unicode(string)
@@ -211,6 +233,46 @@ class Viff(QtGui.QMainWindow):
         # The same for colormap thresholds.
         self.threshold_write_block = False
 
+        # Only the visible windows of the planes are sliced, at the
+        # resolution of the screen. They are updated shortly after the views
+        # changed.
+        self.detail_timer = QtCore.QTimer()
+        self.detail_timer.setSingleShot(True)
+        self.detail_timer.setInterval(30)
+        self.detail_timer.timeout.connect(self.updateDetail)
+        # Windows of the planes that are sliced (see planeWindow).
+        self.plane_windows = [None, None, None]
+
+        # Large images are shown as a preview first (see loadPreviewFromFile)
+        # and added images are resampled in the background (see
+        # Image.deferred). 'refine_queue' holds the images whose full data is
+        # still to be read or resampled and 'refine_thread' works on one of
+        # them.
+        self.refine_queue = []
+        self.refine_thread = None
+        # Files opened while images are shown are read one after the other
+        # by 'load_thread'. 'load_queue' holds (filename, file type) of the
+        # files still to be read.
+        self.load_queue = []
+        self.load_thread = None
+        # Computes the trial averages of all voxels of a 4D image (see
+        # computeConditionVolumes).
+        self.average_thread = None
+        # Computes the statistics over time of a 4D image (see
+        # computeStatistics).
+        self.statistics_thread = None
+        # Computes the quality traces of a 4D image, shown in 'quality_plot'
+        # for 'quality_image' (see toggleQualityTraces).
+        self.quality_thread = None
+        self.quality_image = None
+        # 4D images whose planes for playback are still to be computed by
+        # 'stacks_thread' (see preparePlayback).
+        self.stacks_queue = []
+        self.stacks_thread = None
+        # Seed correlation map: the 4D image, its CorrelationEngine, the 3D
+        # image showing the map and the seed voxel of the map, or None.
+        self.correlation = None
+
         # 'prefered_path' saves the path last used to load a file into the
         # viewer, making it more convenient to use the File Dialog.
         self.prefered_path = None
@@ -246,6 +308,13 @@ class Viff(QtGui.QMainWindow):
         # The MosaicView class is only initialized if needed
         self.mosaic_view = None
 
+        # Memory held by the images and what can be released.
+        self.memory_dialog = MemoryDialog()
+        self.memory_dialog.sigLazy.connect(self.setImageLazy)
+        self.memory_dialog.sigReleaseCaches.connect(self.releaseCaches)
+        self.memory_dialog.sigBudget.connect(self.setMemoryBudget)
+        self.memory_dialog.sigRefresh.connect(self.updateMemoryDialog)
+
         # 'mosaic_lines' contains a list of help lines shown when the
         # MosaicDialog is openend.
         self.mosaic_lines = {}
@@ -255,6 +324,15 @@ class Viff(QtGui.QMainWindow):
 
         # The ipython qtconsole is only initialized if needed.
         self.console = None
+
+        # The single-instance server is only started on request.
+        self.instance_server = None
+
+        # Follow mode: watcher of incoming volumes and the image they are
+        # appended to.
+        self.frame_watcher = None
+        self.follow_image = None
+        self.follow_newest = True
         
         self.is_linked = False
         
@@ -284,7 +362,7 @@ class Viff(QtGui.QMainWindow):
         log1("setupUI: window posx: {}, posy: {}, width: {}, height: {}".format(posx, posy, width, height))
         self.setGeometry(posx, posy, width, height)
 
-        self.setWindowIcon(QtGui.QIcon(pkg_resources.resource_filename(__name__, 'icons/app_icon.svg')))
+        self.setWindowIcon(QtGui.QIcon(iconPath('app_icon.svg')))
 
         # The size of the slice widget kept changing as did the offset of all
         # other widgets. 'listoffset' was used to make this easier.
@@ -325,6 +403,12 @@ class Viff(QtGui.QMainWindow):
         self.slice_popouts[1] = SingleSlice('s')
         self.slice_popouts[2] = SingleSlice('t')
 
+        # frame rate and stage latencies drawn over the slice views
+        self.performance_overlay = PerformanceOverlay(self.centralwidget)
+        self.performance_overlay.watch('c', self.c_slice_widget)
+        self.performance_overlay.watch('s', self.s_slice_widget)
+        self.performance_overlay.watch('t', self.t_slice_widget)
+
 
 
         imagelist_layout = QtGui.QGridLayout()
@@ -348,8 +432,8 @@ class Viff(QtGui.QMainWindow):
         self.up_button.clicked.connect(self.swapUp)
         self.down_button.clicked.connect(self.swapDown)
         
-        icon_up = QtGui.QIcon(pkg_resources.resource_filename(__name__, 'icons/chevron-up.svg'))
-        icon_down = QtGui.QIcon(pkg_resources.resource_filename(__name__, 'icons/chevron-down.svg'))
+        icon_up = QtGui.QIcon(iconPath('chevron-up.svg'))
+        icon_down = QtGui.QIcon(iconPath('chevron-down.svg'))
         self.up_button.setIcon(icon_up)
         self.down_button.setIcon(icon_down)
         self.up_button.setToolTip('move image up')
@@ -360,7 +444,7 @@ class Viff(QtGui.QMainWindow):
         # add image button
         self.add_button = QtGui.QToolButton(self)
         self.add_button.clicked.connect(self.openNewFile)
-        icon_add = QtGui.QIcon(pkg_resources.resource_filename(__name__, 'icons/plus.svg'))
+        icon_add = QtGui.QIcon(iconPath('plus.svg'))
         
         self.add_button.setIcon(icon_add)
         self.add_button.setToolTip("add image")
@@ -369,7 +453,7 @@ class Viff(QtGui.QMainWindow):
         # delete image button
         self.del_button = QtGui.QToolButton(self)
         self.del_button.clicked.connect(self.deleteImage)
-        icon_dash = QtGui.QIcon(pkg_resources.resource_filename(__name__, 'icons/dash.svg'))
+        icon_dash = QtGui.QIcon(iconPath('dash.svg'))
         self.del_button.setIcon(icon_dash)
         self.del_button.setToolTip("remove currently selected image")
         imagelist_layout.addWidget(self.del_button, 3, 4, 1, 1)
@@ -383,7 +467,7 @@ class Viff(QtGui.QMainWindow):
         self.cross_button.setCheckable(True)
         self.cross_button.setChecked(True)
         
-        icon_cross = QtGui.QIcon(pkg_resources.resource_filename(__name__, 'icons/cross.svg'))
+        icon_cross = QtGui.QIcon(iconPath('cross.svg'))
         self.cross_button.setIcon(icon_cross)
         self.cross_button.setToolTip("toggle crosshair on/off")
         self.cross_button.clicked.connect(self.setCrosshairsVisible)
@@ -395,8 +479,8 @@ class Viff(QtGui.QMainWindow):
         self.max_button = QtGui.QToolButton(self)
         self.min_button.clicked.connect(self.findMin)
         self.max_button.clicked.connect(self.findMax)
-        icon_min = QtGui.QIcon(pkg_resources.resource_filename(__name__, 'icons/min.svg'))
-        icon_max = QtGui.QIcon(pkg_resources.resource_filename(__name__, 'icons/max.svg'))
+        icon_min = QtGui.QIcon(iconPath('min.svg'))
+        icon_max = QtGui.QIcon(iconPath('max.svg'))
         self.min_button.setIcon(icon_min)
         self.max_button.setIcon(icon_max)
         self.min_button.setToolTip("go to local minimum")
@@ -490,7 +574,7 @@ class Viff(QtGui.QMainWindow):
         self.backward_button = QtGui.QToolButton(self)
         self.backward_button.pressed.connect(self.prevFrame)
         self.backward_button.released.connect(self.setSliceStateOff)
-        icon_backward = QtGui.QIcon(pkg_resources.resource_filename(__name__, 'icons/prev.svg'))
+        icon_backward = QtGui.QIcon(iconPath('prev.svg'))
         
         self.backward_button.setIcon(icon_backward)
         self.backward_button.setToolTip("move to previous volume")
@@ -503,8 +587,8 @@ class Viff(QtGui.QMainWindow):
         self.play_button.pressed.connect(self.playFuncPressed)
         self.play_button.released.connect(self.playFuncReleased)
         
-        self.icon_play = QtGui.QIcon(pkg_resources.resource_filename(__name__, 'icons/triangle-right.svg'))
-        self.icon_pause = QtGui.QIcon(pkg_resources.resource_filename(__name__, 'icons/pause.svg'))
+        self.icon_play = QtGui.QIcon(iconPath('triangle-right.svg'))
+        self.icon_pause = QtGui.QIcon(iconPath('pause.svg'))
         
         self.play_button.setIcon(self.icon_play)
         self.play_button.setToolTip("play as movie")
@@ -514,7 +598,7 @@ class Viff(QtGui.QMainWindow):
         self.forward_button = QtGui.QToolButton(self)
         self.forward_button.pressed.connect(self.nextFrame)
         self.forward_button.released.connect(self.setSliceStateOff)
-        icon_forward = QtGui.QIcon(pkg_resources.resource_filename(__name__, 'icons/next.svg'))
+        icon_forward = QtGui.QIcon(iconPath('next.svg'))
         
         
         self.forward_button.setIcon(icon_forward)
@@ -558,8 +642,16 @@ class Viff(QtGui.QMainWindow):
         spacer = QtGui.QWidget()
         spacer.setSizePolicy(QtGui.QSizePolicy.Minimum, QtGui.QSizePolicy.Fixed)
         button_row_fmrislider.addWidget(spacer,1)
-        
-        self.l.addLayout(button_row_fmrislider, 5, self.listoffset+2, 1, 1)
+
+        # quality traces of the frames under the slider
+        slider_column = QtGui.QVBoxLayout()
+        slider_column.addLayout(button_row_fmrislider)
+        self.quality_plot = QualityPlot(parent=self)
+        self.quality_plot.sigFrameSelected.connect(self.jumpToFrame)
+        self.quality_plot.hide()
+        slider_column.addWidget(self.quality_plot)
+
+        self.l.addLayout(slider_column, 5, self.listoffset+2, 1, 1)
         
         
         
@@ -704,6 +796,12 @@ class Viff(QtGui.QMainWindow):
         self.slice_popouts[1].sw.sigMouseOver.connect(self.MouseMoved)
         self.slice_popouts[2].sw.sigMouseOver.connect(self.MouseMoved)
 
+        # for the level of detail of out-of-core images
+        for widget in [self.c_slice_widget, self.s_slice_widget,
+                       self.t_slice_widget] + \
+                [popout.sw for popout in self.slice_popouts]:
+            self.connectDetail(widget)
+
         ## keyboard shortcuts ##
         # zooming in
         self.zoom_in = QtGui.QAction('ZoomIn', self)
@@ -785,6 +883,22 @@ class Viff(QtGui.QMainWindow):
         # disables the functional play buttons and sliders
         self.disableFuncView()
 
+        # progress of loading and resampling in the background, the status
+        # bar is only shown while something is in progress
+        self.load_label = QtGui.QLabel()
+        self.load_progress = QtGui.QProgressBar()
+        self.load_progress.setMaximumWidth(200)
+        self.load_progress.setTextVisible(False)
+        self.load_cancel = QtGui.QPushButton("Cancel")
+        self.load_cancel.setFocusPolicy(QtCore.Qt.NoFocus)
+        self.load_cancel.setToolTip(
+            "Stop loading the files that are read and computing averages.")
+        self.load_cancel.clicked.connect(self.cancelLoads)
+        self.statusBar().addWidget(self.load_label, 1)
+        self.statusBar().addPermanentWidget(self.load_progress)
+        self.statusBar().addPermanentWidget(self.load_cancel)
+        self.statusBar().hide()
+
         # links or delinks the slice widgets
         if self.link_mode == 0:
             self.linkSlices(True)
@@ -819,6 +933,20 @@ class Viff(QtGui.QMainWindow):
         openFile.triggered.connect(self.openNewFile)
         self.file_menu.addAction(openFile)
 
+        follow_action = QtGui.QAction('Follow acquisition...', self)
+        follow_action.setStatusTip(
+            'Show volumes written to a directory as they arrive')
+        follow_action.triggered.connect(self.openFollowDirectory)
+        self.file_menu.addAction(follow_action)
+
+        self.follow_newest_action = QtGui.QAction(
+            'Jump to newest frame', self, checkable=True)
+        self.follow_newest_action.setChecked(self.follow_newest)
+        self.follow_newest_action.setStatusTip(
+            'Show every new volume as soon as it arrives in follow mode')
+        self.follow_newest_action.toggled.connect(self.setFollowNewest)
+        self.file_menu.addAction(self.follow_newest_action)
+
         exit_action = QtGui.QAction(
             QtGui.QIcon.fromTheme("window-close"), '&Exit', self)
         exit_action.setShortcut(QtGui.QKeySequence("Ctrl+C"))
@@ -831,7 +959,7 @@ class Viff(QtGui.QMainWindow):
         res_os_ratio.triggered.connect(self.setOSRatio)
         self.resampling_menu.addAction(res_os_ratio)
 
-        self.icon_checked  = QtGui.QIcon(pkg_resources.resource_filename(__name__, 'icons/check.svg'))
+        self.icon_checked  = QtGui.QIcon(iconPath('check.svg'))
         
 
         self.res_affine = QtGui.QAction('Apply affine transformation', self)
@@ -901,6 +1029,13 @@ class Viff(QtGui.QMainWindow):
         openHistogram.triggered.connect(self.openHistogramWindow)
         self.tools_menu.addAction(openHistogram)
 
+        # values of all images at a table of coordinates
+        queryCoords = QtGui.QAction('Sample coordinate table...', self)
+        queryCoords.setStatusTip(
+            'Write the values of all images at coordinates read from a CSV file')
+        queryCoords.triggered.connect(self.queryCoordinatesFromFile)
+        self.tools_menu.addAction(queryCoords)
+
         # copy properties
         copyImageProps = QtGui.QAction('Copy image properties', self)
         copyImageProps.setShortcut('c')
@@ -922,6 +1057,51 @@ class Viff(QtGui.QMainWindow):
         openMosaic.triggered.connect(self.openMosaic)
         self.tools_menu.addAction(openMosaic)
 
+        # frame rate and timing of the display pipeline
+        self.performance_action = QtGui.QAction(
+            'Performance overlay', self, checkable=True)
+        self.performance_action.setShortcut('Ctrl+P')
+        self.performance_action.setStatusTip(
+            'Show the frame rate and the time spent in each display stage')
+        self.performance_action.toggled.connect(self.togglePerformanceOverlay)
+        self.tools_menu.addAction(self.performance_action)
+
+        saveTrace = QtGui.QAction('Save performance trace...', self)
+        saveTrace.setStatusTip(
+            'Save the recorded display stages as Chrome trace (JSON)')
+        saveTrace.triggered.connect(self.saveTrace)
+        self.tools_menu.addAction(saveTrace)
+
+        # correlation of all voxels with the voxel at the crosshair
+        self.correlation_action = QtGui.QAction(
+            'Seed correlation map', self, checkable=True)
+        self.correlation_action.setStatusTip(
+            'Show the correlation with the time course at the crosshair')
+        self.correlation_action.toggled.connect(self.toggleCorrelation)
+        self.tools_menu.addAction(self.correlation_action)
+
+        # mean, standard deviation, tSNR, minimum and maximum over time
+        computeStatistics = QtGui.QAction('Temporal statistics', self)
+        computeStatistics.setStatusTip(
+            'Add the statistics over time of the selected 4D image as images')
+        computeStatistics.triggered.connect(self.computeStatistics)
+        self.tools_menu.addAction(computeStatistics)
+
+        # global mean, DVARS and outlier score of every frame
+        self.quality_action = QtGui.QAction(
+            'Quality control traces', self, checkable=True)
+        self.quality_action.setStatusTip(
+            'Show the quality traces of the frames of the selected 4D image')
+        self.quality_action.toggled.connect(self.toggleQualityTraces)
+        self.tools_menu.addAction(self.quality_action)
+
+        # memory held by the images
+        openMemory = QtGui.QAction('Memory usage...', self)
+        openMemory.setStatusTip(
+            'Show the memory held by each image and release some of it')
+        openMemory.triggered.connect(self.openMemoryDialog)
+        self.tools_menu.addAction(openMemory)
+
         ## Preferences ##
         # for editing the search width
         searchPreferences = QtGui.QAction('Search min/max width', self)
@@ -953,8 +1133,13 @@ class Viff(QtGui.QMainWindow):
             return
 
         for i in range(len(filename_list)):
-            img = loadImageFromFile(
+            # Large images are shown as preview until refineImages has read
+            # them completely.
+            img = loadPreviewFromFile(
                 unicode(filename_list[i]), self.preferences, type_list[i])
+            if img is None:
+                img = loadImageFromFile(
+                    unicode(filename_list[i]), self.preferences, type_list[i])
             # Saves the first part of the path as 'prefered_path'.
             self.prefered_path = "/".join(filename_list[i].split('/')[:-1])
             # Connects changes in the image dialog with rerendering the image.
@@ -1061,6 +1246,205 @@ class Viff(QtGui.QMainWindow):
         # This will automatically scale and pan the images in the slices.
         self.autoRange()
 
+        self.refineImages()
+
+    def refineImages(self):
+        """
+        Reads the full data of the images shown as preview and resamples the
+        deferred images in a background thread, one image after the other,
+        and shows them when they are ready.
+        """
+        for img in self.images:
+            if (img.preview is not None or (img.deferred and not img.lazy)) \
+                    and img not in self.refine_queue and \
+                    (self.refine_thread is None or
+                     self.refine_thread.img is not img):
+                self.refine_queue.append(img)
+        self.refineNext()
+
+    def refineNext(self):
+        if self.refine_thread is not None:
+            return
+        # images may have been removed in the meantime
+        self.refine_queue = [img for img in self.refine_queue
+                             if img in self.images]
+        if len(self.refine_queue) == 0:
+            return
+        img = self.refine_queue.pop(0)
+        self.refine_thread = RefineThread(
+            img, self.imagelist.item(self.images.index(img)).text())
+        # thresholds that are still the defaults of the preview are reset to
+        # those of the full data
+        self.refine_thread.thresholds = (
+            list(img.threshold_pos), list(img.threshold_neg))
+        self.refine_thread.sigProgress.connect(self.updateLoadProgress)
+        self.refine_thread.sigRefined.connect(self.imageRefined)
+        self.refine_thread.start()
+        self.updateLoadProgress()
+
+    def imageRefined(self, img, result):
+        """
+        Replaces the preview of 'img' by the full data read by refineNext, or
+        sets the data resampled by refineNext for a deferred image.
+        """
+        thread = self.refine_thread
+        thread.wait()
+        self.refine_thread = None
+        if img in self.images:
+            changed = False
+            if isinstance(result, Exception):
+                print("Cannot read or resample {}: {}".format(
+                    thread.filename, result))
+            elif result is None:
+                # cancelled, the preview or deferred data is kept
+                pass
+            elif thread.read:
+                img.replacePreview(*result)
+                if thread.thresholds == (list(img.threshold_pos),
+                                         list(img.threshold_neg)):
+                    img.setThresholdsDefault()
+                changed = True
+            else:
+                changed = img.setResampled(*result[2:])
+            if changed:
+                index = self.images.index(img)
+                img.slice(np.asarray(self.img_coord).astype(np.int32))
+                self.updateImageItem(index)
+                if index == self.imagelist.currentRow():
+                    self.updateSelected()
+                self.updateMemoryDialog()
+            # resampled differently in the meantime
+            if img.deferred and not img.lazy and result is not None and \
+                    not isinstance(result, Exception) and \
+                    img not in self.refine_queue:
+                self.refine_queue.append(img)
+        self.refineNext()
+        self.updateLoadProgress()
+
+    def queueLoad(self, filename, file_type=0):
+        """
+        Reads the file in a background thread after the files queued before
+        and adds it as new image (see loadNewImage).
+
+        file_type: normal (0), z-map (1) or functional (2)
+        """
+        self.load_queue.append((filename, file_type))
+        self.loadNext()
+
+    def loadNext(self):
+        if self.load_thread is None and len(self.load_queue) > 0:
+            filename, file_type = self.load_queue.pop(0)
+            self.load_thread = LoadThread(filename, file_type)
+            self.load_thread.sigProgress.connect(self.updateLoadProgress)
+            self.load_thread.sigLoaded.connect(self.imageLoaded)
+            self.load_thread.start()
+        self.updateLoadProgress()
+
+    def imageLoaded(self, result):
+        """
+        Adds the image read by loadNext. Its resampled data is computed in the
+        background.
+        """
+        thread = self.load_thread
+        thread.wait()
+        self.load_thread = None
+        if isinstance(result, Exception):
+            print("Cannot load {}: {}".format(thread.filename, result))
+            QtGui.QMessageBox.warning(
+                self, "Warning",
+                "Error: image could not be loaded: " + thread.filename)
+        elif result is not None:
+            try:
+                image, hdr, scan = result
+                img = setPreferences(
+                    image, hdr, self.preferences, thread.file_type, scan)
+                img.filename = thread.filename
+                self.addNewImage(img, thread.filename, deferred=True)
+            except:
+                traceback.print_exc()
+                QtGui.QMessageBox.warning(
+                    self, "Warning",
+                    "Error: image could not be loaded: " + thread.filename)
+        self.loadNext()
+
+    def cancelLoads(self):
+        """
+        Stops reading the current file, drops the queued files and stops
+        computing averages, statistics, quality traces and planes for
+        playback, and reading the full data of previews and resampling.
+        """
+        self.load_queue = []
+        if self.load_thread is not None:
+            self.load_thread.cancel()
+        self.refine_queue = []
+        if self.refine_thread is not None:
+            self.refine_thread.cancel()
+        if self.average_thread is not None:
+            self.average_thread.cancel()
+        if self.statistics_thread is not None:
+            self.statistics_thread.cancel()
+        if self.quality_thread is not None:
+            self.quality_thread.cancel()
+        self.stacks_queue = []
+        if self.stacks_thread is not None:
+            self.stacks_thread.cancel()
+        self.updateLoadProgress()
+
+    def updateLoadProgress(self):
+        """
+        Shows the progress of loading, averaging, computing statistics,
+        quality traces or planes for playback and resampling in the status
+        bar.
+        """
+        fraction = None
+        if self.load_thread is not None:
+            text, fraction = self.load_thread.progress
+            if self.load_thread.cancelled:
+                text = "Cancelling {}".format(self.load_thread.name)
+            if len(self.load_queue) > 0:
+                text += " ({} more queued)".format(len(self.load_queue))
+        elif self.average_thread is not None:
+            text, fraction = self.average_thread.progress
+            if self.average_thread.cancelled:
+                text = "Cancelling the averages of {}".format(
+                    self.average_thread.name)
+        elif self.statistics_thread is not None:
+            text, fraction = self.statistics_thread.progress
+            if self.statistics_thread.cancelled:
+                text = "Cancelling the statistics of {}".format(
+                    self.statistics_thread.name)
+        elif self.quality_thread is not None:
+            text, fraction = self.quality_thread.progress
+            if self.quality_thread.cancelled:
+                text = "Cancelling the quality traces of {}".format(
+                    self.quality_thread.name)
+        elif self.stacks_thread is not None:
+            text, fraction = self.stacks_thread.progress
+            if len(self.stacks_queue) > 0:
+                text += " ({} more)".format(len(self.stacks_queue))
+        elif self.refine_thread is not None:
+            text, fraction = self.refine_thread.progress
+            if self.refine_thread.cancelled:
+                text = "Cancelling {}".format(self.refine_thread.name)
+            if len(self.refine_queue) > 0:
+                text += " ({} more)".format(len(self.refine_queue))
+        else:
+            self.statusBar().hide()
+            return
+        self.load_label.setText(text)
+        if fraction is None:
+            # busy indicator
+            self.load_progress.setRange(0, 0)
+        else:
+            self.load_progress.setRange(0, 1000)
+            self.load_progress.setValue(int(fraction * 1000))
+        self.load_cancel.setEnabled(any(
+            thread is not None and not thread.cancelled
+            for thread in [self.load_thread, self.average_thread,
+                           self.statistics_thread, self.quality_thread,
+                           self.stacks_thread, self.refine_thread]))
+        self.statusBar().show()
+
     def loadNewImageObject(self, fileobj, filename='NiftiObj'):
         """
         Loads a new file.
@@ -1137,14 +1521,28 @@ class Viff(QtGui.QMainWindow):
         self.updateSelected()
         self.autoRange()
 
-    def loadNewImage(self, filename):
+    def loadNewImage(self, filename, file_type=0):
         """
         Loads a new file.
+
+        file_type: normal (0), z-map (1) or functional (2)
         """
         # Gets the image instance from 
-        img = loadImageFromFile(unicode(filename), self.preferences, 0)
+        img = loadImageFromFile(unicode(filename), self.preferences, file_type)
+        self.addNewImage(img, filename)
+
+    def addNewImage(self, img, filename, deferred=False):
+        """
+        Adds the loaded image 'img' of the file 'filename' on top of the
+        other images.
+
+        With deferred=True the images are resampled lazily first and their
+        resampled data is computed in the background (see reresample).
+        """
         # save path as prefered
-        self.prefered_path = "/".join(filename.split('/')[:-1])
+        if os.path.dirname(filename):
+            self.prefered_path = "/".join(filename.split('/')[:-1])
+        img.filename = filename
         img.dialog.sigImageChanged.connect(self.updateImages)
         img.dialog.sigImageChanged.connect(self.updateSelected)
 
@@ -1177,7 +1575,7 @@ class Viff(QtGui.QMainWindow):
 
         # Resample all images with previous settings
         # This makes sense since the new image might have a higher resolution.
-        self.reresample()
+        self.reresample(deferred)
 
         self.addToSliceWidgets(0)
 
@@ -1211,12 +1609,12 @@ class Viff(QtGui.QMainWindow):
         self.updateSelected()
         self.autoRange()
         
-    def loadImagesFromNumpy(self, array, itemname):
+    def loadImagesFromNumpy(self, array, itemname, affine=None):
         """
         Loads an image provided as numpy array
         """
 
-        img = loadImageFromNumpy(array, self.preferences, 0)
+        img = loadImageFromNumpy(array, self.preferences, 0, affine)
         # save path as prefered
         img.dialog.sigImageChanged.connect(self.updateImages)
         img.dialog.sigImageChanged.connect(self.updateSelected)
@@ -1282,6 +1680,34 @@ class Viff(QtGui.QMainWindow):
         self.autoRange()
         
         
+    def replaceImageData(self, index, array, reset_thresholds=False):
+        """
+        Replaces the data of the image with the given index by a numpy array
+        with the same number of dimensions.
+
+        If the shape is unchanged only this image is resampled, otherwise all
+        images are resampled to the new common grid.
+        """
+        img = self.images[index]
+        old_shape = img.image.shape
+        if array.ndim == 2:
+            array = np.atleast_3d(array)
+        if (array.ndim == 4) != (img.type_d() == "4D"):
+            raise ValueError("the number of dimensions can not change")
+        img.replaceData(Nifti2Image(array, img.image.affine))
+        if img.type_d() == "4D":
+            if img.getTimeDim() > self.time_dim:
+                self.time_dim = img.getTimeDim()
+                self.frame_sld.setMaximum(self.time_dim-1)
+        if reset_thresholds:
+            img.setThresholdsDefault()
+        if array.shape[:3] == old_shape[:3] and img.affine_res_inv is not None:
+            img.reresample()
+            self.updateImages()
+            self.updateSelected()
+        else:
+            self.reresample()
+
         #%% checkIf2DAndRemovePanes
     def checkIf2DAndRemovePanes(self):
         
@@ -1290,7 +1716,7 @@ class Viff(QtGui.QMainWindow):
         max_t = -1
         
         for i in range(len(self.images)):
-            sh = self.images[i].image.get_fdata().shape
+            sh = self.images[i].image.shape
             if sh[0] > max_c:
                 max_c = sh[0]
             if sh[1] > max_s:
@@ -1410,6 +1836,111 @@ class Viff(QtGui.QMainWindow):
     
         
 
+    def startInstanceServer(self):
+        """
+        Starts listening for files sent by further vini invocations.
+        """
+        if self.instance_server is not None:
+            return True
+        self.instance_server = InstanceServer(self)
+        if not self.instance_server.listen():
+            self.instance_server = None
+            return False
+        self.instance_server.sigOpenFiles.connect(self.openFilesFromInstance)
+        return True
+
+    def openFollowDirectory(self):
+        """
+        Asks for the directory an acquisition writes its volumes to.
+        """
+        directory = QtGui.QFileDialog.getExistingDirectory(
+            self, 'Follow acquisition', self.prefered_path)
+        if directory:
+            self.startFollowing(directory)
+
+    def startFollowing(self, path):
+        """
+        Shows the volumes matching 'path' (a directory or a glob pattern) as
+        one functional image and appends new volumes as they are written.
+        """
+        self.stopFollowing()
+        self.follow_image = None
+        self.frame_watcher = FrameWatcher(path, parent=self)
+        self.frame_watcher.sigNewFrames.connect(self.appendAcquiredFrames)
+        self.frame_watcher.start()
+
+    def stopFollowing(self):
+        if self.frame_watcher is not None:
+            self.frame_watcher.stop()
+            self.frame_watcher = None
+
+    def setFollowNewest(self, state):
+        self.follow_newest = state
+
+    def appendAcquiredFrames(self, frames, affine):
+        """
+        Adds volumes found by the frame watcher to the followed image.
+        """
+        if self.follow_image not in self.images:
+            # first volumes or the image was closed: start a new image
+            first = len(self.images) == 0
+            name = os.path.basename(self.frame_watcher.pattern.rstrip('/'))
+            self.loadImagesFromNumpy(
+                np.stack(frames, axis=-1), 'follow: ' + name, affine)
+            self.follow_image = self.images[0]
+            if first:
+                self.checkIf2DAndRemovePanes()
+            frames = []
+        else:
+            try:
+                self.follow_image.appendFrames(frames)
+            except ValueError as e:
+                print("Warning: volume skipped in follow mode: " + str(e))
+                return
+        if self.follow_image.getTimeDim() > self.time_dim:
+            self.time_dim = self.follow_image.getTimeDim()
+            self.frame_sld.setMaximum(self.time_dim-1)
+        if self.follow_newest and not self.playstate:
+            self.frame = self.time_dim - 1
+            self.setSliceStateOn()
+            self.setFrame()
+            self.setFrameToBox()
+            self.setFrameToSlider()
+            self.setSliceStateOff()
+        else:
+            self.follow_image.updateTimeData()
+
+    def openFilesFromInstance(self, filenames, z_filenames, func_filenames):
+        """
+        Loads the files handed over by another vini invocation.
+
+        Already loaded images keep their resampled data, if the common grid
+        does not change they are not resampled again.
+        """
+        file_list = []
+        type_list = []
+        for file_type, names in enumerate(
+                [filenames, z_filenames, func_filenames]):
+            # same order as on the command line
+            for filename in reversed(names):
+                if os.path.isfile(filename):
+                    file_list.append(filename)
+                    type_list.append(file_type)
+                else:
+                    print("Error: File doesn't exist: {}".format(filename))
+        if len(file_list) == 0:
+            return
+        if len(self.images) == 0:
+            self.loadImagesFromFiles(file_list, type_list)
+        else:
+            # read in the background while the images can be viewed
+            for filename, file_type in zip(file_list, type_list):
+                self.queueLoad(filename, file_type)
+        self.setWindowState(
+            self.windowState() & ~QtCore.Qt.WindowMinimized)
+        self.raise_()
+        self.activateWindow()
+
     def openNewFile(self):
         """
         Opens dialog for adding images.
@@ -1419,20 +1950,18 @@ class Viff(QtGui.QMainWindow):
         else:
             fnames = QtGui.QFileDialog.getOpenFileNames(
                 self, 'Open file', self.prefered_path)
-        # Go through list and add them one by one.
-        if fnames != []:
-            for filename in fnames:
-                # self.loadNewImage(unicode(filename))
-                if len(filename) > 0:
-                    if os.path.isfile(filename[0]):
-                        log2("openNewFile: filename {}".format(filename[0]))
-                        try:
-                            self.loadNewImage(filename[0])
-                        except:
-                            QtGui.QMessageBox.warning(self, "Warning", "Error: image could not be loaded")
-                            
-                            
-                                
+        # PyQt5 returns the filenames and the selected filter
+        if isinstance(fnames, tuple):
+            fnames = fnames[0]
+        # Go through list and queue them one by one, they are read in the
+        # background.
+        for filename in fnames:
+            filename = unicode(filename)
+            if os.path.isfile(filename):
+                log2("openNewFile: filename {}".format(filename))
+                self.prefered_path = "/".join(filename.split('/')[:-1])
+                self.queueLoad(filename)
+
 
     def deleteImage(self):
         """
@@ -1440,7 +1969,12 @@ class Viff(QtGui.QMainWindow):
 
         This will remove it from all lists.
         """
-        index = self.imagelist.currentRow()
+        self.deleteImageIndex(self.imagelist.currentRow())
+
+    def deleteImageIndex(self, index):
+        """
+        Removes the image with the given index from the viewer.
+        """
         if index >= 0:
             self.removeFromSliceWidgets(index)
             if self.states[index]:
@@ -1524,6 +2058,7 @@ class Viff(QtGui.QMainWindow):
         # +1 to avoid having a 0 in img_dims
 
         # resample
+        self.confirmMemoryBudget(self.img_dims)
         for img in self.images:
             # print("dims: {} affine {}".format(self.img_dims, self.affine))
             img.resample(shape = self.img_dims, affine = self.affine)
@@ -1542,6 +2077,7 @@ class Viff(QtGui.QMainWindow):
             self.affine = self.images[index].getAffine()
             self.img_dims = self.images[index].getOriginalDimensions()
             # resample
+            self.confirmMemoryBudget(self.img_dims)
             for img in self.images:
                 img.resample(shape = self.img_dims, affine = self.affine)
         else: # if for whatever reason the index is < 0 take first image.
@@ -1549,6 +2085,7 @@ class Viff(QtGui.QMainWindow):
                 self.affine = self.images[0].getAffine()
                 self.img_dims = self.images[0].getOriginalDimensions()
                 # resample
+                self.confirmMemoryBudget(self.img_dims)
                 for img in self.images:
                     img.resample(shape = self.img_dims, affine = self.affine)
 
@@ -1574,6 +2111,7 @@ class Viff(QtGui.QMainWindow):
 
         self.affine = np.eye(4)
 
+        self.confirmMemoryBudget(self.img_dims)
         iter_idx = 0
         for img in self.images:
             # Compute scaling and resample.
@@ -1609,19 +2147,31 @@ class Viff(QtGui.QMainWindow):
         self.forbid_mm = True
         self.voxel_button.setCheckable(False)
 
-    def reresample(self):
+    def reresample(self, deferred=False):
         """
         Reapplies the resampling.
 
         This is necessary if the interpolation method or the
         oversampling ratio are changed, or a new image is loaded.
+
+        With deferred=True the 3D images that have to be resampled are
+        resampled lazily first, their resampled data is computed in the
+        background (see refineImages).
         """
+        if deferred:
+            for img in self.images:
+                if img.lazy_capable and not img.lazy:
+                    img.deferred = True
         if self.transform_ind == 0:
             self.resampleToAffine()
         if self.transform_ind == 1:
             self.resampleToCurrent()
         if self.transform_ind == 2:
             self.resampleToFit()
+        # images that were already resampled to the grid
+        for img in self.images:
+            if img.deferred and not isinstance(img.image_res, ResampledGrid):
+                img.deferred = False
         self.resamplingAftermath()
 
     def resamplingAftermath(self):
@@ -1635,10 +2185,16 @@ class Viff(QtGui.QMainWindow):
         and reseting the views reasonably.
         """
         self.setSliceWidgetsDims()
+        # the windows belong to the old grid
+        self.plane_windows = [None, None, None]
+        for img in self.images:
+            img.setPlaneWindows(self.plane_windows)
         self.updateImageItems()
         self.setCrosshairPositionCenter()
         self.updateSelected()
         self.autoRange()
+        self.updateMemoryDialog()
+        self.refineImages()
 
     def getVoxelResolution(self):
         """
@@ -1718,6 +2274,88 @@ class Viff(QtGui.QMainWindow):
             mapped_xyz = np.dot(inv_code_map, xyz)
         return mapped_xyz
 
+    def queryCoordinates(self, coords, space='mm', interpolation='nearest',
+                         reference=None):
+        """
+        Returns the values of all images at N coordinates ((N, 3) array).
+
+        space: 'mm' for world coordinates, 'voxel' for voxel coordinates of
+            the image with index 'reference' (default: the selected image)
+            or 'grid' for coordinates of the resampled grid
+        interpolation: 'nearest' or 'trilinear'
+
+        The result has shape (N, number of images), or (N, number of images,
+        time_dim) if a 4D image is loaded; 3D values are then repeated over
+        time. Coordinates outside an image give NaN.
+        """
+        coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+        order = {'nearest': 0, 'trilinear': 1}[interpolation]
+        if space == 'mm':
+            to_grid = np.linalg.inv(self.affine)
+        elif space == 'voxel':
+            if reference is None:
+                reference = self.imagelist.currentRow()
+            to_grid = np.linalg.inv(self.images[reference].affine_res_inv)
+        elif space == 'grid':
+            to_grid = np.eye(4)
+        else:
+            raise ValueError("unknown coordinate space: {}".format(space))
+        has_time = any(img.type_d() == "4D" for img in self.images)
+        if has_time:
+            values = np.full(
+                (len(coords), len(self.images), self.time_dim), np.nan)
+        else:
+            values = np.full((len(coords), len(self.images)), np.nan)
+        for i, img in enumerate(self.images):
+            # one combined mapping from the given space to image voxels
+            mapping = np.dot(img.affine_res_inv, to_grid)
+            sampled = img.sampleCoordinates(coords, order, mapping)
+            if not has_time:
+                values[:,i] = sampled
+            elif sampled.ndim == 1:
+                values[:,i,:] = sampled[:,np.newaxis]
+            else:
+                values[:,i,:sampled.shape[1]] = sampled
+        return values
+
+    def queryCoordinatesFromFile(self):
+        """
+        Asks for a coordinate table, samples all images there and saves the
+        values as CSV.
+        """
+        if len(self.images) == 0:
+            return
+        filename = QtGui.QFileDialog.getOpenFileName(
+            self, 'Open coordinate table', self.prefered_path,
+            'Tables (*.csv *.tsv *.txt);;All files (*)')[0]
+        if not filename:
+            return
+        coords = readCoordinates(filename)
+        if len(coords) == 0:
+            QtGui.QMessageBox.warning(self, "Warning",
+                "Error: no x, y, z coordinates found in " + filename)
+            return
+        space, ok = QtGui.QInputDialog.getItem(
+            self, 'Coordinate table', 'Coordinates are given in:',
+            ['mm', 'voxel (selected image)'], 0 if not self.voxel_coord else 1,
+            False)
+        if not ok:
+            return
+        interpolation, ok = QtGui.QInputDialog.getItem(
+            self, 'Coordinate table', 'Interpolation:',
+            ['nearest', 'trilinear'], 0, False)
+        if not ok:
+            return
+        values = self.queryCoordinates(
+            coords, space.split()[0], interpolation)
+        out = QtGui.QFileDialog.getSaveFileName(
+            self, 'Save values', os.path.splitext(filename)[0] +
+            '_values.csv', 'CSV (*.csv)')[0]
+        if out:
+            names = [self.imagelist.item(i).text()
+                     for i in range(len(self.images))]
+            writeValues(out, coords, names, values)
+
     def setOSRatio(self):
         """
         Opens the dialog to set the oversampling ratio.
@@ -1730,7 +2368,7 @@ class Viff(QtGui.QMainWindow):
 
         def save():
             if testFloat(ratio_le.text()):
-                self.preferences['os_ratio'][0] = float(ratio_le.text())
+                self.preferences['os_ratio'] = float(ratio_le.text())
             self.os_setting.close()
 
         ratio_le.returnPressed.connect(save)
@@ -2043,6 +2681,7 @@ class Viff(QtGui.QMainWindow):
         """
         # Reset img_coord if out of bounds
         self.moveCrosshairIntoImage()
+        self.updateCorrelation()
         # Reslice the images
         self.updateSlices()
         self.updateImageItems()
@@ -2143,6 +2782,121 @@ class Viff(QtGui.QMainWindow):
             if self.slice_focus == 't':
                 self.t_slice_widget.zoomIn()
 
+    ## Section: Viewports ##
+    def connectDetail(self, widget):
+        """
+        Updates the sliced windows when the view of a SliceWidget changes.
+        """
+        widget.sb.sigRangeChanged.connect(self.scheduleDetail)
+        widget.sb.sigResized.connect(self.scheduleDetail)
+
+    def scheduleDetail(self, *args):
+        # not restarted while pending, so that it also fires while panning
+        if not self.detail_timer.isActive():
+            self.detail_timer.start()
+
+    def planeWidgets(self, plane):
+        """
+        Returns the visible SliceWidgets showing a plane (0: sagittal,
+        1: coronal, 2: transverse).
+        """
+        name = ['s', 'c', 't'][plane]
+        widgets = [getattr(self, name + '_slice_widget'),
+                   self.slice_popouts[[1, 0, 2][plane]].sw]
+        widgets += [getattr(window, 'sw_' + name)
+                    for window in self.extra_windows]
+        return [widget for widget in widgets if widget.isVisible()]
+
+    def planeView(self, plane):
+        """
+        Returns the part of a plane visible in any of its views as
+        [x0, x1, y0, y1] in voxels of the resampled grid and the largest
+        number of device pixels per voxel, or None if it is not shown.
+        """
+        visible = None
+        pixels = 0
+        for widget in self.planeWidgets(plane):
+            rect = widget.sb.viewRect()
+            if rect.width() <= 0 or rect.height() <= 0:
+                continue
+            ratio = widget.devicePixelRatioF()
+            pixels = max(pixels, ratio * widget.sb.width() / rect.width(),
+                         ratio * widget.sb.height() / rect.height())
+            bounds = [rect.left(), rect.right(), rect.top(), rect.bottom()]
+            if visible is None:
+                visible = bounds
+            else:
+                visible = [min(visible[0], bounds[0]),
+                           max(visible[1], bounds[1]),
+                           min(visible[2], bounds[2]),
+                           max(visible[3], bounds[3])]
+        if visible is None:
+            return None
+        return visible, pixels
+
+    def planeWindow(self, plane, current):
+        """
+        Returns the window of a plane to slice: the visible part with a
+        margin of half its size on every side, sampled with about one voxel
+        per device pixel. None stands for the whole plane at full resolution.
+
+        The current window is kept as long as it covers the visible part at
+        a similar resolution and is not much larger, so that panning and
+        zooming only slice again now and then.
+        """
+        view = self.planeView(plane)
+        if view is None:
+            return current
+        (x0, x1, y0, y1), pixels = view
+        shape = [int(n) for axis, n in enumerate(self.img_dims)
+                 if axis != plane]
+        x0, x1 = max(x0, 0), min(x1, shape[0])
+        y0, y1 = max(y0, 0), min(y1, shape[1])
+        if x1 <= x0 or y1 <= y0 or pixels <= 0:
+            return current
+        # voxels per device pixel
+        ideal = 1.0 / pixels
+        if current is not None:
+            first0, last0, first1, last1, step = current
+            if (first0 <= x0 and last0 >= x1 and first1 <= y0 and
+                    last1 >= y1 and ideal / 2 <= step <= max(1, 1.5 * ideal)
+                    and (last0 - first0) * (last1 - first1) <=
+                    9 * (x1 - x0) * (y1 - y0)):
+                return current
+        step = max(1, int(round(ideal)))
+        margin0, margin1 = (x1 - x0) / 2., (y1 - y0) / 2.
+        # aligned to the step, so that windows sample the same voxels
+        first0 = max(0, int(np.floor((x0 - margin0) / step)) * step)
+        first1 = max(0, int(np.floor((y0 - margin1) / step)) * step)
+        last0 = min(shape[0], int(np.ceil(x1 + margin0)))
+        last1 = min(shape[1], int(np.ceil(y1 + margin1)))
+        if (first0, last0, first1, last1, step) == (0, shape[0], 0, shape[1], 1):
+            return None
+        return (first0, last0, first1, last1, step)
+
+    def updateDetail(self):
+        """
+        Sets the windows of the planes to what the views show and the level
+        of detail of out-of-core images to their zoom, and slices the planes
+        that changed again. The cost of slicing then depends on the size of
+        the views, not on the size of the data.
+        """
+        pixels = [0, 0, 0]
+        for plane in range(3):
+            self.plane_windows[plane] = self.planeWindow(
+                plane, self.plane_windows[plane])
+            view = self.planeView(plane)
+            if view is not None:
+                pixels[plane] = view[1]
+        for index, img in enumerate(self.images):
+            changed = img.setPlaneWindows(self.plane_windows)
+            if isinstance(img, BrickedImage3D):
+                changed = [img.setDetail(plane, pixels[plane]) or changed[plane]
+                           for plane in range(3)]
+            if any(changed) and img.getState():
+                img.slice()
+                self.updateImageItem(index)
+
     ## Section: Updating the Slices ##
     def updateImages(self):
         self.updateSlices()
@@ -2161,28 +2915,30 @@ class Viff(QtGui.QMainWindow):
         Resets the image arrays of all ImageItemMods.
         """
         # treat original vini separately
-        mode = self.images[index].mode
-        for window in range(len(self.image_window_list[index])):
-            if self.image_window_list[index][window][0] is not None:
-                # attention: order of indies change
-                self.image_window_list[index][window][0].setImage(
-                    self.images[index].getImageArrays()[1])
-                self.image_window_list[index][window][1].setImage(
-                    self.images[index].getImageArrays()[0])
-                self.image_window_list[index][window][2].setImage(
-                    self.images[index].getImageArrays()[2])
-                for i in range(3):
-                    self.image_window_list[index][window][i] \
-                        .setCompositionMode(mode)
+        img = self.images[index]
+        if img.plane_windows != self.plane_windows:
+            # e.g. a new image, slice it with the windows of the views
+            self.scheduleDetail()
+        mode = img.mode
+        arrays = img.getImageArrays()
+        # The arrays may only cover part of their plane.
+        rects = [None if rect is None else QtCore.QRectF(*rect)
+                 for rect in img.getImageRects()]
+        # All items showing a plane share its levels and rendered QImage.
+        cache = img.render_cache
+        items = [self.image_window_list[index][window]
+                 for window in range(len(self.image_window_list[index]))
+                 if self.image_window_list[index][window][0] is not None]
         if self.popouts_ii[index][0] is not None:
-            self.popouts_ii[index][0].setImage(
-                self.images[index].getImageArrays()[1])
-            self.popouts_ii[index][1].setImage(
-                self.images[index].getImageArrays()[0])
-            self.popouts_ii[index][2].setImage(
-                self.images[index].getImageArrays()[2])
-            for i in range(3):
-                self.popouts_ii[index][i].setCompositionMode(mode)
+            items.append(self.popouts_ii[index])
+        for item_list in items:
+            # attention: order of indies change
+            for i, plane in enumerate([1, 0, 2]):
+                item_list[i].setImage(
+                    arrays[plane], render_cache=(cache, plane))
+                if rects[plane] is not None:
+                    item_list[i].setRect(rects[plane])
+                item_list[i].setCompositionMode(mode)
 
     def resetZValues(self):
         """
@@ -2603,10 +3359,15 @@ class Viff(QtGui.QMainWindow):
         window.sw_c.sigMouseOver.connect(self.MouseMoved)
         window.sw_s.sigMouseOver.connect(self.MouseMoved)
         window.sw_t.sigMouseOver.connect(self.MouseMoved)
+        # connect zooming for the level of detail
+        self.connectDetail(window.sw_c)
+        self.connectDetail(window.sw_s)
+        self.connectDetail(window.sw_t)
 
         self.updateImageItem(index)
         window_number = len(self.extra_windows)
         self.addToSliceWidget(index, window_number)
+        self.setSliceWidgetsDims()
 
         if self.link_mode:
             window.sw_c.sb.setXLink(window.sw_t.sb)
@@ -2821,6 +3582,9 @@ class Viff(QtGui.QMainWindow):
             self.time_dim = 1
             self.setFrameToBox()
             self.setFrameToSlider()
+        if self.quality_image is not None and \
+                self.quality_image not in self.images:
+            self.stopQualityTraces()
 
     def enableFuncView(self, state=True):
         """
@@ -2943,8 +3707,82 @@ class Viff(QtGui.QMainWindow):
                     if self.images[i].type_d() == "4D":
                         self.images[i].setPlaying(True)
                 self.play_button.setIcon(self.icon_pause)
+                self.preparePlayback()
                 self.playingFunc()
 
+    def preparePlayback(self):
+        """
+        Computes in the background the planes through the crosshair of all
+        frames of the shown 4D images, so that playing them back needs no
+        resampling (see Image4D.stackedSlice).
+        """
+        pending = list(self.stacks_queue)
+        if self.stacks_thread is not None:
+            # replaced when done if the crosshair moved meanwhile
+            pending.append(self.stacks_thread.img)
+        for i, img in enumerate(self.images):
+            if img.type_d() != "4D" or not self.states[i] or img in pending:
+                continue
+            if img.interp_type > 1:
+                # the stacks are sampled linearly at most, spline
+                # interpolated frames are resampled when shown
+                continue
+            if img.plane_stacks_key != img.planeStacksKey(
+                    self.img_dims, self.affine):
+                self.stacks_queue.append(img)
+        self.prepareNextStacks()
+
+    def prepareNextStacks(self):
+        """
+        Starts computing the planes of the next image of 'stacks_queue'.
+
+        The planes are colored in advance if they fit into the memory
+        budget. Images whose planes don't fit at all are played back by
+        resampling the planes of every frame.
+        """
+        if self.stacks_thread is not None:
+            return
+        budget = self.memoryBudget()
+        while len(self.stacks_queue) > 0:
+            img = self.stacks_queue.pop(0)
+            if img not in self.images:
+                continue
+            colored = True
+            if budget is not None:
+                used = sum(sum(memory.values())
+                           for memory in self.memoryUsage())
+                if used + img.planeStacksBytes(self.img_dims) > budget:
+                    colored = False
+                    if used + img.planeStacksBytes(
+                            self.img_dims, False) > budget:
+                        continue
+            name = self.imagelist.item(self.images.index(img)).text()
+            self.stacks_thread = StacksThread(
+                img, img.planeStacksKey(self.img_dims, self.affine),
+                img.planeStacksArgs(self.img_dims, self.affine, colored),
+                name)
+            self.stacks_thread.sigProgress.connect(self.updateLoadProgress)
+            self.stacks_thread.sigFinished.connect(self.playbackPrepared)
+            self.stacks_thread.start()
+            break
+        self.updateLoadProgress()
+
+    def playbackPrepared(self, result):
+        """
+        Hands the planes computed by prepareNextStacks to their image.
+        """
+        thread = self.stacks_thread
+        thread.wait()
+        self.stacks_thread = None
+        img = thread.img
+        if isinstance(result, Exception):
+            print("Cannot prepare the playback of {}: {}".format(
+                thread.name, result))
+        elif result is not None and img in self.images and \
+                thread.key == img.planeStacksKey(self.img_dims, self.affine):
+            img.setPlaneStacks(result, thread.key)
+        self.prepareNextStacks()
+
     def playFuncReleased(self):
         if self.func_enabled:
             if self.playstate == False:
@@ -2986,6 +3824,7 @@ class Viff(QtGui.QMainWindow):
                 self.setFrameToBox()
                 self.setFrameToSlider()
 
+    @traced('setFrame')
     def setFrame(self):
         """
         Updates all functional image items to display the correct frame.
@@ -3005,8 +3844,12 @@ class Viff(QtGui.QMainWindow):
             if self.images[i].type_d() == "4D":
                 self.images[i].setFrame(self.frame) # only set the variable
                 if self.playstate or self.slicestate:
-                    # resample only slices
-                    self.images[i].resample_slice(shape=self.img_dims, affine=self.affine)
+                    # planes computed for playback, or resample only slices
+                    if not self.images[i].stackedSlice(
+                            self.img_dims, self.affine):
+                        self.images[i].resample_slice(shape=self.img_dims, affine=self.affine)
+                        if self.playstate:
+                            self.preparePlayback()
                     self.updateImageItem(i)
                 else:
                     # resample whole frame and slice
@@ -3019,6 +3862,8 @@ class Viff(QtGui.QMainWindow):
                     self.updateImageItem(i)
         self.setFrameToBox()
         self.setFrameToSlider()
+        if self.quality_image is not None:
+            self.quality_plot.setFrame(self.frame)
         self.updateCrossIntensityLabel()
         self.refreshMosaicView()
         log1("setFrame called (self.frame {})".format(self.frame))
@@ -3077,6 +3922,13 @@ class Viff(QtGui.QMainWindow):
         
 
 
+    def jumpToFrame(self, frame):
+        """
+        Shows the frame 'frame', e.g. clicked in the quality traces.
+        """
+        self.frame = frame
+        self.setFrame()
+
     def setFrameFromSlider(self):
         """
         Takes the slider frame value and resets the current frame.
@@ -3345,11 +4197,223 @@ class Viff(QtGui.QMainWindow):
         index = self.imagelist.currentRow()
         if index >= 0:
             if self.images[index].type_d() == "4D":
-                self.images[index].openFuncDialog()
+                self.setRoiMasks(index)
+                img = self.images[index]
+                # the dialog computes the average volumes of this image
+                try:
+                    img.funcdialog.sigComputeVolumes.disconnect()
+                except TypeError:
+                    pass
+                img.funcdialog.sigComputeVolumes.connect(
+                    lambda img=img: self.computeConditionVolumes(img))
+                img.openFuncDialog()
             else:
                 QtGui.QMessageBox.warning(
                     self, "Warning", "Error: 3D image has no time data!")
 
+    def computeConditionVolumes(self, img):
+        """
+        Computes in the background the trial averages of all voxels of the
+        4D image 'img' for the conditions of its design file and adds them
+        as one 4D image per condition.
+        """
+        if img not in self.images:
+            return
+        if img.design is None:
+            QtGui.QMessageBox.warning(
+                img.funcdialog, "Warning", "Error: No design file was loaded.")
+            return
+        if self.average_thread is not None:
+            QtGui.QMessageBox.warning(
+                img.funcdialog, "Warning",
+                "Error: Averages are already being computed.")
+            return
+        times, conds, matrices = img.conditionAverageMatrices()
+        if len(conds) == 0 or len(times) == 0:
+            QtGui.QMessageBox.warning(
+                img.funcdialog, "Warning",
+                "Error: No condition or time point to average.")
+            return
+        rows, order = img.voxelRows()
+        name = self.imagelist.item(self.images.index(img)).text()
+        self.average_thread = AverageThread(rows, matrices, name)
+        # what is needed to add the averages as images
+        self.average_thread.volumes = (img, times, conds, order)
+        self.average_thread.sigProgress.connect(self.updateLoadProgress)
+        self.average_thread.sigFinished.connect(self.conditionVolumesComputed)
+        self.average_thread.start()
+        self.updateLoadProgress()
+
+    def conditionVolumesComputed(self, result):
+        """
+        Adds the averages computed by computeConditionVolumes as images.
+        """
+        thread = self.average_thread
+        thread.wait()
+        self.average_thread = None
+        img, times, conds, order = thread.volumes
+        if isinstance(result, Exception):
+            print("Cannot average the trials of {}: {}".format(
+                thread.name, result))
+            QtGui.QMessageBox.warning(
+                self, "Warning",
+                "Error: trial averages could not be computed: {}".format(
+                    result))
+        elif result is not None:
+            shape = img.image.shape[:3]
+            step = times[1] - times[0] if len(times) > 1 else \
+                img.funcdialog.cond_dx
+            for cond, averages in zip(conds, result):
+                self.loadImagesFromNumpy(
+                    averages.reshape(shape + (len(times),), order=order),
+                    "{} condition {}".format(thread.name, cond),
+                    img.image.affine)
+                # time between the peri-stimulus time points
+                self.images[0].frame_time = step
+        self.updateLoadProgress()
+
+    def computeStatistics(self):
+        """
+        Adds the temporal mean, standard deviation, tSNR, minimum and
+        maximum of the selected 4D image as 3D images.
+
+        They are computed in the background and cached next to the file of
+        the image, so that they are added right away the next time.
+        """
+        index = self.imagelist.currentRow()
+        if index < 0 or self.images[index].type_d() != "4D":
+            QtGui.QMessageBox.warning(
+                self, "Warning", "Error: Select a 4D image first.")
+            return
+        if self.statistics_thread is not None:
+            QtGui.QMessageBox.warning(
+                self, "Warning",
+                "Error: Statistics are already being computed.")
+            return
+        img = self.images[index]
+        name = self.imagelist.item(index).text()
+        data = img.image.get_data()
+        filename = getattr(img, 'filename', None)
+        if filename is None or not os.path.isfile(filename):
+            filename = None
+        else:
+            statistics = loadStatistics(filename, data.shape)
+            if statistics is not None:
+                self.addStatistics(statistics, name, img.image.affine)
+                return
+        self.statistics_thread = StatisticsThread(data, name, filename)
+        self.statistics_thread.affine = img.image.affine
+        self.statistics_thread.sigProgress.connect(self.updateLoadProgress)
+        self.statistics_thread.sigFinished.connect(self.statisticsComputed)
+        self.statistics_thread.start()
+        self.updateLoadProgress()
+
+    def statisticsComputed(self, result):
+        """
+        Adds the statistics computed by computeStatistics as images.
+        """
+        thread = self.statistics_thread
+        thread.wait()
+        self.statistics_thread = None
+        if isinstance(result, Exception):
+            print("Cannot compute the statistics of {}: {}".format(
+                thread.name, result))
+            QtGui.QMessageBox.warning(
+                self, "Warning",
+                "Error: statistics could not be computed: {}".format(result))
+        elif result is not None:
+            self.addStatistics(result, thread.name, thread.affine)
+        self.updateLoadProgress()
+
+    def addStatistics(self, statistics, name, affine):
+        """
+        Adds the volumes of 'statistics' of the image 'name' as images, the
+        mean on top.
+        """
+        for statistic in reversed(STATISTICS):
+            self.loadImagesFromNumpy(
+                statistics[statistic], "{} {}".format(name, statistic),
+                affine)
+
+    def toggleQualityTraces(self, state):
+        """
+        Shows or hides the global mean, DVARS and outlier score of the frames
+        of the selected 4D image under the frame slider. They are computed
+        in the background.
+        """
+        if not state:
+            self.stopQualityTraces()
+            return
+        index = self.imagelist.currentRow()
+        if index < 0 or self.images[index].type_d() != "4D":
+            QtGui.QMessageBox.warning(
+                self, "Warning", "Error: Select a 4D image first.")
+            self.stopQualityTraces()
+            return
+        if self.quality_thread is not None:
+            # stops after the current frame
+            self.quality_thread.cancel()
+            self.quality_thread.wait()
+        img = self.images[index]
+        name = self.imagelist.item(index).text()
+        self.quality_thread = TracesThread(img.image.get_data(), name)
+        self.quality_thread.img = img
+        self.quality_thread.sigProgress.connect(self.updateLoadProgress)
+        self.quality_thread.sigFinished.connect(self.qualityTracesComputed)
+        self.quality_thread.start()
+        self.updateLoadProgress()
+
+    def qualityTracesComputed(self, result):
+        """
+        Shows the traces computed for toggleQualityTraces.
+        """
+        thread = self.quality_thread
+        if thread is None or self.sender() is not thread:
+            # from a thread replaced by toggleQualityTraces
+            return
+        thread.wait()
+        self.quality_thread = None
+        if isinstance(result, Exception):
+            print("Cannot compute the quality traces of {}: {}".format(
+                thread.name, result))
+            QtGui.QMessageBox.warning(
+                self, "Warning",
+                "Error: quality traces could not be computed: {}".format(
+                    result))
+            self.stopQualityTraces()
+        elif result is None or thread.img not in self.images:
+            self.stopQualityTraces()
+        else:
+            self.quality_image = thread.img
+            self.quality_plot.setFrame(self.frame)
+            self.quality_plot.setTraces(result)
+            self.quality_plot.show()
+        self.updateLoadProgress()
+
+    def stopQualityTraces(self):
+        """
+        Hides the quality traces.
+        """
+        if self.quality_thread is not None:
+            self.quality_thread.cancel()
+        self.quality_image = None
+        self.quality_plot.hide()
+        self.quality_action.blockSignals(True)
+        self.quality_action.setChecked(False)
+        self.quality_action.blockSignals(False)
+
+    def setRoiMasks(self, index):
+        """
+        Offers the loaded 3D images as time course masks of a 4D image.
+        """
+        masks = []
+        names = []
+        for i in range(len(self.images)):
+            if self.images[i].type_d() == "3D":
+                masks.append(self.images[i])
+                names.append(self.imagelist.item(i).text())
+        self.images[index].setRoiMasks(masks, names)
+
     def openTimeSeries(self):
         """
         Opens window to display the time series of the crosshair voxel.
@@ -3358,6 +4422,7 @@ class Viff(QtGui.QMainWindow):
         if index >= 0:
             if self.images[index].type_d() == "4D":
                 pos = (self.preferences['ts_posx'], self.preferences['ts_posy'], self.preferences['ts_width'], self.preferences['ts_height'])
+                self.setRoiMasks(index)
                 self.images[index].showTimeSeries(pos)
             else:
                 QtGui.QMessageBox.warning(self, "Warning",
@@ -3377,6 +4442,212 @@ class Viff(QtGui.QMainWindow):
 
 
     ## Section: Tools Related ##
+    def togglePerformanceOverlay(self, state):
+        """
+        Shows or hides the frame rate and stage latencies over the views.
+        """
+        self.performance_overlay.setActive(state)
+
+    def toggleCorrelation(self, state):
+        """
+        Starts or stops showing the correlation of all voxels of the current
+        4D image with the time course at the crosshair as overlay.
+
+        The time course is that of the region chosen in the functional image
+        settings. If a mask image is selected there, only the voxels under
+        the mask are correlated.
+        """
+        if not state:
+            self.stopCorrelation()
+            return
+        index = self.imagelist.currentRow()
+        if index < 0 or self.images[index].type_d() != "4D":
+            QtGui.QMessageBox.warning(
+                self, "Warning", "Error: Select a 4D image first.")
+            self.correlation_action.setChecked(False)
+            return
+        if self.correlation is not None:
+            self.correlation[1].close()
+            self.correlation = None
+        img = self.images[index]
+        name = self.imagelist.item(index).text()
+        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            rows, order = img.voxelRows()
+            indices = None
+            if img.roi_mask is not None and img.roi_mask in self.images:
+                indices = img.maskIndices(img.roi_mask, order)
+            engine = CorrelationEngine(
+                rows, img.image.shape[:3], order, indices)
+            voxel = img.crosshairVoxel(self.img_coord)
+            overlay = loadImageFromNumpy(
+                engine.correlate(img.timeCourse(voxel)), self.preferences,
+                1, img.image.affine)
+        finally:
+            QtGui.QApplication.restoreOverrideCursor()
+        # correlations from 0.3 on are shown
+        overlay.setPosThresholds([0.3, 1.0])
+        overlay.setNegThresholds([-1.0, -0.3])
+        # the map changes with every move of the crosshair, only the
+        # displayed planes are resampled
+        overlay.setLazy(True, resample=False)
+        overlay.filename = "{} correlation".format(name)
+        self.correlation = (img, engine, overlay, voxel)
+        self.addNewImage(overlay, overlay.filename)
+
+    def stopCorrelation(self):
+        """
+        Stops updating the correlation map, which stays loaded.
+        """
+        if self.correlation is not None:
+            self.correlation[1].close()
+            self.correlation = None
+        self.correlation_action.blockSignals(True)
+        self.correlation_action.setChecked(False)
+        self.correlation_action.blockSignals(False)
+
+    @traced('updateCorrelation')
+    def updateCorrelation(self):
+        """
+        Recomputes the correlation map for the time course at the crosshair.
+        """
+        if self.correlation is None:
+            return
+        img, engine, overlay, voxel = self.correlation
+        if img not in self.images or overlay not in self.images:
+            self.stopCorrelation()
+            return
+        new_voxel = img.crosshairVoxel(self.img_coord)
+        if new_voxel == voxel:
+            return
+        self.correlation = (img, engine, overlay, new_voxel)
+        overlay.replaceData(Nifti2Image(
+            engine.correlate(img.timeCourse(new_voxel)),
+            overlay.image.affine))
+        overlay.reresample()
+        if self.images.index(overlay) == self.imagelist.currentRow():
+            self.updateSelected()
+
+    def openMemoryDialog(self):
+        """
+        Opens the panel listing the memory held by each image.
+        """
+        self.memory_dialog.show()
+        self.memory_dialog.raise_()
+        self.updateMemoryDialog()
+
+    def memoryUsage(self):
+        """
+        Returns the memory held by each image per category (see
+        MemoryUsage.imageMemory). Buffers shared between images are counted
+        for the first one only.
+        """
+        counter = MemoryCounter()
+        usage = []
+        for index, img in enumerate(self.images):
+            items = [item for window in self.image_window_list[index]
+                     for item in window]
+            items += self.popouts_ii[index]
+            usage.append(imageMemory(img, items, counter))
+        return usage
+
+    def memoryBudget(self):
+        """
+        Returns the memory budget in bytes, None if there is none.
+        """
+        if self.preferences['memory_budget'] > 0:
+            return int(self.preferences['memory_budget'] * 2**30)
+        physical = systemMemory()
+        if physical is None:
+            return None
+        return physical * 3 // 4
+
+    def updateMemoryDialog(self):
+        if not self.memory_dialog.isVisible():
+            return
+        names = [self.imagelist.item(i).text()
+                 for i in range(len(self.images))]
+        self.memory_dialog.setRows(
+            names, self.memoryUsage(), [img.lazy for img in self.images],
+            [img.lazy_capable for img in self.images],
+            self.preferences['memory_budget'], self.memoryBudget())
+
+    def setImageLazy(self, index, state):
+        """
+        Switches lazy resampling of an image on or off.
+        """
+        img = self.images[index]
+        img.setLazy(state)
+        img.slice(np.asarray(self.img_coord).astype(np.int32))
+        self.updateImageItem(index)
+        self.updateMemoryDialog()
+        self.refineImages()
+
+    def releaseCaches(self):
+        for img in self.images:
+            img.releaseCaches()
+        self.updateMemoryDialog()
+
+    def setMemoryBudget(self, budget):
+        self.preferences['memory_budget'] = budget
+        self.savePreferences()
+        self.updateMemoryDialog()
+
+    def confirmMemoryBudget(self, shape):
+        """
+        Asks before resampling all images to 'shape' if the images would then
+        hold more memory than the budget. The user can switch the 3D images
+        to lazy mode instead.
+        """
+        budget = self.memoryBudget()
+        if budget is None or len(self.images) == 0:
+            return
+        usage = self.memoryUsage()
+        resampled = sum(img.resampledBytes(shape) for img in self.images)
+        total = sum(sum(memory.values()) - memory['resampled']
+                    for memory in usage) + resampled
+        if total <= budget:
+            return
+        lazy = [img for img in self.images
+                if img.lazy_capable and not img.lazy]
+        text = ("Resampling to {} voxels needs {} for the resampled data, "
+                "the images would then hold {}. This is more than the memory "
+                "budget of {} (Tools/Memory usage...).").format(
+                    " x ".join(str(int(n)) for n in shape),
+                    formatBytes(resampled), formatBytes(total),
+                    formatBytes(budget))
+        box = QtGui.QMessageBox(QtGui.QMessageBox.Warning, "Memory budget",
+                                text, parent=self)
+        if len(lazy) > 0:
+            box.setInformativeText(
+                "In lazy mode 3D images are only resampled where they are "
+                "displayed.")
+            lazy_button = box.addButton(
+                "Resample lazily", QtGui.QMessageBox.AcceptRole)
+        box.addButton("Resample anyway", QtGui.QMessageBox.RejectRole)
+        box.exec_()
+        if len(lazy) > 0 and box.clickedButton() is lazy_button:
+            for img in lazy:
+                img.setLazy(True, resample=False)
+
+    def saveTrace(self):
+        """
+        Saves the recorded stages of the display pipeline as Chrome trace
+        (open in chrome://tracing or https://ui.perfetto.dev).
+        """
+        if len(tracer.events) == 0:
+            QtGui.QMessageBox.information(self, "Performance trace",
+                "Nothing recorded. Stages are recorded while the performance "
+                "overlay is shown or if vini is started with VINI_TRACE set "
+                "to a filename.")
+            return
+        filename = QtGui.QFileDialog.getSaveFileName(
+            self, 'Save performance trace', self.prefered_path,
+            'Chrome trace (*.json)')[0]
+        if not filename:
+            return
+        tracer.save(filename)
+
     def openQtConsoleWindow(self):
         from qtconsole.jupyter_widget import JupyterWidget
         """
@@ -3602,6 +4873,7 @@ class Viff(QtGui.QMainWindow):
                     self.mosaic_view.viewboxes[coord_ind].addItem(img)
         self.mosaic_view.show()
 
+    @traced('refreshMosaicView')
     def refreshMosaicView(self):
         """
         Refreshes mosaic view window with the specified values.
@@ -3641,8 +4913,9 @@ class Viff(QtGui.QMainWindow):
         """
         exports the current view and colorbar
         """
-        # self = viewer
-        # from pyqtgraph_vini.exporters import ImageExporter
+        # exporters and matplotlib are only needed here
+        from .pyqtgraph_vini.exporters import ImageExporter
+        from matplotlib.image import imsave
         
         filename = QtGui.QFileDialog.getSaveFileName(self, 'Export Images')[0]
         dp_write = os.path.split(filename)[0]
@@ -3789,6 +5062,8 @@ class Viff(QtGui.QMainWindow):
             'res_method': 0, # (0 - affine, 1 - image, 2 - fit)
             'interpolation': 1,
             'os_ratio': 1.0,
+            # warn before resampling beyond this (GB, 0: 3/4 of the RAM)
+            'memory_budget': 0.0,
 
             # search
             'search_radius': 5
@@ -3801,7 +5076,7 @@ class Viff(QtGui.QMainWindow):
         list_bools = ['voxel_coord', 'clip_under_high', 'clip_under_low', 'clip_pos_high', 'clip_pos_low', 'clip_neg_high', 'clip_neg_low']
         list_ints = ['link_mode', 'window_width', 'window_height', 'window_posx', 'window_posy', 'hist_width', 'hist_height', 'hist_posx', 'hist_posy', 
                      'ts_width', 'ts_height', 'ts_posx', 'ts_posy','interpolation', 'res_method', 'search_radius']
-        list_floats = ['os_ratio']
+        list_floats = ['os_ratio', 'memory_budget']
         list_strings = ['cm_under', 'cm_pos', 'cm_neg']
         
         for xs in settings.allKeys():
@@ -3901,6 +5176,22 @@ class Viff(QtGui.QMainWindow):
             self.hist.hide()
         if self.mosaic_view is not None:
             self.mosaic_view.hide()
+        if self.instance_server is not None:
+            self.instance_server.close()
+        self.stopFollowing()
+        self.cancelLoads()
+        if self.load_thread is not None:
+            self.load_thread.wait()
+        if self.average_thread is not None:
+            self.average_thread.wait()
+        if self.statistics_thread is not None:
+            self.statistics_thread.wait()
+        if self.quality_thread is not None:
+            self.quality_thread.wait()
+        if self.stacks_thread is not None:
+            self.stacks_thread.wait()
+        if self.refine_thread is not None:
+            self.refine_thread.wait()
 
 
 def main():
@@ -3922,6 +5213,12 @@ def main():
                         help = "specify a functional image", type=str)
     parser.add_argument('-l', action='store_true', default=False,
                         dest='linked', help='Set linked views to true')
+    parser.add_argument('-s', '--single', action='store_true', default=False,
+                        dest='single', help='open the files in a running \
+                        viewer started with -s, if there is one')
+    parser.add_argument('--follow', metavar='PATH', default=None,
+                        help='show the volumes written to a directory (or \
+                        matching a glob pattern) as they arrive')
 
 
     # parser.add_argument("files",nargs="*") 
@@ -3947,7 +5244,15 @@ def main():
 
     # Initialize QT app GUI and setup the layout.
     app = QtGui.QApplication([])
+
+    # Hand the files over to a running viewer.
+    if args.single:
+        if sendToRunningInstance(filenames, z_filenames, func_filenames):
+            sys.exit(0)
+
     viewer = Viff()
+    if args.single:
+        viewer.startInstanceServer()
 
     # change order of the images being loaded to be more intuitive
     filenames.reverse()
@@ -4031,7 +5336,8 @@ def main():
         if file_list is not None:
             viewer.loadImagesFromFiles(file_list, type_list)
 
-        
+    if args.follow is not None:
+        viewer.startFollowing(args.follow)
 
     sys.exit(app.exec_())
 
@@ -4041,15 +5347,22 @@ def main():
 #     viewer.show()
 #     app.exec_()
 
-def show(*argv):
+def show(*argv, **kwargs):
     """ 
     use this function to visualize numpy arrays. can handle multiple arguments, e.g.
     vini.show(a,b,c)
     where a,b,c are numpy arrays.
+
+    With block=False the arrays are shown in a viewer running in the
+    background and vini.show returns right away with a handle (a list of
+    handles for several arrays) to update, replace or close the images, e.g.
+    h = vini.show(a, block=False)
+    h.update(b)
     """
-    app = QtGui.QApplication([])
-    viewer = Viff()
-    
+    block = kwargs.pop('block', True)
+    if kwargs:
+        raise TypeError("unexpected keyword arguments: " + ", ".join(kwargs))
+
     #attempt to get array name...
     try:
         stack = traceback.extract_stack()
@@ -4061,7 +5374,18 @@ def show(*argv):
             itemname = itemname.split(",")
     except:
         itemname = ["array {}".format(i) for i in range(len(argv))]
-    
+    itemname = [name.strip() for name in itemname if '=' not in name]
+    if len(itemname) != len(argv):
+        itemname = ["array {}".format(i) for i in range(len(argv))]
+
+    if not block:
+        from .RemoteViewer import showRemote
+        handles = showRemote(argv, itemname)
+        return handles[0] if len(handles) == 1 else handles
+
+    app = QtGui.QApplication([])
+    viewer = Viff()
+
     for i,arg in enumerate(argv):
         viewer.loadImagesFromNumpy(arg, itemname[i])
     viewer.checkIf2DAndRemovePanes()